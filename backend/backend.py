@@ -1,13 +1,19 @@
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, status
+from fastapi import FastAPI, Request, status
 from fastapi.middleware.cors import CORSMiddleware
+from utils.startup_timing import get_startup_timer
+
+# Kathara, Docker e digital_twin sono importati dai router solo al primo uso
+get_startup_timer().mark("framework_imported")
 from routers import execution, configuration, infos, validate, files 
 from log import set_logging
+get_startup_timer().mark("routers_imported")
 
 
 def app_startup():
     set_logging()
     execution.startup()
+    get_startup_timer().mark("startup_hook")
 
 
 app = FastAPI(title="IXP Digital Twin API", version="1.0.0")
@@ -42,6 +48,13 @@ app.add_middleware(
 )
 
 
+@app.middleware("http")
+async def track_first_request(request: Request, call_next):
+    response = await call_next(request)
+    get_startup_timer().request_served(request.url.path)
+    return response
+
+
 @app.get("/", status_code=status.HTTP_200_OK)
 async def index_route():
     return {
@@ -1,29 +1,41 @@
-from datetime import datetime, timedelta
 import logging
 
+from utils.shared_state import get_shared_state
+
+STATS_CACHE_NAMESPACE = "stats_cache"
+
+
 class StatsCache:
-    def __init__(self, ttl_seconds=5):
-        self._cache = {}
-        self.ttl = timedelta(seconds=ttl_seconds)
-    
+    """
+    TTL cache of Docker/Kathara stats shared by all the uvicorn workers
+    (stored in the shared state store, values must be JSON serializable)
+    """
+
+    def __init__(self, ttl_seconds=5, namespace=STATS_CACHE_NAMESPACE):
+        self.ttl = ttl_seconds
+        self.namespace = namespace
+
     def get(self, key):
-        if key in self._cache:
-            data, timestamp = self._cache[key]
-            if datetime.now() - timestamp < self.ttl:
-                logging.debug(f"Cache HIT for {key}")
-                return data
-            else:
-                logging.debug(f"Cache EXPIRED for {key}")
-                del self._cache[key]
-        logging.debug(f"Cache MISS for {key}")
-        return None
-    
+        try:
+            data = get_shared_state().get(self.namespace, key)
+        except Exception as e:
+            logging.warning(f"Stats cache unavailable: {e}")
+            return None
+        logging.debug(f"Cache {'HIT' if data is not None else 'MISS'} for {key}")
+        return data
+
     def set(self, key, data):
-        self._cache[key] = (data, datetime.now())
-    
+        try:
+            get_shared_state().put(self.namespace, key, data, ttl=self.ttl)
+        except Exception as e:
+            logging.warning(f"Could not cache {key}: {e}")
+
     def clear(self):
-        self._cache.clear()
-        logging.info("Cache cleared")
+        try:
+            get_shared_state().clear(self.namespace)
+            logging.info("Cache cleared")
+        except Exception as e:
+            logging.warning(f"Could not clear the stats cache: {e}")
 
 # Singleton
 _stats_cache = StatsCache(ttl_seconds=5)
@@ -1,7 +1,9 @@
 import os
 import json
+import fcntl
 import logging
 import shutil
+import tempfile
 from pathlib import Path
 
 BACKEND_BASE_PATH = os.path.relpath(Path(os.path.dirname(__file__)))
@@ -10,6 +12,10 @@ BACKEND_IXPCONFIGS_FOLDER: str = os.path.abspath(os.path.join(BACKEND_BASE_PATH,
 BACKEND_LOGS_PATH: str = os.path.abspath(os.path.join(BACKEND_BASE_PATH, "logs", "namex.log"))
 SETTINGS_FILE: str = os.path.abspath(os.path.join(BACKEND_BASE_PATH, "settings.json"))
 DIGITAL_TWIN_RESOURCES_FOLDER: str = os.path.abspath(os.path.join(BACKEND_BASE_PATH, "digital_twin", "resources"))
+BACKEND_CACHE_FOLDER: str = os.path.abspath(os.path.join(BACKEND_BASE_PATH, "cache"))
+BACKEND_PROFILES_FOLDER: str = os.path.abspath(os.path.join(BACKEND_BASE_PATH, "profiles"))
+BACKEND_CHECKPOINTS_FOLDER: str = os.path.abspath(os.path.join(BACKEND_BASE_PATH, "checkpoints"))
+BACKEND_STATE_FOLDER: str = os.path.abspath(os.path.join(BACKEND_BASE_PATH, "state"))
 
 
 def get_max_devices():
@@ -40,12 +46,134 @@ def get_max_devices():
     
     return None  # ✅ Default unlimited in caso di errore
 
+
+def get_backend_setting(name, default=None):
+    """
+    Read a backend option from settings.json file.
+
+    Returns:
+        The stored value, or default if the file or the option is missing
+    """
+    try:
+        if os.path.exists(SETTINGS_FILE):
+            with open(SETTINGS_FILE, 'r') as f:
+                value = json.load(f).get(name, None)
+                return default if value is None else value
+    except Exception as e:
+        logging.error(f"Could not load setting '{name}': {e}")
+    return default
+
+
+def set_backend_setting(name, value):
+    """
+    Persist a backend option into settings.json file, keeping the other options.
+
+    The read-modify-write runs under an exclusive lock on `settings.json.lock`
+    (shared by all the processes of the backend) and the file is replaced
+    atomically, so concurrent readers see either the old or the new content.
+    """
+    os.makedirs(os.path.dirname(SETTINGS_FILE), exist_ok=True)
+
+    with open(SETTINGS_FILE + ".lock", "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+
+        settings_data = {}
+        if os.path.exists(SETTINGS_FILE):
+            try:
+                with open(SETTINGS_FILE, 'r') as f:
+                    settings_data = json.load(f)
+            except Exception:
+                settings_data = {}
+
+        settings_data[name] = value
+
+        # File temporaneo nella stessa directory: os.replace è atomico solo sullo stesso filesystem
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(SETTINGS_FILE), prefix=".settings-", suffix=".json")
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(settings_data, f, indent=2)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, SETTINGS_FILE)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+
+SYNC_MANIFEST_FILENAME = ".sync_manifest.json"
+CRITICAL_RESOURCE_FILES = ['rs1-rom-v4.conf', 'rs1-rom-v6.conf', 'config_peerings.json']
+
+# ioctl FICLONE (Linux): copia copy-on-write su filesystem che lo supportano (btrfs, xfs, ...)
+FICLONE = 0x40049409
+
+
+def _load_sync_manifest(manifest_path):
+    try:
+        with open(manifest_path, 'r') as f:
+            manifest = json.load(f)
+        return manifest if isinstance(manifest, dict) else {}
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        logging.warning(f"⚠️ Invalid sync manifest, doing a full sync: {e}")
+        return {}
+
+
+def _save_sync_manifest(manifest_path, manifest):
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
+
+
+def _reflink(src_path, dst_path):
+    with open(src_path, 'rb') as src, open(dst_path, 'wb') as dst:
+        fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+    shutil.copystat(src_path, dst_path)
+
+
+def _link_or_copy(src_path, dst_path, same_filesystem):
+    """
+    Place a copy of src_path at dst_path, preferring a reflink (copy-on-write)
+    when both folders are on the same filesystem. Returns the method used.
+
+    No hardlinks: the two files would share the inode, and a resource rewritten
+    in place would change the copy digital_twin is parsing.
+    """
+    tmp_path = dst_path + ".sync_tmp"
+    if os.path.lexists(tmp_path):
+        os.remove(tmp_path)
+
+    method = None
+    if same_filesystem:
+        try:
+            _reflink(src_path, tmp_path)
+            method = "reflink"
+        except OSError:
+            if os.path.lexists(tmp_path):
+                os.remove(tmp_path)
+
+    if method is None:
+        shutil.copy2(src_path, tmp_path)
+        method = "copy"
+
+    # Sostituzione atomica del file di destinazione
+    os.replace(tmp_path, dst_path)
+    return method
+
+
 def sync_resources_to_digital_twin():
     """
-    Copia tutti i file da backend/resources/ a backend/digital_twin/resources/
+    Sincronizza backend/resources/ in backend/digital_twin/resources/
     Viene eseguito prima di ogni start/reload del lab.
+
+    Usa un manifest (size, mtime, sha256) per copiare solo i file modificati,
+    preferisce il reflink quando le cartelle sono sullo stesso filesystem
+    e rimuove i file sincronizzati in precedenza che non esistono più.
     """
     try:
+        from utils.file_utils import file_digest
+
         logging.info(f"🔄 Syncing resources from: {BACKEND_RESOURCES_FOLDER}")
         logging.info(f"🔄 Syncing resources to: {DIGITAL_TWIN_RESOURCES_FOLDER}")
         
@@ -56,33 +184,84 @@ def sync_resources_to_digital_twin():
         
         # Crea la directory di destinazione se non esiste
         os.makedirs(DIGITAL_TWIN_RESOURCES_FOLDER, exist_ok=True)
-        logging.info(f"✅ Destination folder created/verified: {DIGITAL_TWIN_RESOURCES_FOLDER}")
-        
-        # Conta file copiati
-        copied_count = 0
+
+        same_filesystem = os.stat(BACKEND_RESOURCES_FOLDER).st_dev == os.stat(DIGITAL_TWIN_RESOURCES_FOLDER).st_dev
+        manifest_path = os.path.join(DIGITAL_TWIN_RESOURCES_FOLDER, SYNC_MANIFEST_FILENAME)
+        manifest = _load_sync_manifest(manifest_path)
+        new_manifest = {}
+
+        # Conta file sincronizzati
+        synced_count = 0
+        unchanged_count = 0
         failed_count = 0
-        
-        # Copia tutti i file
+        removed_count = 0
+
         for filename in os.listdir(BACKEND_RESOURCES_FOLDER):
             src_path = os.path.join(BACKEND_RESOURCES_FOLDER, filename)
             dst_path = os.path.join(DIGITAL_TWIN_RESOURCES_FOLDER, filename)
-            
-            # Copia solo file (non directory)
-            if os.path.isfile(src_path):
-                try:
-                    shutil.copy2(src_path, dst_path)
-                    copied_count += 1
-                    logging.info(f"  ✅ {filename} ({os.path.getsize(src_path)} bytes)")
-                except Exception as e:
-                    failed_count += 1
-                    logging.error(f"  ❌ Failed to copy {filename}: {e}")
-        
-        logging.info(f"✅ Resources sync completed: {copied_count} files copied, {failed_count} failed")
+
+            # Sincronizza solo file (non directory)
+            if not os.path.isfile(src_path) or filename == SYNC_MANIFEST_FILENAME:
+                continue
+
+            try:
+                src_stat = os.stat(src_path)
+                entry = manifest.get(filename)
+                # I file sincronizzati come hardlink condividono l'inode con resources/: vanno ricopiati
+                dst_ok = os.path.isfile(dst_path) and os.path.getsize(dst_path) == src_stat.st_size \
+                    and (entry or {}).get("method") != "hardlink"
+
+                if entry and dst_ok and entry.get("size") == src_stat.st_size \
+                        and entry.get("mtime_ns") == src_stat.st_mtime_ns:
+                    new_manifest[filename] = entry
+                    unchanged_count += 1
+                    continue
+
+                # Stat cambiato: confronta il contenuto prima di copiare
+                digest = file_digest(src_path)
+                if entry and dst_ok and entry.get("sha256") == digest:
+                    method = entry.get("method", "copy")
+                    unchanged_count += 1
+                else:
+                    method = _link_or_copy(src_path, dst_path, same_filesystem)
+                    synced_count += 1
+                    logging.info(f"  ✅ {filename} ({src_stat.st_size} bytes, {method})")
+
+                new_manifest[filename] = {
+                    "size": src_stat.st_size,
+                    "mtime_ns": src_stat.st_mtime_ns,
+                    "sha256": digest,
+                    "method": method,
+                }
+            except Exception as e:
+                failed_count += 1
+                logging.error(f"  ❌ Failed to sync {filename}: {e}")
+
+        # Rimuovi i file sincronizzati in precedenza e non più presenti in resources/
+        for filename in set(manifest.keys()) - set(new_manifest.keys()):
+            if os.path.exists(os.path.join(BACKEND_RESOURCES_FOLDER, filename)):
+                continue
+            try:
+                stale_path = os.path.join(DIGITAL_TWIN_RESOURCES_FOLDER, filename)
+                if os.path.isfile(stale_path):
+                    os.remove(stale_path)
+                removed_count += 1
+                logging.info(f"  🗑️ Removed stale file {filename}")
+            except Exception as e:
+                failed_count += 1
+                new_manifest[filename] = manifest[filename]
+                logging.error(f"  ❌ Failed to remove stale file {filename}: {e}")
+
+        _save_sync_manifest(manifest_path, new_manifest)
+
+        logging.info(
+            f"✅ Resources sync completed: {synced_count} synced, {unchanged_count} unchanged, "
+            f"{removed_count} removed, {failed_count} failed"
+        )
         
-        # Verifica che i file critici siano stati copiati
-        critical_files = ['rs1-rom-v4.conf', 'rs1-rom-v6.conf', 'config_peerings.json']
+        # Verifica che i file critici siano presenti
         missing_files = []
-        for critical_file in critical_files:
+        for critical_file in CRITICAL_RESOURCE_FILES:
             dst_path = os.path.join(DIGITAL_TWIN_RESOURCES_FOLDER, critical_file)
             if not os.path.exists(dst_path):
                 missing_files.append(critical_file)
@@ -100,4 +279,3 @@ def sync_resources_to_digital_twin():
         import traceback
         logging.error(traceback.format_exc())
         return False
-
@@ -1,17 +1,46 @@
 import logging
 import os
-import docker
+import threading
+import time
+from collections import OrderedDict
 
+from Kathara.manager.Kathara import Kathara
 from Kathara.setting.Setting import Setting
 
 from log import set_logging
 from digital_twin.ixp.configuration.frr_scenario_configuration_applier import FrrScenarioConfigurationApplier
-from digital_twin.ixp.foundation.dumps.member_dump.member_dump_factory import MemberDumpFactory
-from digital_twin.ixp.foundation.dumps.table_dump.table_dump_factory import TableDumpFactory
-from globals import BACKEND_RESOURCES_FOLDER, BACKEND_IXPCONFIGS_FOLDER, get_max_devices, sync_resources_to_digital_twin
+from globals import BACKEND_IXPCONFIGS_FOLDER, sync_resources_to_digital_twin
 from digital_twin.ixp.network_scenario.network_scenario_manager import NetworkScenarioManager
 from digital_twin.ixp.network_scenario.rs_manager import RouteServerManager
 from digital_twin.ixp.settings.settings import Settings
+from utils.jobs import Job, job_phase
+from utils.dt_utils import load_table_dump
+from utils.build_cache import compute_build_key
+from utils.config_hash import (
+    compute_config_hashes,
+    compute_structure_hashes,
+    diff_hashes,
+    estimate_payload_bytes,
+    load_config_hashes,
+    save_config_hashes,
+)
+from utils.config_push import push_device_info, summarize_push, PUSH_OK, PUSH_FAILED, PUSH_TIMEOUT
+from utils.docker_utils import get_lab_containers
+from utils.lab_manifest import save_lab_manifest
+from utils.profiler import profiled_run, profile_phase, profile_annotate
+from utils.reload_estimate import get_reload_rates, estimate_reload_duration
+
+# Il singleton Settings di digital_twin è condiviso: un solo build/piano alla volta
+_scenario_build_lock = threading.Lock()
+
+
+class LabMismatchError(Exception):
+    """The scenario built from the ixpconf is not the running lab (different lab hash)"""
+
+
+# Piani di reload calcolati di recente (vedi plan_reload)
+MAX_CACHED_PLANS = 8
+_plan_cache = OrderedDict()
 
 
 def load_settings_for_reload(settings, config_file_path):
@@ -68,57 +97,221 @@ def get_existing_containers(lab_hash):
         set: Set of existing device names
     """
     try:
-        docker_client = docker.from_env()
-        all_containers = docker_client.containers.list(all=True)
-        
-        existing_devices = set()
-        for container in all_containers:
-            # Extract device name from container name
-            # Format: <hash>_<device_name> or kathara_<hash>_<device_name>
-            container_name = container.name
-            
-            if lab_hash in container_name:
-                # Extract device name
-                parts = container_name.split('_')
-                if len(parts) >= 2:
-                    # Remove hash prefix to get device name
-                    if container_name.startswith('kathara_'):
-                        device_name = '_'.join(parts[2:])  # kathara_hash_devicename
-                    else:
-                        device_name = '_'.join(parts[1:])  # hash_devicename
-                    
-                    existing_devices.add(device_name)
-        
-        return existing_devices
-        
+        # Le label Kathara riportano il nome del device, senza dover interpretare il nome del container
+        return {container.labels["name"] for container in get_lab_containers(lab_hash) if "name" in container.labels}
     except Exception as e:
         logging.warning(f"Could not get existing containers: {e}")
         return set()
 
 
-def reload_lab(ixp_configs_filename: str):
+def reload_lab(ixp_configs_filename: str, job: Job | None = None, cprofile: bool = False,
+               expected_lab_hash: str | None = None):
     """
     Hot-reload lab configuration without full restart.
     Only deploys new/changed devices and updates configurations.
     
     Args:
         ixp_configs_filename: Name of the config file (e.g., 'ixp.conf')
+        job: Optional job on which the reload phases are tracked
+        cprofile: Capture a cProfile of the whole reload (see utils/profiler.py)
+        expected_lab_hash: Lab that must be updated (the reload stops before touching Docker otherwise)
         
     Returns:
         net_scenario: Updated network scenario object
+    
+    Raises:
+        LabMismatchError: The ixpconf builds a lab other than expected_lab_hash
     """
     set_logging()
     
+    with profiled_run("reload", ixp_configs_filename, capture_cprofile=cprofile) as profiler:
+        if job is not None:
+            profiler.annotate(job_id=job.id)
+        return _run_reload(ixp_configs_filename, job, expected_lab_hash)
+
+
+def _run_reload(ixp_configs_filename: str, job: Job | None, expected_lab_hash: str | None = None):
     # ✅ Sincronizza resources PRIMA di fare qualsiasi cosa
     logging.info("=" * 80)
     logging.info("🔄 SYNCING RESOURCES TO DIGITAL_TWIN")
     logging.info("=" * 80)
     
-    if not sync_resources_to_digital_twin():
-        error_msg = "Failed to sync resources to digital_twin. Cannot reload lab."
-        logging.error(f"❌ {error_msg}")
-        raise RuntimeError(error_msg)
+    with job_phase(job, "sync"), profile_phase("resource_sync"):
+        if not sync_resources_to_digital_twin():
+            error_msg = "Failed to sync resources to digital_twin. Cannot reload lab."
+            logging.error(f"❌ {error_msg}")
+            raise RuntimeError(error_msg)
+    
+    with job_phase(job, "build"), _scenario_build_lock:
+        net_scenario, net_scenario_manager, table_dump, frr_conf, rs_manager = _build_reload_scenario(
+            ixp_configs_filename
+        )
+    
+    lab_hash = net_scenario.hash
+    if expected_lab_hash is not None and lab_hash != expected_lab_hash:
+        raise LabMismatchError(f"{ixp_configs_filename} builds lab {lab_hash}, not {expected_lab_hash}")
+    
+    # Get existing containers
+    with profile_phase("existing_containers"):
+        existing_devices = get_existing_containers(lab_hash)
+    logging.info(f"Found {len(existing_devices)} existing containers: {existing_devices}")
+    
+    # Hash di quanto è in esecuzione (salvati all'ultimo start/reload)
+    manifest = load_config_hashes(lab_hash) or {}
+    with profile_phase("structure_hashing"):
+        new_devices, removed_devices, recreated_devices, skipped_devices, structure_hashes = _classify_devices(
+            net_scenario, existing_devices, manifest
+        )
+    
+    if skipped_devices:
+        logging.info(f"Skipped {len(skipped_devices)} existing devices: {skipped_devices}")
+    if recreated_devices:
+        logging.info(f"Will recreate {len(recreated_devices)} devices with changed image/interfaces: {recreated_devices}")
+    if removed_devices:
+        logging.info(f"Will undeploy {len(removed_devices)} removed devices: {removed_devices}")
+    if len(new_devices) == 0:
+        logging.info("No new devices to deploy. Updating existing configurations only.")
+    else:
+        logging.info(f"Will deploy {len(new_devices)} new devices: {list(new_devices.keys())}")
+    
+    profile_annotate(
+        lab_hash=lab_hash, machines=len(net_scenario.machines), new_devices=len(new_devices),
+        removed_devices=len(removed_devices), recreated_devices=len(recreated_devices),
+    )
+    
+    if job is not None:
+        job.lab_hash = lab_hash
+        job.set_devices_total(len(new_devices) + len(removed_devices))
+    
+    # Undeploy removed devices (and the old containers of the recreated ones)
+    to_undeploy = set(removed_devices) | set(recreated_devices)
+    if to_undeploy:
+        with job_phase(job, "undeploy"), profile_phase("undeploy_devices"):
+            try:
+                Kathara.get_instance().undeploy_lab(lab_hash=lab_hash, selected_machines=to_undeploy)
+            except Exception as e:
+                logging.error(f"Failed to undeploy devices: {e}")
+                raise
+        if job is not None:
+            for device_name in removed_devices:
+                job.device_completed(device_name)
+    
+    # Deploy new devices
+    if new_devices:
+        with job_phase(job, "deploy"):
+            try:
+                logging.info("Applying FRR configurations to new devices...")
+                with profile_phase("frr_configuration"):
+                    frr_conf.apply_to_devices(new_devices)
+                logging.info("FRR configurations applied")
+            except Exception as e:
+                logging.error(f"Failed to apply FRR configurations: {e}")
+                raise
+            
+            try:
+                logging.info("Deploying new devices...")
+                with profile_phase("deploy_devices"):
+                    net_scenario_manager.deploy_devices(new_devices)
+                logging.info("New devices deployed")
+            except Exception as e:
+                logging.error(f"Failed to deploy new devices: {e}")
+                raise
+        
+        if job is not None:
+            for device_name in new_devices:
+                job.device_completed(device_name)
+        
+        with job_phase(job, "interconnect"), profile_phase("interconnect"):
+            try:
+                logging.info("Updating network interconnections...")
+                net_scenario_manager.update_interconnection(table_dump, new_devices)
+                logging.info("Interconnections updated")
+            except Exception as e:
+                logging.error(f"Failed to update interconnections: {e}")
+                raise
+    
+    with job_phase(job, "config push"):
+        config_hashes, pushed, push_results = _push_configurations(
+            net_scenario, net_scenario_manager, frr_conf, rs_manager, manifest.get("config", {}), job,
+            deployed_devices=new_devices,
+        )
+    
+    save_config_hashes(lab_hash, structure_hashes, config_hashes)
+    with profile_phase("lab_manifest"):
+        save_lab_manifest(net_scenario, ixp_configs_filename, get_lab_containers(lab_hash))
+    
+    changes = {
+        "added": sorted(set(new_devices) - set(recreated_devices)),
+        "removed": removed_devices,
+        "recreated": recreated_devices,
+        "reconfigured": sorted({name for names in pushed.values() for name in names}),
+        "push_failed": sorted({
+            device for kind_results in push_results.values()
+            for device, result in kind_results.items() if result["status"] != PUSH_OK
+        }),
+    }
+    touched = set(changes["reconfigured"]) | set(changes["push_failed"])
+    changes["unchanged"] = sorted(set(net_scenario.machines) - set(new_devices) - touched)
+    profile_annotate(changes={key: len(value) for key, value in changes.items()})
+    if job is not None:
+        job.emit("changes", **changes)
+        job.emit("push_results", **push_results)
+    
+    # Success
+    logging.info("=" * 80)
+    logging.info("LAB HOT-RELOAD COMPLETED SUCCESSFULLY!")
+    logging.info(f"Total machines in scenario: {len(net_scenario.machines)}")
+    logging.info(f"New machines deployed: {len(new_devices)}")
+    logging.info(f"Removed machines: {len(removed_devices)}")
+    logging.info(f"Unchanged machines: {len(changes['unchanged'])}")
+    logging.info(f"Lab hash: {lab_hash}")
+    logging.info("=" * 80)
+    
+    return net_scenario
+
+
+def _classify_devices(net_scenario, existing_devices: set, manifest: dict):
+    """
+    Compare the scenario built by build_diff with the running devices.
+    
+    Returns:
+        (new_devices, removed_devices, recreated_devices, skipped_devices, structure_hashes)
+    """
+    structure_hashes = compute_structure_hashes(net_scenario)
+    structure_diff = diff_hashes(manifest.get("structure"), structure_hashes)
+    
+    # Devices no longer in the scenario, and devices whose container must be recreated
+    removed_devices = sorted(existing_devices - set(net_scenario.machines))
+    recreated_devices = [name for name in structure_diff["changed"] if name in existing_devices]
     
+    # Extract NEW devices (marked by build_diff) plus the ones to recreate
+    new_devices = {}
+    skipped_devices = []
+    for device_name, device in net_scenario.machines.items():
+        if device_name in recreated_devices:
+            new_devices[device_name] = device
+        elif device.meta.get("new"):
+            if device_name in existing_devices:
+                logging.warning(f"Device {device_name} already exists in Docker, skipping deployment")
+                skipped_devices.append(device_name)
+            else:
+                new_devices[device_name] = device
+    
+    return new_devices, removed_devices, recreated_devices, skipped_devices, structure_hashes
+
+
+def _config_kinds(frr_conf, rs_manager):
+    """Configurations pushed on reload: (kind, label, device info getter)"""
+    return (
+        ("rs", "Route Server", rs_manager.get_device_info),
+        ("peering", "Peering", frr_conf.get_device_info),
+    )
+
+
+def _build_reload_scenario(ixp_configs_filename: str):
+    """
+    Load settings and dumps, then compute the network scenario diff against the running lab
+    """
     logging.info("=" * 80)
     logging.info("Starting LAB HOT-RELOAD")
     logging.info("=" * 80)
@@ -136,52 +329,17 @@ def reload_lab(ixp_configs_filename: str):
         raise FileNotFoundError(f"Config file not found: {config_file_path}")
     
     # Load settings with custom loader
-    load_settings_for_reload(settings, config_file_path)
+    with profile_phase("settings_loading"):
+        load_settings_for_reload(settings, config_file_path)
+        build_key = compute_build_key(ixp_configs_filename)
     
     # Configure Kathara
     Setting.get_instance().load_from_dict({"manager_type": "docker"})
     
     logging.info(f"Peering configuration: {settings.peering_configuration}")
     
-    # Load member dump
-    try:
-        member_dump_class = MemberDumpFactory(submodule_package="digital_twin").get_class_from_name(
-            settings.peering_configuration["type"]
-        )
-        entries = member_dump_class().load_from_file(
-            os.path.join(BACKEND_RESOURCES_FOLDER, settings.peering_configuration["path"])
-        )
-        logging.info(f"Loaded {len(entries)} member entries")
-    except Exception as e:
-        logging.error(f"Failed to load member dump: {e}")
-        raise
-    
-    # Load table dump
-    try:
-        table_dump = TableDumpFactory(submodule_package="digital_twin").get_class_from_name(
-            settings.rib_dumps["type"]
-        )(entries)
-        
-        for v, file in settings.rib_dumps["dumps"].items():
-            dump_path = os.path.join(BACKEND_RESOURCES_FOLDER, file)
-            logging.info(f"Loading RIB dump (IPv{v}): {dump_path}")
-            table_dump.load_from_file(dump_path)
-        
-        logging.info(f"Loaded RIB dumps for {len(settings.rib_dumps['dumps'])} IP versions")
-    except Exception as e:
-        logging.error(f"Failed to load RIB dumps: {e}")
-        raise
-    
-    # Limit entries based on MAX_DEVICES configuration (read fresh value)
-    max_devices = get_max_devices()
-    logging.info(f"DEBUG: get_max_devices() returned: {max_devices}")
-
-    if max_devices is not None and max_devices > 0:
-        original_count = len(table_dump.entries)
-        table_dump.entries = dict(list(table_dump.entries.items())[0:max_devices])
-        logging.info(f"✅ Limited devices: {original_count} -> {max_devices} (MAX_DEVICES)")
-    else:
-        logging.info(f"No device limit applied (total: {len(table_dump.entries)} devices)")
+    # Load member dump and RIB dumps (from build cache, if inputs are unchanged)
+    table_dump = load_table_dump(settings, build_key)
     
     # Initialize managers
     net_scenario_manager = NetworkScenarioManager()
@@ -191,105 +349,180 @@ def reload_lab(ixp_configs_filename: str):
     # Build diff
     logging.info("Analyzing configuration changes...")
     try:
-        net_scenario = net_scenario_manager.build_diff(table_dump)
+        with profile_phase("scenario_build_diff"):
+            net_scenario = net_scenario_manager.build_diff(table_dump)
         logging.info(f"Network scenario hash: {net_scenario.hash}")
     except Exception as e:
         logging.error(f"Failed to build network scenario diff: {e}")
         raise
     
-    # Get existing containers
-    existing_devices = get_existing_containers(net_scenario.hash)
-    logging.info(f"Found {len(existing_devices)} existing containers: {existing_devices}")
-    
-    # Extract NEW devices (marked by build_diff)
-    new_devices_from_diff = dict(
-        x for x in net_scenario.machines.items() 
-        if "new" in x[1].meta and x[1].meta["new"]
-    )
-    
-    # Filter out devices that already exist in Docker
-    new_devices = {}
-    skipped_devices = []
-    
-    for device_name, device in new_devices_from_diff.items():
-        if device_name in existing_devices:
-            logging.warning(f"Device {device_name} already exists in Docker, skipping deployment")
-            skipped_devices.append(device_name)
-        else:
-            new_devices[device_name] = device
-    
-    if skipped_devices:
-        logging.info(f"Skipped {len(skipped_devices)} existing devices: {skipped_devices}")
-    
-    if len(new_devices) == 0:
-        logging.info("No new devices to deploy. Updating existing configurations only.")
-    else:
-        logging.info(f"Will deploy {len(new_devices)} new devices: {list(new_devices.keys())}")
+    return net_scenario, net_scenario_manager, table_dump, frr_conf, rs_manager
+
+
+def _devices_to_push(previous: dict | None, current: dict, deployed_devices) -> tuple[list, int]:
+    """
+    Devices whose configuration must be pushed: the ones whose rendered hash
+    differs from the last push, plus the ones deployed by this reload (new or
+    recreated containers start without it, even when the hash is unchanged)
+
+    Returns:
+        (devices, unchanged): devices to push and number of devices left as they are
+    """
+    changed = diff_hashes(previous, current)
+    devices = changed["added"] + changed["changed"]
+    deployed = [device for device in changed["unchanged"] if device in deployed_devices]
+    return devices + deployed, len(changed["unchanged"]) - len(deployed)
+
+
+def _push_configurations(net_scenario, net_scenario_manager, frr_conf, rs_manager, previous_hashes: dict,
+                         job: Job | None = None, deployed_devices=()):
+    """
+    Upload Route Server and Peering configurations to the running devices.
+    Only devices whose rendered configuration hash differs from the last push,
+    and the devices just deployed (deployed_devices), are updated, in parallel
+    (see utils/config_push.py).
     
-    # Deploy new devices
-    if new_devices:
-        try:
-            logging.info("Applying FRR configurations to new devices...")
-            frr_conf.apply_to_devices(new_devices)
-            logging.info("FRR configurations applied")
-        except Exception as e:
-            logging.error(f"Failed to apply FRR configurations: {e}")
-            raise
-        
-        try:
-            logging.info("Deploying new devices...")
-            net_scenario_manager.deploy_devices(new_devices)
-            logging.info("New devices deployed")
-        except Exception as e:
-            logging.error(f"Failed to deploy new devices: {e}")
-            raise
-        
-        try:
-            logging.info("Updating network interconnections...")
-            net_scenario_manager.update_interconnection(table_dump, new_devices)
-            logging.info("Interconnections updated")
-        except Exception as e:
-            logging.error(f"Failed to update interconnections: {e}")
-            raise
-    
-    # Upload Route Server configurations (always update, even if no new devices)
-    try:
-        logging.info("Uploading Route Server configurations...")
-        rs_info = rs_manager.get_device_info(net_scenario)
-        return_code = net_scenario_manager.copy_and_exec_by_device_info(rs_info)
+    Returns:
+        (hashes, pushed, results): config hashes to save per kind, devices updated per kind,
+        per-device push results per kind
+    """
+    hashes = {}
+    pushed = {}
+    results = {}
+    for kind, label, get_info in _config_kinds(frr_conf, rs_manager):
+        logging.info(f"Uploading {label} configurations...")
+        with profile_phase(f"{kind}_config_push"):
+            device_info = get_info(net_scenario)
+            current = compute_config_hashes(device_info)
+            
+            if current is None:
+                # Formato non suddivisibile per device: caricamento unico come prima
+                try:
+                    return_code = net_scenario_manager.copy_and_exec_by_device_info(device_info)
+                except Exception as e:
+                    raise Exception(f"Error during {label} Copy and Exec: {e}")
+                if return_code != 0:
+                    raise Exception(f"{label} configuration upload failed with return code {return_code}")
+                pushed[kind] = ["*"]
+                continue
+            
+            previous = previous_hashes.get(kind) or {}
+            devices, unchanged = _devices_to_push(previous, current, deployed_devices)
+            logging.info(f"{label}: {len(devices)} devices to update, {unchanged} unchanged")
+            
+            if job is not None:
+                job.set_devices_total(job.devices_total + len(devices))
+            results[kind] = push_device_info(
+                net_scenario_manager, {device: device_info[device] for device in devices}, job
+            )
+            summary = summarize_push(results[kind])
+            profile_annotate(**{f"{kind}_push": summary})
         
-        if return_code != 0:
-            raise Exception(f"RS configuration upload failed with return code {return_code}")
+        # I device non aggiornati mantengono l'hash precedente: verranno ritentati al prossimo reload
+        failed = [device for device, result in results[kind].items() if result["status"] != PUSH_OK]
+        hashes[kind] = {device: digest for device, digest in current.items() if device not in failed}
+        hashes[kind].update({device: previous[device] for device in failed if device in previous})
+        pushed[kind] = [device for device in devices if device not in failed]
         
-        logging.info("Route Server configurations uploaded")
-    except Exception as e:
-        logging.error(f"Failed to upload RS configurations: {e}")
-        raise Exception(f"Error during RS Copy and Exec: {e}")
+        if failed:
+            logging.warning(f"{label} configuration push failed on {len(failed)} devices: {failed}")
+        logging.info(
+            f"{label} configurations uploaded: {summary[PUSH_OK]} ok, "
+            f"{summary[PUSH_FAILED]} failed, {summary[PUSH_TIMEOUT]} timed out"
+        )
     
-    # Upload Peering configurations (always update, even if no new devices)
-    try:
-        logging.info("Uploading Peering configurations...")
-        peerings_info = frr_conf.get_device_info(net_scenario)
-        return_code = net_scenario_manager.copy_and_exec_by_device_info(peerings_info)
-        
-        if return_code != 0:
-            raise Exception(f"Peering configuration upload failed with return code {return_code}")
-        
-        logging.info("Peering configurations uploaded")
-    except Exception as e:
-        logging.error(f"Failed to upload Peering configurations: {e}")
-        raise Exception(f"Error during Peerings Copy and Exec: {e}")
+    return hashes, pushed, results
+
+
+# ==================== PLANNING ====================
+
+def plan_reload(ixp_configs_filename: str, lab_hash: str, running_devices: set) -> dict:
+    """
+    Dry run of reload_lab: same settings loading, table dump and build_diff,
+    without touching Docker. Running devices come from the lab context.
+    Plans are cached on (build key, lab, running devices, last push), so
+    calling it again on an unchanged config is immediate.
     
-    # Success
-    logging.info("=" * 80)
-    logging.info("LAB HOT-RELOAD COMPLETED SUCCESSFULLY!")
-    logging.info(f"Total machines in scenario: {len(net_scenario.machines)}")
-    logging.info(f"New machines deployed: {len(new_devices)}")
-    logging.info(f"Skipped existing machines: {len(skipped_devices)}")
-    logging.info(f"Lab hash: {net_scenario.hash}")
-    logging.info("=" * 80)
+    Returns:
+        dict: Devices to add, remove, recreate and reconfigure, push volume and estimated duration
+    """
+    started = time.perf_counter()
+    manifest = load_config_hashes(lab_hash) or {}
     
-    return net_scenario
+    with _scenario_build_lock:
+        # Sincronizzazione incrementale: costa solo per i file modificati
+        if not sync_resources_to_digital_twin():
+            raise RuntimeError("Failed to sync resources to digital_twin. Cannot plan reload.")
+        
+        settings = Settings.get_instance()
+        # Il singleton Settings è condiviso con il lab in esecuzione: viene ripristinato a fine piano
+        saved_settings = dict(vars(settings))
+        try:
+            config_file_path = os.path.join(BACKEND_IXPCONFIGS_FOLDER, ixp_configs_filename)
+            load_settings_for_reload(settings, config_file_path)
+            build_key = compute_build_key(ixp_configs_filename)
+            
+            cache_key = (build_key, lab_hash, frozenset(running_devices), manifest.get("updated_at"))
+            if build_key is not None and cache_key in _plan_cache:
+                _plan_cache.move_to_end(cache_key)
+                return {**_plan_cache[cache_key], "cached": True, "planning_s": round(time.perf_counter() - started, 4)}
+            
+            table_dump = load_table_dump(settings, build_key)
+            net_scenario = NetworkScenarioManager().build_diff(table_dump)
+            
+            new_devices, removed_devices, recreated_devices, _, _ = _classify_devices(
+                net_scenario, running_devices, manifest
+            )
+            
+            frr_conf = FrrScenarioConfigurationApplier(table_dump)
+            push = {}
+            for kind, _, get_info in _config_kinds(frr_conf, RouteServerManager()):
+                device_info = get_info(net_scenario)
+                current = compute_config_hashes(device_info)
+                if current is None:
+                    push[kind] = {"devices": ["*"], "unchanged": 0, "bytes": estimate_payload_bytes(device_info)}
+                    continue
+                devices, unchanged = _devices_to_push((manifest.get("config") or {}).get(kind), current, new_devices)
+                push[kind] = {
+                    "devices": devices,
+                    "unchanged": unchanged,
+                    "bytes": sum(estimate_payload_bytes(device_info[device]) for device in devices),
+                }
+        finally:
+            settings.__dict__.clear()
+            settings.__dict__.update(saved_settings)
+    
+    reconfigured = sorted({device for kind in push.values() for device in kind["devices"] if device != "*"})
+    pushed_count = sum(len(kind["devices"]) for kind in push.values())
+    rates = get_reload_rates(ixp_configs_filename)
+    
+    plan = {
+        "lab_hash": lab_hash,
+        "ixpconf_filename": ixp_configs_filename,
+        "build_key": build_key,
+        "add": sorted(set(new_devices) - set(recreated_devices)),
+        "remove": removed_devices,
+        "recreate": recreated_devices,
+        "reconfigure": reconfigured,
+        "unchanged": sorted(set(net_scenario.machines) - set(new_devices) - set(reconfigured)),
+        "push": {
+            "devices": pushed_count,
+            "bytes": sum(kind["bytes"] for kind in push.values()),
+            "by_kind": push,
+            # Alla prima reload dopo uno start tutte le configurazioni vengono caricate
+            "baseline": bool(manifest.get("config")),
+        },
+        "estimated_duration_s": estimate_reload_duration(
+            rates, len(new_devices), len(removed_devices) + len(recreated_devices), pushed_count
+        ),
+        "estimate_basis": rates,
+    }
+    if build_key is not None:
+        _plan_cache[cache_key] = plan
+        while len(_plan_cache) > MAX_CACHED_PLANS:
+            _plan_cache.popitem(last=False)
+    
+    return {**plan, "cached": False, "planning_s": round(time.perf_counter() - started, 4)}
 
 
 if __name__ == "__main__":
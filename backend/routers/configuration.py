@@ -1,14 +1,18 @@
+import asyncio
 import os
 import logging
 from pathlib import Path
 from fastapi import APIRouter, UploadFile, Response, status
 
-from start_lab import build_lab
 from utils.responses import success_2xx, error_4xx, error_5xx
 from model.IXPConfFile import IXPConfFile
 from model.file import ConfigFileModel
 from utils.ixpconf_util import exists_file_in_ixpconfigs, create_file_in_ixpconfigs, get_ribs_content_from_ixpconf_name, get_rib_names_from_ixpconf_name
-from utils.server_context import ServerContext
+from utils.server_context import ServerContext, LabTransitionConflict, LAB_BUILDING
+from utils.jobs import get_job_registry, JobCancelledError, JOB_COMPLETED, JOB_FAILED, JOB_CANCELLED
+from utils.lab_manifest import save_lab_manifest
+from utils.file_utils import write_file_atomically
+from utils.docker_utils import get_lab_containers
 
 router = APIRouter(prefix="/ixp/file", tags=["IXP Lab Configuration"])
 
@@ -46,9 +50,9 @@ def list_files_in_directory(directory: Path):
 # ==================== LAB MANAGEMENT ====================
 
 @router.post("/running_ixpconf", status_code=status.HTTP_202_ACCEPTED)
-async def set_running_ixpconf(ixp_filename: ConfigFileModel, response: Response):
+async def set_running_ixpconf(ixp_filename: ConfigFileModel, response: Response, lab_hash: str | None = None):
     filename = ixp_filename.filename
-    if not ServerContext.get_is_lab_discovered():
+    if not ServerContext.get_is_lab_discovered(lab_hash):
         return error_4xx(response=response,
                          status_code=status.HTTP_406_NOT_ACCEPTABLE,
                          message="ixp.conf file is already known")
@@ -56,12 +60,50 @@ async def set_running_ixpconf(ixp_filename: ConfigFileModel, response: Response)
         return error_4xx(response=response,
                          status_code=status.HTTP_406_NOT_ACCEPTABLE,
                          message="ixp.conf file does not exist")
-    lab, _ = build_lab(filename)
-    ServerContext.set_ixpconf_filename(filename)
-    ServerContext.set_lab(lab)
-    ServerContext.set_is_lab_discovered(False)
-    ServerContext.set_total_machines(lab.machines)
-    return success_2xx(message="ixp.conf file set successfully")
+    from start_lab import build_lab
+
+    discovered = await asyncio.to_thread(ServerContext.get_lab, lab_hash)
+
+    def new_attach_job():
+        attach_job = get_job_registry().create(
+            "attach", lab_hash=discovered.hash if discovered is not None else None, ixpconf_filename=filename
+        )
+        attach_job.start()
+        return attach_job
+
+    # La build carica il singleton Settings di digital_twin: come start/reload/restore passa dal lock del ciclo di vita
+    try:
+        job, coalesced = ServerContext.begin_transition(
+            "attach", filename, LAB_BUILDING, new_attach_job,
+            lab_hash=discovered.hash if discovered is not None else None,
+        )
+    except LabTransitionConflict as e:
+        return error_4xx(response, status.HTTP_409_CONFLICT, message=str(e))
+    if coalesced:
+        return {**success_2xx(message="ixp.conf file is being set"), "job_id": job.id, "coalesced": True}
+
+    def attach():
+        lab, _ = build_lab(filename, job)
+        # Il lab scoperto viene sostituito da quello costruito dall'ixpconf
+        if discovered is not None and discovered.hash != lab.hash:
+            ServerContext.clear_lab_context(discovered.hash)
+        ServerContext.set_lab_context(lab, filename, is_discovered=False)
+        save_lab_manifest(lab, filename, get_lab_containers(lab.hash))
+        return lab
+
+    try:
+        lab = await asyncio.to_thread(attach)
+    except JobCancelledError:
+        job.finish(JOB_CANCELLED)
+        return error_4xx(response, status.HTTP_409_CONFLICT, message="ixp.conf file setting cancelled")
+    except Exception as e:
+        logging.error(f"Error setting ixp.conf file {filename}: {e}")
+        job.add_failure(None, str(e))
+        job.finish(JOB_FAILED, error=str(e))
+        return error_5xx(response=response, message=f"couldn't set ixp.conf file: {str(e)}")
+    job.lab_hash = lab.hash
+    job.finish(JOB_COMPLETED)
+    return {**success_2xx(message="ixp.conf file set successfully"), "job_id": job.id}
 
 # ==================== UPLOAD ENDPOINTS (FormData) ====================
 
@@ -73,8 +115,7 @@ async def upload_ixp_config_file(file: UploadFile, response: Response):
         file_path = CONFIGS_DIR / file.filename
         
         content = await file.read()
-        with open(file_path, "wb") as f:
-            f.write(content)
+        write_file_atomically(file_path, content)
         
         logging.info(f"Config file uploaded: {file.filename}")
         return success_2xx(message="file saved successfully")
@@ -91,8 +132,7 @@ async def upload_resource_file(file: UploadFile, response: Response):
         file_path = RESOURCES_DIR / file.filename
         
         content = await file.read()
-        with open(file_path, "wb") as f:
-            f.write(content)
+        write_file_atomically(file_path, content)
         
         logging.info(f"Resource file uploaded: {file.filename}")
         return success_2xx(message="file saved successfully")
@@ -225,8 +265,7 @@ async def create_resource_file(resource_data: dict, response: Response):
     
     try:
         ensure_directory_exists(RESOURCES_DIR)
-        with open(file_path, "w", encoding="utf-8") as f:
-            f.write(content)
+        write_file_atomically(file_path, content)
         logging.info(f"Resource file created: {filename}")
         return success_2xx(message="file created successfully")
     except Exception as e:
@@ -266,8 +305,7 @@ async def update_resource_file(filename: str, data: dict, response: Response):
     
     try:
         content = data.get("content", "")
-        with open(file_path, "w", encoding="utf-8") as f:
-            f.write(content)
+        write_file_atomically(file_path, content)
         logging.info(f"Resource file updated: {filename}")
         return success_2xx(message="file updated successfully")
     except Exception as e:
@@ -1,34 +1,68 @@
+import asyncio
+import functools
 import logging
 import json
-import os
 from typing import Annotated
-from threading import Thread
 
 from pydantic import BaseModel
-from globals import SETTINGS_FILE, get_max_devices
-from fastapi.responses import JSONResponse
+from globals import SETTINGS_FILE, get_max_devices, get_backend_setting, set_backend_setting
+from fastapi.responses import JSONResponse, StreamingResponse
 from utils.responses import *
-from Kathara.manager.Kathara import Kathara
-from fastapi import APIRouter, status, Response, Body, HTTPException
-from start_lab import build_lab, start_lab
-from reload_lab import reload_lab
+from fastapi import APIRouter, status, Response, Body, HTTPException, WebSocket, Query
+from starlette.websockets import WebSocketDisconnect
 from model.file import ConfigFileModel
 from model.lab import Lab as BodyLab
-from utils.lab_utils import (
-    get_running_machines_names,
-    execute_command_on_machine,
-    discover_running_lab,
+from utils.lab_utils import get_running_machines_names
+from utils.server_context import (
+    ServerContext,
+    LabTransitionConflict,
+    LAB_BUILDING,
+    LAB_QUEUED,
+    LAB_DEPLOYING,
+    LAB_RELOADING,
+    LAB_RUNNING,
 )
-from utils.server_context import ServerContext
+from utils.startup_timing import get_startup_timer
+from utils.build_cache import get_build_cache
+from utils.member_selection import get_member_selection, validate_member_selection, MemberSelectionError, STRATEGIES
+from utils.jobs import get_job_registry, JobCancelledError, JOB_COMPLETED, JOB_FAILED, JOB_CANCELLED
+from utils.image_prewarm import get_image_prewarmer, get_required_images
+from utils.lab_scheduler import get_lab_scheduler
+from utils.teardown import start_wipe_job, get_active_wipe
+from utils.warm_pool import get_warm_pool
+from utils.blue_green import blue_green_default, next_scenario_suffix, switch_over
+from utils.exec_pool import get_exec_pool, ExecTimeout, ExecStreamLimit
+from utils.exec_fanout import select_devices, fan_out
+from utils.exec_channels import benchmark_exec, MAX_BENCHMARK_ITERATIONS
+from utils.ixpconf_util import get_route_servers_from_ixpconf_name
+from utils.checkpoint import (
+    create_checkpoint,
+    list_checkpoints,
+    get_checkpoint,
+    delete_checkpoint,
+    restore_checkpoint,
+    CheckpointError,
+)
+import threading
 import traceback
-import docker
+import time
 from datetime import datetime
 from cache_manager import get_stats_cache
 from utils.docker_utils import (
     get_docker_client,
     get_all_running_containers,
     find_container_by_name,
+    get_kathara_containers,
+    get_lab_containers,
+)
+from utils.lab_manifest import (
+    list_lab_manifests,
+    match_containers,
+    reattach_artefacts,
+    delete_lab_manifest,
+    save_lab_manifest,
 )
+from utils.lab_recycling import recycling_enabled, recycle_blocker, is_identical_lab, RECYCLED_IDENTICAL, RECYCLED_DIFF
 
 
 router = APIRouter(prefix="/ixp", tags=["IXP Lab Execution"])
@@ -36,32 +70,108 @@ router = APIRouter(prefix="/ixp", tags=["IXP Lab Execution"])
 
 # ==================== MODELS ====================
 
+# Attesa massima delle immagini prima di un /start
+IMAGE_READINESS_TIMEOUT = 600
+IMAGE_READINESS_POLICIES = ("wait", "fail_fast", "skip")
+
+
 class MaxDevicesModel(BaseModel):
     max_devices: int | None = None
 
 
+class CheckpointModel(BaseModel):
+    name: str | None = None
+    stop: bool = False
+    lab_hash: str | None = None
+
+
+class FanOutModel(BaseModel):
+    command: str
+    devices: list[str] | None = None
+    glob: str | None = None
+    role: str | None = None
+    concurrency: int | None = None
+    timeout: float | None = None
+    lab_hash: str | None = None
+
+
+class MemberSelectionModel(BaseModel):
+    strategy: str
+    count: int | None = None
+    asns: list[int | str] | None = None
+    strata: int | None = None
+    prefix_budget: int | None = None
+    seed: int | None = None
+
+
 # ==================== STARTUP ====================
 
 def startup():
-    found_lab_hash = discover_running_lab()
-    lab = (
-        Kathara.get_instance().get_lab_from_api(found_lab_hash)
-        if found_lab_hash
-        else None
-    )
-    ServerContext.set_is_lab_discovered(True if lab is not None else None)
-    ServerContext.set_lab(lab)
-    ServerContext.set_total_machines(lab.machines if lab else None)
-    ServerContext.set_ixpconf_filename(None)
+    # La discovery interroga Docker per ogni macchina dell'host: in background, l'API risponde subito
+    if ServerContext.begin_discovery(get_startup_timer().process_started_at):
+        threading.Thread(target=discover_labs, name="lab-discovery", daemon=True).start()
+    else:
+        logging.info("Lab discovery already done by another worker")
+
+    # Immagini pronte prima del primo deploy (pull ed estrazione dei layer in background)
+    if get_backend_setting("prewarm_images_on_startup", True):
+        if not get_image_prewarmer().start(not_before=get_startup_timer().process_started_at):
+            logging.info("Image prewarm already claimed by another worker")
 
     logging.info("IXP API Started")
-    if ServerContext.get_is_lab_discovered():
-        logging.info("Lab was discovered!")
-    logging.info(
-        f"Context:\n"
-        f"Lab: {ServerContext.get_lab().hash if ServerContext.get_lab() else 'None'}\n"
-        f"Machines: {ServerContext.get_total_machines().keys() if ServerContext.get_lab() else 'None'}"
-    )
+
+
+def discover_labs():
+    """Register the Kathara labs running on the host, reconciled with the state shared by the workers"""
+    from Kathara.manager.Kathara import Kathara
+
+    try:
+        containers_by_lab = get_kathara_containers()
+        manifests = list_lab_manifests()
+        running_labs = []
+        reattached = []
+        for found_lab_hash, containers in containers_by_lab.items():
+            if not any(container.status == "running" for container in containers):
+                continue
+            manifest = manifests.get(found_lab_hash)
+            if manifest is not None:
+                mismatch = match_containers(manifest, containers)
+                if mismatch is None:
+                    # Lab avviato da questo backend: niente ricostruzione via API di Kathara
+                    changed = reattach_artefacts(manifest)["inputs_changed"]
+                    logging.info(
+                        f"🔗 Lab {found_lab_hash} reattached from its manifest ({manifest['ixpconf_filename']})"
+                        + (f", inputs changed since the deploy: {changed}" if changed else "")
+                    )
+                    reattached.append(manifest)
+                    continue
+                logging.warning(f"Manifest of lab {found_lab_hash} not usable ({mismatch}): discovering it")
+                delete_lab_manifest(found_lab_hash)
+
+            lab = Kathara.get_instance().get_lab_from_api(found_lab_hash)
+            if lab is not None:
+                running_labs.append(lab)
+
+        # Manifest di lab che non hanno più container
+        for lab_hash in manifests.keys() - containers_by_lab.keys():
+            delete_lab_manifest(lab_hash)
+
+        ServerContext.register_discovered_labs(running_labs, reattached)
+
+        if reattached:
+            logging.info(f"{len(reattached)} labs were reattached!")
+        if running_labs:
+            logging.info(f"{len(running_labs)} labs were discovered!")
+        logging.info(
+            f"Context:\n"
+            f"Lab: {ServerContext.get_lab().hash if ServerContext.get_lab() else 'None'}\n"
+            f"Machines: {ServerContext.get_total_machines().keys() if ServerContext.get_lab() else 'None'}"
+        )
+    except Exception as e:
+        logging.error(f"Lab discovery failed: {e}")
+    finally:
+        ServerContext.end_discovery()
+        get_startup_timer().mark("lab_discovery")
 
 
 # ==================== SETTINGS ENDPOINTS ====================
@@ -102,20 +212,7 @@ async def set_max_devices(data: MaxDevicesModel, response: Response):
             )
 
         # Salva su file per persistenza
-        os.makedirs(os.path.dirname(SETTINGS_FILE), exist_ok=True)
-
-        settings_data = {}
-        if os.path.exists(SETTINGS_FILE):
-            try:
-                with open(SETTINGS_FILE, "r") as f:
-                    settings_data = json.load(f)
-            except:
-                settings_data = {}
-
-        settings_data["max_devices"] = max_devices
-
-        with open(SETTINGS_FILE, "w") as f:
-            json.dump(settings_data, f, indent=2)
+        set_backend_setting("max_devices", max_devices)
 
         logging.info(f"✅ MAX_DEVICES updated to: {max_devices}")
         logging.info(f"✅ File saved: {SETTINGS_FILE}")
@@ -129,10 +226,132 @@ async def set_max_devices(data: MaxDevicesModel, response: Response):
         return error_5xx(response, message=f"Error setting max_devices: {str(e)}")
 
 
+@router.get("/settings/member-selection", status_code=status.HTTP_200_OK)
+async def get_member_selection_endpoint():
+    """
+    Get the strategy used to choose which members end up in the lab
+    """
+    return success_2xx(
+        key_mess="member_selection",
+        message={**get_member_selection(), "available_strategies": list(STRATEGIES)},
+    )
+
+
+@router.put("/settings/member-selection", status_code=status.HTTP_200_OK)
+async def set_member_selection(data: MemberSelectionModel, response: Response):
+    """
+    Set the member selection strategy
+    - first_n: first `count` members (same as max_devices)
+    - asn_list: only the members in `asns`
+    - top_n: the `count` members announcing the most prefixes
+    - stratified: `count` members sampled from `strata` prefix-count buckets (`seed` for reproducibility)
+    - prefix_budget: largest members whose prefixes fit in `prefix_budget` (optionally at most `count`)
+    """
+    selection = data.model_dump(exclude_none=True)
+    try:
+        validate_member_selection({**selection, "count": selection.get("count", get_max_devices())})
+    except MemberSelectionError as e:
+        return error_4xx(response, status.HTTP_400_BAD_REQUEST, message=str(e))
+
+    try:
+        set_backend_setting("member_selection", selection)
+        logging.info(f"✅ Member selection updated to: {selection}")
+        return success_2xx(message=f"member selection set to {selection['strategy']}")
+    except Exception as e:
+        logging.error(f"Error setting member selection: {e}")
+        return error_5xx(response, message=f"Error setting member selection: {str(e)}")
+
+
+@router.get("/settings/build-cache", status_code=status.HTTP_200_OK)
+async def get_build_cache_info():
+    """
+    Build cache content (keys in memory and on disk) and hit/miss counters
+    """
+    return success_2xx(key_mess="build_cache", message=get_build_cache().info())
+
+
+@router.delete("/settings/build-cache", status_code=status.HTTP_200_OK)
+async def clear_build_cache(response: Response):
+    """
+    Drop all cached build artefacts, next start/reload will rebuild from scratch
+    """
+    try:
+        get_build_cache().invalidate()
+        return success_2xx(message="build cache cleared")
+    except Exception as e:
+        logging.error(f"Error clearing build cache: {e}")
+        return error_5xx(response, message=f"Error clearing build cache: {str(e)}")
+
+
+@router.get("/settings/warm-pool", status_code=status.HTTP_200_OK)
+async def get_warm_pool_info():
+    """
+    Parked containers per lab, pool size, hit rate and deploy time saved
+    """
+    return success_2xx(key_mess="warm_pool", message=await asyncio.to_thread(get_warm_pool().status))
+
+
+@router.delete("/settings/warm-pool", status_code=status.HTTP_200_OK)
+async def drain_warm_pool(response: Response, lab_hash: str | None = None):
+    """
+    Remove the parked containers (of lab_hash, or all of them) and their networks
+    """
+    try:
+        removed = await asyncio.to_thread(get_warm_pool().drain, lab_hash)
+        return success_2xx(message=f"{removed} parked containers removed")
+    except Exception as e:
+        logging.error(f"Error draining the warm pool: {e}")
+        return error_5xx(response, message=f"Error draining the warm pool: {str(e)}")
+
+
 # ==================== LAB EXECUTION ENDPOINTS ====================
 
 @router.post("/start", status_code=status.HTTP_201_CREATED)
-async def run_namex_lab(ixp_file: ConfigFileModel, response: Response):
+async def run_namex_lab(
+    ixp_file: ConfigFileModel,
+    response: Response,
+    profile: bool = False,
+    image_readiness: str = "wait",
+    replace: bool = True,
+    recycle: bool = True,
+    blue_green: bool | None = None,
+):
+    """
+    Build and deploy the lab.
+    image_readiness: `wait` for the image prewarm to finish, `fail_fast` if
+    the images are not ready yet, `skip` to deploy anyway.
+    replace: wipe the active lab (default); with false the new lab runs next to the
+    existing ones. The deploy starts when the scheduler admits it (see /ixp/scheduler).
+    recycle: when replacing, reuse the containers of the active lab: nothing is done if
+    the config is identical, otherwise only the differing devices are created/destroyed.
+    blue_green: when replacing, deploy the new lab next to the active one and switch over
+    once its route servers have converged (default: "blue_green_switchover" setting).
+    """
+    # Import al primo uso: digital_twin è il modulo più pesante da caricare
+    from start_lab import build_lab, start_lab, get_route_server_types
+
+    if blue_green is None:
+        blue_green = blue_green_default()
+
+    if image_readiness not in IMAGE_READINESS_POLICIES:
+        return error_4xx(
+            response, message=f"image_readiness must be one of {', '.join(IMAGE_READINESS_POLICIES)}"
+        )
+
+    prewarmer = get_image_prewarmer()
+    if image_readiness == "wait":
+        await asyncio.to_thread(prewarmer.wait, IMAGE_READINESS_TIMEOUT)
+    elif image_readiness == "fail_fast":
+        images = prewarmer.status(ixp_file.filename)
+        if images["state"] != "ready" or images["missing"]:
+            return error_5xx(
+                response,
+                status.HTTP_503_SERVICE_UNAVAILABLE,
+                message=f"images not ready ({images['state']}), missing: {images['missing']}",
+            )
+
+    # Il lab attivo (da sostituire) potrebbe non essere ancora stato scoperto
+    await asyncio.to_thread(ServerContext.wait_for_discovery)
     try:
         # Pulisci la cache
         get_stats_cache().clear()
@@ -140,39 +359,114 @@ async def run_namex_lab(ixp_file: ConfigFileModel, response: Response):
         logging.info(f"=== START LAB REQUEST ===")
         logging.info(f"Received filename: {ixp_file.filename}")
 
-        # IMPORTANTE: Wipe completo del lab precedente se esiste
-        if ServerContext.get_lab():
-            logging.info("Previous lab detected, wiping...")
-            try:
-                Kathara.get_instance().wipe()
-                logging.info("Previous lab wiped successfully")
-            except Exception as e:
-                logging.warning(f"Error wiping previous lab: {e}")
+        # Stesso ixpconf già costruito e in attesa/deploy: nessuna nuova build
+        for known in ServerContext.list_labs():
+            if known["ixpconf_filename"] == ixp_file.filename and known["state"] in (LAB_QUEUED, LAB_DEPLOYING):
+                logging.info(f"Start of {ixp_file.filename} already in progress, coalesced into job {known['job_id']}")
+                return {
+                    **success_2xx(key_mess="lab_hash", message=known["lab_hash"]),
+                    "job_id": known["job_id"],
+                    "coalesced": True,
+                }
+
+        # Lab attivo in esecuzione: si riusano i suoi container invece di wipe + deploy
+        if replace and recycle and not blue_green and recycling_enabled():
+            recycled = await _start_by_recycling(ixp_file.filename, profile, response)
+            if recycled is not None:
+                return recycled
+
+        def new_deploy_job():
+            deploy_job = get_job_registry().create("deploy", ixpconf_filename=ixp_file.filename)
+            deploy_job.start()
+            return deploy_job
+
+        try:
+            job, coalesced = ServerContext.begin_transition("start", ixp_file.filename, LAB_BUILDING, new_deploy_job)
+        except LabTransitionConflict as e:
+            return error_4xx(response, status.HTTP_409_CONFLICT, message=str(e))
+
+        if coalesced:
+            # Stessa richiesta già in corso: nessuna nuova build
+            logging.info(f"Start of {ixp_file.filename} already in progress, coalesced into job {job.id}")
+            return {
+                **success_2xx(key_mess="lab_hash", message=job.lab_hash),
+                "job_id": job.id,
+                "coalesced": True,
+            }
 
-        # Pulisci completamente il ServerContext
-        ServerContext.set_lab(None)
-        ServerContext.set_is_lab_discovered(None)
-        ServerContext.set_ixpconf_filename(None)
-        ServerContext.set_total_machines(None)
+        # Pulisci la cache
+        get_stats_cache().clear()
 
-        logging.info(f"Building new lab with config: {ixp_file.filename}")
+        # IMPORTANTE: Wipe del lab attivo (se richiesto), in background e limitato al suo hash
+        previous_lab = await asyncio.to_thread(ServerContext.get_lab) if replace else None
+        blue_lab = None
+        if previous_lab and blue_green and ServerContext.get_state(previous_lab.hash) == LAB_RUNNING:
+            # Blue/green: il lab attivo resta in servizio finché il nuovo non ha converso
+            blue_lab = previous_lab
+            logging.info(f"Blue/green start: lab {blue_lab.hash} stays active while the new lab is deployed")
+        elif previous_lab:
+            logging.info("Previous lab detected, wiping in background...")
+            ServerContext.begin_wipe(previous_lab.hash, lambda: start_wipe_job(previous_lab.hash))
 
-        # Costruisci il nuovo lab
-        lab, net_scenario_manager = build_lab(ixp_file.filename)
+        logging.info(f"Building new lab with config: {ixp_file.filename}")
 
-        ServerContext.set_total_machines(lab.machines)
-        ServerContext.set_lab(lab)
-        ServerContext.set_is_lab_discovered(False)
-        ServerContext.set_ixpconf_filename(ixp_file.filename)
+        # Costruisci il nuovo lab (fuori dall'event loop: le richieste duplicate vengono accorpate)
+        scenario_suffix = next_scenario_suffix(blue_lab.name) if blue_lab is not None else None
+        try:
+            lab, net_scenario_manager = await asyncio.to_thread(
+                build_lab, ixp_file.filename, job, profile, scenario_suffix
+            )
+            route_servers = get_route_server_types()
+        except JobCancelledError:
+            job.finish(JOB_CANCELLED)
+            raise
+        except Exception as e:
+            job.add_failure(None, str(e))
+            job.finish(JOB_FAILED, error=str(e))
+            raise
+
+        if blue_lab is not None and lab.hash == blue_lab.hash:
+            # I due lab non possono coesistere: si torna al wipe prima del deploy
+            logging.warning(f"New lab has the same hash as {blue_lab.hash}, blue/green not possible: replacing it")
+            blue_lab = None
+
+        # Un lab con lo stesso hash non può coesistere con il nuovo: viene rimosso prima del deploy
+        # (prima di assegnare l'hash al job, che altrimenti verrebbe annullato dal wipe)
+        if await asyncio.to_thread(ServerContext.get_lab, lab.hash) is not None:
+            logging.info(f"Lab {lab.hash} is already running, wiping it before deploying..")
+            ServerContext.begin_wipe(lab.hash, lambda: start_wipe_job(lab.hash))
+
+        job.lab_hash = lab.hash
+        job.set_devices_total(len(lab.machines))
+
+        # Con blue/green il lab attivo cambia solo allo switchover
+        ServerContext.set_lab_context(
+            lab, ixp_file.filename, is_discovered=False, state=LAB_QUEUED, activate=blue_lab is None
+        )
+        ServerContext.track_lab_job(lab.hash, job)
+        # Build finito: altri start/reload possono procedere mentre questo lab attende il deploy
+        ServerContext.release_transition(job)
 
         logging.info(f"Lab built successfully. Hash: {lab.hash}")
         logging.info(f"Machines in lab: {list(lab.machines.keys())}")
         logging.info(f"=========================")
 
-        # Starting lab on different thread
-        Thread(target=start_lab, args=(net_scenario_manager,)).start()
+        # Starting lab on different thread, once admitted by the scheduler; se un wipe
+        # dello stesso hash è in corso il deploy lo attende, altrimenti i due si sovrappongono
+        after_deploy = None
+        if blue_lab is not None:
+            after_deploy = functools.partial(switch_over, blue_lab.hash, lab, ixp_file.filename, route_servers)
+        start_lab(
+            net_scenario_manager, job, wait_for=get_active_wipe(lab.hash), lab=lab, after_deploy=after_deploy,
+            route_servers=route_servers,
+        )
 
-        return success_2xx(key_mess="lab_hash", message=ServerContext.get_lab().hash)
+        return {
+            **success_2xx(key_mess="lab_hash", message=lab.hash),
+            "job_id": job.id,
+            "switchover": "blue_green" if blue_lab is not None else ("replace" if previous_lab else None),
+            "previous_lab_hash": blue_lab.hash if blue_lab is not None else None,
+        }
 
     except Exception as e:
         logging.error(f"Error starting the Lab: {e}")
@@ -180,57 +474,164 @@ async def run_namex_lab(ixp_file: ConfigFileModel, response: Response):
         return error_4xx(response, message=f"couldn't start lab: {str(e)}")
 
 
+async def _start_by_recycling(filename: str, profile: bool, response: Response) -> dict | None:
+    """
+    Start filename on the containers of the active lab: a no-op if the lab is identical,
+    otherwise a reload (same job tracking as a start) that creates or destroys only the
+    differing devices and pushes only the changed configurations.
+
+    Returns:
+        dict or None: The response, or None if the lab cannot be recycled (full start)
+    """
+    from reload_lab import reload_lab, LabMismatchError
+
+    context = ServerContext.snapshot()
+    lab_hash = context["lab_hash"]
+    if lab_hash is None or context["state"] != LAB_RUNNING or context["transition"] is not None:
+        return None
+    blocker = recycle_blocker(lab_hash)
+    if blocker is not None:
+        logging.info(f"Lab {lab_hash} not recycled: {blocker}")
+        return None
+
+    if await asyncio.to_thread(is_identical_lab, lab_hash, filename):
+        logging.info(f"♻️ {filename} matches the running lab {lab_hash}: nothing to deploy")
+        if filename != context["ixpconf_filename"]:
+            # Stesso contenuto con un altro nome: il lab ora risulta costruito da filename
+            lab = await asyncio.to_thread(ServerContext.get_lab, lab_hash)
+            ServerContext.set_lab_context(lab, filename, is_discovered=False)
+            await asyncio.to_thread(save_lab_manifest, lab, filename, get_lab_containers(lab_hash))
+        return {
+            **success_2xx(key_mess="lab_hash", message=lab_hash),
+            "recycled": RECYCLED_IDENTICAL,
+        }
+
+    def new_recycle_job():
+        recycle_job = get_job_registry().create("deploy", lab_hash=lab_hash, ixpconf_filename=filename)
+        recycle_job.start()
+        return recycle_job
+
+    try:
+        job, coalesced = ServerContext.begin_transition(
+            "start", filename, LAB_RELOADING, new_recycle_job, lab_hash=lab_hash
+        )
+    except LabTransitionConflict as e:
+        return error_4xx(response, status.HTTP_409_CONFLICT, message=str(e))
+    if coalesced:
+        logging.info(f"Start of {filename} already in progress, coalesced into job {job.id}")
+        return {
+            **success_2xx(key_mess="lab_hash", message=job.lab_hash),
+            "job_id": job.id,
+            "coalesced": True,
+        }
+
+    get_stats_cache().clear()
+    logging.info(f"♻️ Starting {filename} on the containers of lab {lab_hash}")
+    try:
+        net_scenario = await asyncio.to_thread(reload_lab, filename, job, profile, lab_hash)
+    except LabMismatchError as e:
+        # Nessun container toccato: si procede con wipe + deploy
+        logging.info(f"{e}: falling back to a full start")
+        job.finish(JOB_CANCELLED, error=str(e))
+        return None
+    except JobCancelledError:
+        job.finish(JOB_CANCELLED)
+        raise
+    except Exception as e:
+        job.add_failure(None, str(e))
+        job.finish(JOB_FAILED, error=str(e))
+        raise
+
+    job.lab_hash = net_scenario.hash
+    ServerContext.set_lab_context(net_scenario, filename, is_discovered=False)
+    job.finish(JOB_COMPLETED)
+    logging.info(f"♻️ Lab {lab_hash} recycled for {filename}")
+    return {
+        **success_2xx(key_mess="lab_hash", message=net_scenario.hash),
+        "job_id": job.id,
+        "recycled": RECYCLED_DIFF,
+        "failures": len(job.failures),
+    }
+
+
 @router.get("/running", status_code=status.HTTP_200_OK)
-async def get_namex_running_instance(response: Response):
-    if not ServerContext.get_lab():
+async def get_namex_running_instance(response: Response, lab_hash: str | None = None):
+    context = ServerContext.snapshot(lab_hash)
+    if not context["lab_hash"]:
         return error_4xx(response, status.HTTP_404_NOT_FOUND, message="no lab running")
     return success_2xx(
         key_mess="info",
         message={
-            "hash": ServerContext.get_lab().hash,
-            "discovered": ServerContext.get_is_lab_discovered(),
+            "hash": context["lab_hash"],
+            "discovered": context["is_discovered"],
+            "job_id": context["current_job_id"],
+            "state": context["state"],
         },
     )
 
 
+@router.get("/state", status_code=status.HTTP_200_OK)
+async def get_lab_state(lab_hash: str | None = None):
+    """
+    Atomic snapshot of the lab lifecycle: state (idle, building, queued,
+    deploying, running, reloading, wiping), lab, config and operation in progress
+    """
+    return success_2xx(key_mess="context", message=ServerContext.snapshot(lab_hash))
+
+
+@router.get("/labs", status_code=status.HTTP_200_OK)
+async def get_labs():
+    """
+    Labs known to the backend, with their state; endpoints without lab_hash use the active one
+    """
+    return success_2xx(key_mess="labs", message=ServerContext.list_labs())
+
+
+@router.post("/labs/{lab_hash}/select", status_code=status.HTTP_200_OK)
+async def select_lab(lab_hash: str, response: Response):
+    """
+    Make lab_hash the active lab
+    """
+    if not ServerContext.select_lab(lab_hash):
+        return error_4xx(response, status.HTTP_404_NOT_FOUND, message="lab not found")
+    return success_2xx(key_mess="lab_hash", message=lab_hash)
+
+
+@router.get("/scheduler", status_code=status.HTTP_200_OK)
+async def get_scheduler_status():
+    """
+    Admission queue, deployments in progress, host resources and limits
+    """
+    return success_2xx(key_mess="scheduler", message=get_lab_scheduler().status())
+
+
 @router.post("/wipe", status_code=status.HTTP_200_OK)
-async def wipe_namex_lab(response: Response):
+async def wipe_namex_lab(response: Response, lab_hash: str | None = None):
+    await asyncio.to_thread(ServerContext.wait_for_discovery)
     try:
         logging.info("Starting lab wipe...")
 
         # Pulisci la cache
         get_stats_cache().clear()
 
-        if not ServerContext.get_lab():
+        lab = await asyncio.to_thread(ServerContext.get_lab, lab_hash)
+        if not lab:
             logging.warning("No lab to wipe")
             return success_2xx(message="no lab to wipe")
 
-        lab_hash = ServerContext.get_lab().hash
+        lab_hash = lab.hash
         logging.info(f"Wiping lab with hash: {lab_hash}")
 
-        # Pulisci subito il context per rendere il lab "stopped" nell'interfaccia
-        ServerContext.set_lab(None)
-        ServerContext.set_is_lab_discovered(None)
-        ServerContext.set_ixpconf_filename(None)
-        ServerContext.set_total_machines(None)
-
-        # Esegui wipe in background
-        def do_wipe():
-            try:
-                logging.info("Executing Kathara wipe...")
-                Kathara.get_instance().wipe()
-                logging.info("Kathara wipe completed")
-            except Exception as e:
-                logging.error(f"Error during background wipe: {e}")
-
-        # Avvia wipe in thread separato
-        import threading
-
-        wipe_thread = threading.Thread(target=do_wipe)
-        wipe_thread.start()
+        # Wipe del solo lab indicato, in background e tracciato come job: le operazioni in
+        # corso su quel lab vengono interrotte e il lab risulta subito "stopped" nell'interfaccia
+        wipe_job, coalesced = ServerContext.begin_wipe(lab_hash, lambda: start_wipe_job(lab_hash))
 
         logging.info("Wipe started in background")
-        return success_2xx(message="lab wipe initiated")
+        return {
+            **success_2xx(message="lab wipe initiated"),
+            "job_id": wipe_job.id,
+            "coalesced": coalesced,
+        }
 
     except Exception as e:
         logging.error(f"Error during wipe: {e}")
@@ -239,13 +640,21 @@ async def wipe_namex_lab(response: Response):
 
 
 @router.post("/reload", status_code=status.HTTP_200_OK)
-async def reload_lab_endpoint(ixp_file: ConfigFileModel, response: Response):
+async def reload_lab_endpoint(
+    ixp_file: ConfigFileModel, response: Response, profile: bool = False, lab_hash: str | None = None
+):
     """
     Hot-reload lab configuration without full restart.
     Only redeploys changed devices and updates configurations.
+    With ?profile=true a cProfile of the reload is saved (see /ixp/info/profiles).
+    lab_hash selects the lab to reload (default: the active one).
     """
+    from reload_lab import reload_lab
+
+    await asyncio.to_thread(ServerContext.wait_for_discovery)
     try:
-        if not ServerContext.get_lab():
+        lab = await asyncio.to_thread(ServerContext.get_lab, lab_hash)
+        if not lab:
             return error_4xx(
                 response,
                 status.HTTP_400_BAD_REQUEST,
@@ -256,23 +665,69 @@ async def reload_lab_endpoint(ixp_file: ConfigFileModel, response: Response):
         logging.info(f"=== RELOAD LAB REQUEST ===")
         logging.info(f"Reloading lab with config: {filename}")
 
+        lab_hash = lab.hash
+        if ServerContext.get_state(lab_hash) in (LAB_QUEUED, LAB_DEPLOYING):
+            return error_4xx(
+                response, status.HTTP_409_CONFLICT, message=f"lab {lab_hash} is {ServerContext.get_state(lab_hash)}"
+            )
+
+        def new_reload_job():
+            reload_job = get_job_registry().create("reload", lab_hash=lab_hash, ixpconf_filename=filename)
+            reload_job.start()
+            return reload_job
+
+        try:
+            job, coalesced = ServerContext.begin_transition(
+                "reload", filename, LAB_RELOADING, new_reload_job, lab_hash=lab_hash
+            )
+        except LabTransitionConflict as e:
+            return error_4xx(response, status.HTTP_409_CONFLICT, message=str(e))
+
+        if coalesced:
+            # Stesso reload già in corso: si attende il suo esito invece di ripeterlo
+            logging.info(f"Reload of {filename} already in progress, coalesced into job {job.id}")
+            await asyncio.to_thread(job.wait)
+            if job.status != JOB_COMPLETED:
+                return error_5xx(response, message=f"Failed to reload lab: {job.error or job.status}")
+            return {
+                **success_2xx(key_mess="lab_hash", message=job.lab_hash),
+                "job_id": job.id,
+                "coalesced": True,
+            }
+
         # Pulisci la cache
         get_stats_cache().clear()
 
-        # Execute hot-reload
-        net_scenario = reload_lab(filename)
-
-        # Aggiorna ServerContext
-        ServerContext.set_lab(net_scenario)
-        ServerContext.set_ixpconf_filename(filename)
-        ServerContext.set_total_machines(net_scenario.machines)
+        # Execute hot-reload (fuori dall'event loop)
+        try:
+            net_scenario = await asyncio.to_thread(reload_lab, filename, job, profile)
+        except JobCancelledError:
+            job.finish(JOB_CANCELLED)
+            raise
+        except Exception as e:
+            job.add_failure(None, str(e))
+            job.finish(JOB_FAILED, error=str(e))
+            raise
+
+        # Aggiorna ServerContext prima di chiudere il job (lo stato torna "running")
+        job.lab_hash = net_scenario.hash
+        ServerContext.set_lab_context(net_scenario, filename, ServerContext.get_is_lab_discovered(lab_hash))
+        job.finish(JOB_COMPLETED)
 
         logging.info(f"Lab reloaded successfully. New hash: {net_scenario.hash}")
         logging.info(f"Total machines: {len(net_scenario.machines)}")
         logging.info(f"=========================")
 
-        return success_2xx(key_mess="lab_hash", message=net_scenario.hash)
+        # I device su cui il push è fallito sono nei failures del job (ritentati al prossimo reload)
+        return {
+            **success_2xx(key_mess="lab_hash", message=net_scenario.hash),
+            "job_id": job.id,
+            "failures": len(job.failures),
+        }
 
+    except JobCancelledError:
+        logging.warning("Reload cancelled")
+        return error_4xx(response, status.HTTP_409_CONFLICT, message="reload cancelled")
     except FileNotFoundError as e:
         logging.error(f"Config file not found: {e}")
         return error_4xx(
@@ -286,56 +741,448 @@ async def reload_lab_endpoint(ixp_file: ConfigFileModel, response: Response):
         return error_5xx(response, message=f"Failed to reload lab: {str(e)}")
 
 
+@router.post("/reload/plan", status_code=status.HTTP_200_OK)
+async def plan_reload_endpoint(ixp_file: ConfigFileModel, response: Response, lab_hash: str | None = None):
+    """
+    Dry run of /ixp/reload: devices to add, remove, recreate and reconfigure,
+    estimated push volume and duration. Docker is not touched.
+    """
+    from reload_lab import plan_reload
+
+    await asyncio.to_thread(ServerContext.wait_for_discovery)
+    context = ServerContext.snapshot(lab_hash)
+    if not context["lab_hash"]:
+        return error_4xx(
+            response,
+            status.HTTP_400_BAD_REQUEST,
+            message="No lab is currently running. Use /ixp/start instead.",
+        )
+    if context["state"] != LAB_RUNNING or context["transition"] is not None:
+        # Il piano usa gli stessi singleton di digital_twin del build in corso
+        return error_4xx(response, status.HTTP_409_CONFLICT, message=f"lab is {context['state']}, retry later")
+
+    filename = ixp_file.filename
+    try:
+        running_devices = set(await asyncio.to_thread(ServerContext.get_total_machines, context["lab_hash"]) or {})
+        plan = await asyncio.to_thread(plan_reload, filename, context["lab_hash"], running_devices)
+        return success_2xx(key_mess="plan", message=plan)
+    except FileNotFoundError as e:
+        logging.error(f"Config file not found: {e}")
+        return error_4xx(
+            response,
+            status.HTTP_404_NOT_FOUND,
+            message=f"Configuration file not found: {filename}",
+        )
+    except Exception as e:
+        logging.error(f"Failed to plan reload: {e}")
+        logging.error(traceback.format_exc())
+        return error_5xx(response, message=f"Failed to plan reload: {str(e)}")
+
+
 @router.post("/hot_reload", status_code=status.HTTP_200_OK)
 async def hot_reload_namex_lab(lab: BodyLab, response: Response):
     """
     Legacy hot reload endpoint (usa lab hash per validazione)
     """
-    if not ServerContext.get_lab():
-        return error_4xx(response, status.HTTP_404_NOT_FOUND, message="no lab running")
-    if ServerContext.get_lab().hash != lab.hash:
+    context = ServerContext.snapshot(lab.hash)
+    if not context["lab_hash"]:
         return error_4xx(response, status.HTTP_404_NOT_FOUND, message="lab not found")
+    if not context["ixpconf_filename"]:
+        return error_4xx(response, message="the running lab has no ixpconf, use /ixp/reload")
+    # Stesso percorso di /reload: lock, coalescing e job
+    return await reload_lab_endpoint(
+        ConfigFileModel(filename=context["ixpconf_filename"]), response, lab_hash=lab.hash
+    )
+
+
+# ==================== JOBS ENDPOINTS ====================
+
+@router.get("/jobs", status_code=status.HTTP_200_OK)
+async def list_jobs(kind: str | None = None):
+    """
+    List deploy/reload jobs, most recent first
+    """
+    jobs = [job.to_dict() for job in get_job_registry().list(kind)]
+    return JSONResponse(content={"result": "success", "jobs": jobs})
+
+
+@router.get("/jobs/{job_id}", status_code=status.HTTP_200_OK)
+async def get_job_progress(job_id: str, response: Response):
+    """
+    Progress of a job: current phase, phase timings, devices completed and failures
+    """
+    job = get_job_registry().get(job_id)
+    if job is None:
+        return error_4xx(response, status.HTTP_404_NOT_FOUND, message="job not found")
+    return success_2xx(key_mess="job", message=job.to_dict())
+
+
+@router.post("/jobs/{job_id}/cancel", status_code=status.HTTP_202_ACCEPTED)
+async def cancel_job(job_id: str, response: Response):
+    """
+    Request cooperative cancellation: the job stops at the next phase or device boundary
+    """
+    job = get_job_registry().get(job_id)
+    if job is None:
+        return error_4xx(response, status.HTTP_404_NOT_FOUND, message="job not found")
+    if not job.cancel():
+        return error_4xx(response, status.HTTP_409_CONFLICT, message=f"job already {job.status}")
+    return success_2xx(message="cancellation requested")
+
+
+@router.websocket("/jobs/{job_id}/events")
+async def job_events_via_websocket(ws: WebSocket, job_id: str, since: int = 0):
+    """
+    Stream job events as they happen, closing once the job is finished
+    """
+    await ws.accept()
+    job = get_job_registry().get(job_id)
+    if job is None:
+        await ws.send_json({"type": "error", "message": "job not found"})
+        await ws.close()
+        return
+
+    next_seq = max(since, 0)
+    try:
+        while True:
+            finished = job.is_finished()
+            for event in job.events_since(next_seq):
+                await ws.send_json(event)
+                next_seq = event["seq"] + 1
+            if finished:
+                await ws.send_json({"type": "snapshot", "data": job.to_dict()})
+                break
+            await asyncio.sleep(0.5)
+        await ws.close()
+    except WebSocketDisconnect:
+        logging.info("Job events WS Client Disconnected")
+
+
+# ==================== IMAGES ====================
+
+@router.get("/images", status_code=status.HTTP_200_OK)
+async def get_images_readiness(ixpconf: str | None = None):
+    """
+    Image prewarm status; with ixpconf, also the images that config needs and are not ready
+    """
+    return success_2xx(key_mess="images", message=get_image_prewarmer().status(ixpconf))
+
+
+@router.post("/images/prewarm", status_code=status.HTTP_202_ACCEPTED)
+async def prewarm_images(response: Response, ixpconf: str | None = None):
+    """
+    Check/pull/unpack the images needed by ixpconf (or by every known config) in background
+    """
+    if not get_image_prewarmer().start(get_required_images(ixpconf)):
+        return error_4xx(response, status.HTTP_409_CONFLICT, message="image prewarm already running")
+    return success_2xx(message="image prewarm started")
+
+
+# ==================== CHECKPOINTS ====================
+
+@router.post("/checkpoints", status_code=status.HTTP_201_CREATED)
+async def create_lab_checkpoint(data: CheckpointModel, response: Response):
+    """
+    Save the running lab build artefacts and its device -> container map.
+    With stop=true the containers are stopped (lab hibernated) and can be
+    restarted later through /ixp/checkpoints/{checkpoint_id}/restore.
+    """
+    state = ServerContext.get_state(data.lab_hash)
+    if state != LAB_RUNNING:
+        return error_4xx(response, status.HTTP_409_CONFLICT, message=f"lab is {state}, not running")
+    lab = await asyncio.to_thread(ServerContext.get_lab, data.lab_hash)
+    if lab is None:
+        return error_4xx(response, status.HTTP_409_CONFLICT, message="no lab is running")
+
+    def new_checkpoint_job():
+        checkpoint_job = get_job_registry().create(
+            "checkpoint", lab_hash=lab.hash, ixpconf_filename=ServerContext.get_ixpconf_filename(lab.hash)
+        )
+        checkpoint_job.start()
+        return checkpoint_job
+
+    # Con stop=true i container vengono fermati: non deve sovrapporsi a un reload/restore dello stesso lab
+    try:
+        job, coalesced = ServerContext.begin_transition(
+            "checkpoint", lab.hash, LAB_RUNNING, new_checkpoint_job, lab_hash=lab.hash
+        )
+    except LabTransitionConflict as e:
+        return error_4xx(response, status.HTTP_409_CONFLICT, message=str(e))
+    if coalesced:
+        return error_4xx(response, status.HTTP_409_CONFLICT, message=f"checkpoint of lab {lab.hash} already in progress")
+
     try:
-        new_lab = reload_lab(ServerContext.get_ixpconf_filename())
-        ServerContext.set_lab(new_lab)
-        return success_2xx(key_mess="lab_hash", message=ServerContext.get_lab().hash)
+        checkpoint = await asyncio.to_thread(create_checkpoint, name=data.name, stop=data.stop, lab_hash=lab.hash)
+        job.finish(JOB_COMPLETED)
+        return success_2xx(key_mess="checkpoint", message={k: v for k, v in checkpoint.items() if k != "devices"})
+    except CheckpointError as e:
+        job.finish(JOB_FAILED, error=str(e))
+        return error_4xx(response, status.HTTP_409_CONFLICT, message=str(e))
     except Exception as e:
-        logging.error(f"Error reloading the Lab: {e}")
-        return error_5xx(response, message="couldn't start lab")
+        logging.error(f"Error creating checkpoint: {e}")
+        logging.error(traceback.format_exc())
+        job.add_failure(None, str(e))
+        job.finish(JOB_FAILED, error=str(e))
+        return error_5xx(response, message=f"Error creating checkpoint: {str(e)}")
+
+
+@router.get("/checkpoints", status_code=status.HTTP_200_OK)
+async def get_lab_checkpoints():
+    return success_2xx(key_mess="checkpoints", message=list_checkpoints())
+
 
+@router.get("/checkpoints/{checkpoint_id}", status_code=status.HTTP_200_OK)
+async def get_lab_checkpoint(checkpoint_id: str, response: Response):
+    checkpoint = get_checkpoint(checkpoint_id)
+    if checkpoint is None:
+        return error_4xx(response, status.HTTP_404_NOT_FOUND, message="checkpoint not found")
+    return success_2xx(key_mess="checkpoint", message=checkpoint)
+
+
+@router.delete("/checkpoints/{checkpoint_id}", status_code=status.HTTP_200_OK)
+async def delete_lab_checkpoint(checkpoint_id: str, response: Response):
+    if not delete_checkpoint(checkpoint_id):
+        return error_4xx(response, status.HTTP_404_NOT_FOUND, message="checkpoint not found")
+    return success_2xx(message=f"checkpoint {checkpoint_id} deleted")
+
+
+@router.post("/checkpoints/{checkpoint_id}/restore", status_code=status.HTTP_202_ACCEPTED)
+async def restore_lab_checkpoint(checkpoint_id: str, response: Response):
+    """
+    Warm restore: restart the checkpointed containers and reattach the lab,
+    skipping dumps loading and configuration rendering.
+    The lab is ready (and reported by /ixp/running) once the returned job completes.
+    """
+    checkpoint = get_checkpoint(checkpoint_id)
+    if checkpoint is None:
+        return error_4xx(response, status.HTTP_404_NOT_FOUND, message="checkpoint not found")
+
+    def new_restore_job():
+        restore_job = get_job_registry().create(
+            "restore", lab_hash=checkpoint["lab_hash"], ixpconf_filename=checkpoint.get("ixpconf_filename")
+        )
+        restore_job.start()
+        return restore_job
+
+    try:
+        job, coalesced = ServerContext.begin_transition(
+            "restore", checkpoint["lab_hash"], LAB_DEPLOYING, new_restore_job, lab_hash=checkpoint["lab_hash"]
+        )
+    except LabTransitionConflict as e:
+        return error_4xx(response, status.HTTP_409_CONFLICT, message=str(e))
+    if coalesced:
+        return {
+            **success_2xx(key_mess="lab_hash", message=checkpoint["lab_hash"]),
+            "job_id": job.id,
+            "coalesced": True,
+        }
+
+    get_stats_cache().clear()
+
+    def do_restore():
+        try:
+            restore_checkpoint(checkpoint, job)
+            job.finish(JOB_COMPLETED)
+        except JobCancelledError:
+            logging.warning(f"Restore of checkpoint {checkpoint_id} cancelled")
+            job.finish(JOB_CANCELLED)
+        except Exception as e:
+            logging.error(f"Restore of checkpoint {checkpoint_id} failed: {e}")
+            job.add_failure(None, str(e))
+            job.finish(JOB_FAILED, error=str(e))
+
+    threading.Thread(target=do_restore, daemon=True).start()
+
+    return {
+        **success_2xx(key_mess="lab_hash", message=checkpoint["lab_hash"]),
+        "job_id": job.id,
+    }
+
+
+# ==================== COMMAND EXECUTION ENDPOINTS ====================
 
 @router.post("/execute_command/{rs_name}", status_code=status.HTTP_200_OK)
 async def execute_command_on_rs(
-    rs_name: str, command: Annotated[str, Body()], response: Response
+    rs_name: str, command: Annotated[str, Body()], response: Response, lab_hash: str | None = None,
+    timeout: float | None = Query(default=None, gt=0),
 ):
     """
-    Execute a command on a specific device
+    Execute a command on a specific device, on the exec executor (utils/exec_pool.py)
     """
     logging.info(f"Executing command on {rs_name}: {command}")
 
-    if ServerContext.get_lab() is None:
-        return error_4xx(response, status.HTTP_404_NOT_FOUND, message="lab not found")
-
-    machine_names = get_running_machines_names(ServerContext.get_lab().hash)
-
-    if rs_name not in machine_names:
-        logging.warning(f"Machine {rs_name} not found in running machines")
-        return error_4xx(
-            response, status.HTTP_404_NOT_FOUND, message="machine not found"
-        )
+    lab, error = await _get_exec_target(rs_name, lab_hash)
+    if lab is None:
+        return error_4xx(response, status.HTTP_404_NOT_FOUND, message=error)
 
     try:
         logging.info(f"Executing command on machine {rs_name}")
-        command_output = execute_command_on_machine(
-            rs_name, command, ServerContext.get_lab()
-        )
+        command_output = await get_exec_pool().execute_command(rs_name, command, lab, timeout=timeout)
         logging.info(f"Command output: {command_output}")
         return success_2xx(message=command_output)
+    except ExecTimeout as e:
+        return error_5xx(response, status.HTTP_504_GATEWAY_TIMEOUT, message=f"Error executing command: {e}")
     except Exception as e:
         logging.error(f"Error executing command: {e}")
         return error_5xx(response, message=f"Error executing command: {str(e)}")
 
 
+@router.post("/execute_command", status_code=status.HTTP_200_OK)
+async def fan_out_command(body: FanOutModel, response: Response):
+    """
+    Execute a command on all the running devices matching the selectors (names, glob,
+    role), concurrently. One JSON event per line: the selected devices, the result of
+    each device as it completes (exit code, duration, output), then a summary.
+    """
+    lab = await asyncio.to_thread(ServerContext.get_lab, body.lab_hash)
+    if lab is None:
+        return error_4xx(response, status.HTTP_404_NOT_FOUND, message="lab not found")
+    if body.concurrency is not None and body.concurrency < 1:
+        return error_4xx(response, message="concurrency must be at least 1")
+
+    # Una sola query Docker per tutti i device, al posto di un get_lab_from_api per comando
+    containers = {
+        c.labels.get("name"): c
+        for c in await asyncio.to_thread(get_lab_containers, lab.hash) if c.status == "running"
+    }
+    route_servers = get_route_servers_from_ixpconf_name(ServerContext.get_ixpconf_filename(lab.hash))
+    if body.role and not route_servers:
+        # Lab scoperto (o ixpconf senza route server): i ruoli non sono noti, la selezione sarebbe vuota
+        return error_4xx(
+            response, status.HTTP_409_CONFLICT,
+            message=f"role selection needs the ixpconf of lab {lab.hash} "
+                    f"(set it with POST /ixp/file/running_ixpconf), select devices by name or glob instead",
+        )
+    selected = select_devices(list(containers), route_servers, body.devices, body.glob, body.role)
+    if not selected:
+        return error_4xx(response, status.HTTP_404_NOT_FOUND, message="no running device matches the selectors")
+    logging.info(f"Executing command on {len(selected)} devices: {body.command}")
+
+    async def ndjson():
+        started = time.perf_counter()
+        failed = 0
+        yield json.dumps({"type": "selected", "devices": selected}) + "\n"
+        async for result in fan_out({name: containers[name] for name in selected}, body.command,
+                                    body.concurrency, body.timeout):
+            failed += result["exit_code"] != 0
+            yield json.dumps({"type": "result", **result}) + "\n"
+        yield json.dumps({
+            "type": "summary",
+            "devices": len(selected),
+            "succeeded": len(selected) - failed,
+            "failed": failed,
+            "duration_s": round(time.perf_counter() - started, 3),
+        }) + "\n"
+
+    return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+
+
+@router.post("/execute_command/{rs_name}/benchmark", status_code=status.HTTP_200_OK)
+async def benchmark_command_on_rs(
+    rs_name: str, response: Response, command: Annotated[str, Body()] = "true", lab_hash: str | None = None,
+    iterations: int = Query(default=20, ge=1, le=MAX_BENCHMARK_ITERATIONS),
+):
+    """
+    Compare the per-command latency of the Kathara exec path and of the Docker fast path
+    on a device (run the command only if it is read-only: it is executed 2 * (iterations + 1) times)
+    """
+    lab, error = await _get_exec_target(rs_name, lab_hash)
+    if lab is None:
+        return error_4xx(response, status.HTTP_404_NOT_FOUND, message=error)
+    try:
+        report = await asyncio.to_thread(benchmark_exec, lab, rs_name, command, iterations)
+        return success_2xx(key_mess="benchmark", message=report)
+    except Exception as e:
+        logging.error(f"Error benchmarking command: {e}")
+        return error_5xx(response, message=f"Error benchmarking command: {str(e)}")
+
+
+async def _get_exec_target(rs_name: str, lab_hash: str | None):
+    """Lab on which rs_name is running, or the error message (lab not found, machine not found)"""
+    lab = await asyncio.to_thread(ServerContext.get_lab, lab_hash)
+    if lab is None:
+        return None, "lab not found"
+    if rs_name not in await asyncio.to_thread(get_running_machines_names, lab.hash):
+        logging.warning(f"Machine {rs_name} not found in running machines")
+        return None, "machine not found"
+    return lab, None
+
+
+@router.post("/execute_command/{rs_name}/stream", status_code=status.HTTP_200_OK)
+async def stream_command_on_rs(
+    rs_name: str, command: Annotated[str, Body()], response: Response, lab_hash: str | None = None
+):
+    """
+    Execute a command on a device relaying its output as it arrives, one JSON event
+    per line (started, stdout, stderr, then end or error). Closing the connection
+    kills the command.
+    """
+    lab, error = await _get_exec_target(rs_name, lab_hash)
+    if lab is None:
+        return error_4xx(response, status.HTTP_404_NOT_FOUND, message=error)
+    try:
+        stream = get_exec_pool().open_stream(rs_name, command, lab)
+    except ExecStreamLimit as e:
+        return error_4xx(response, status.HTTP_429_TOO_MANY_REQUESTS, message=str(e))
+    logging.info(f"Streaming command on {rs_name}: {command}")
+
+    async def ndjson():
+        try:
+            async for event in stream.events():
+                yield json.dumps(event) + "\n"
+        finally:
+            # Client disconnesso prima della fine del comando
+            await stream.cancel()
+
+    return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+
+
+@router.websocket("/execute_command/{rs_name}/stream")
+async def stream_command_via_websocket(ws: WebSocket, rs_name: str, lab_hash: str | None = None):
+    """
+    Execute a command on a device relaying its output as it arrives. The client sends
+    {"command": "..."} and then {"type": "cancel"} (or disconnects) to kill the command;
+    the server sends started, stdout, stderr events and then end, error or cancelled.
+    """
+    await ws.accept()
+    stream = None
+    try:
+        lab, error = await _get_exec_target(rs_name, lab_hash)
+        command = (await ws.receive_json()).get("command") if lab is not None else None
+        if lab is None or not command:
+            await ws.send_json({"type": "error", "message": error or "command missing"})
+            await ws.close()
+            return
+        try:
+            stream = get_exec_pool().open_stream(rs_name, command, lab)
+        except ExecStreamLimit as e:
+            await ws.send_json({"type": "error", "message": str(e)})
+            await ws.close()
+            return
+        logging.info(f"Streaming command on {rs_name} via WebSocket: {command}")
+
+        async def wait_for_cancel():
+            try:
+                while (await ws.receive_json()).get("type") != "cancel":
+                    pass
+            except WebSocketDisconnect:
+                logging.info("Command stream WS Client Disconnected")
+            await stream.cancel()
+
+        cancel_listener = asyncio.create_task(wait_for_cancel())
+        try:
+            async for event in stream.events():
+                await ws.send_json(event)
+        finally:
+            cancel_listener.cancel()
+        await ws.close()
+    except WebSocketDisconnect:
+        logging.info("Command stream WS Client Disconnected")
+    finally:
+        if stream is not None:
+            await stream.cancel()
+
+
 # ==================== HELPER FUNCTIONS ====================
 
 def calculate_cpu_percent(stats, machine_name):
@@ -467,12 +1314,11 @@ def calculate_uptime(container, machine_name):
 # ==================== DEVICES ENDPOINT ====================
 
 @router.get("/devices", status_code=status.HTTP_200_OK)
-async def get_lab_devices(response: Response):
-    if not ServerContext.get_lab():
+async def get_lab_devices(response: Response, lab_hash: str | None = None):
+    lab = await asyncio.to_thread(ServerContext.get_lab, lab_hash)
+    if not lab:
         return error_4xx(response, status.HTTP_404_NOT_FOUND, message="no lab running")
 
-    lab = ServerContext.get_lab()
-
     # Prova a usare la cache (5 secondi TTL)
     cache_key = f"devices_{lab.hash}"
     from routers.infos import _stats_cache
@@ -488,6 +1334,8 @@ async def get_lab_devices(response: Response):
         # Usa il docker client singleton e ottieni tutti i container una volta sola
         from routers.infos import get_docker_client
 
+        from docker.errors import NotFound
+
         docker_client = get_docker_client()
         all_containers = docker_client.containers.list()
         logging.info(f"Found {len(all_containers)} running containers")
@@ -536,7 +1384,7 @@ async def get_lab_devices(response: Response):
                                 f"Found container {possible_name} for device {machine_name}"
                             )
                             break
-                        except docker.errors.NotFound:
+                        except NotFound:
                             continue
 
                 if not container:
@@ -4,6 +4,8 @@ import os
 from pathlib import Path
 import logging
 
+from utils.file_utils import write_file_atomically
+
 router = APIRouter(tags=["Files"])
 
 # Directory dei file
@@ -80,8 +82,7 @@ async def create_config_file(data: dict):
         
         ensure_directory_exists(CONFIGS_DIR)
         
-        with open(file_path, "w", encoding="utf-8") as f:
-            f.write(content)
+        write_file_atomically(file_path, content)
         
         logging.info(f"Config file created: {filename}")
         return {"message": f"File {filename} created successfully", "filename": filename}
@@ -102,8 +103,7 @@ async def update_config_file(filename: str, data: dict):
         
         content = data.get("content", "")
         
-        with open(file_path, "w", encoding="utf-8") as f:
-            f.write(content)
+        write_file_atomically(file_path, content)
         
         logging.info(f"Config file updated: {filename}")
         return {"message": f"File {filename} updated successfully", "filename": filename}
@@ -121,8 +121,7 @@ async def upload_config_file(file: UploadFile = File(...)):
         file_path = CONFIGS_DIR / file.filename
         
         content = await file.read()
-        with open(file_path, "wb") as f:
-            f.write(content)
+        write_file_atomically(file_path, content)
         
         logging.info(f"Config file uploaded: {file.filename}")
         return {"message": f"File {file.filename} uploaded successfully", "filename": file.filename}
@@ -186,8 +185,7 @@ async def create_resource_file(data: dict):
         
         ensure_directory_exists(RESOURCES_DIR)
         
-        with open(file_path, "w", encoding="utf-8") as f:
-            f.write(content)
+        write_file_atomically(file_path, content)
         
         logging.info(f"Resource file created: {filename}")
         return {"message": f"File {filename} created successfully", "filename": filename}
@@ -208,8 +206,7 @@ async def update_resource_file(filename: str, data: dict):
         
         content = data.get("content", "")
         
-        with open(file_path, "w", encoding="utf-8") as f:
-            f.write(content)
+        write_file_atomically(file_path, content)
         
         logging.info(f"Resource file updated: {filename}")
         return {"message": f"File {filename} updated successfully", "filename": filename}
@@ -227,8 +224,7 @@ async def upload_resource_file(file: UploadFile = File(...)):
         file_path = RESOURCES_DIR / file.filename
         
         content = await file.read()
-        with open(file_path, "wb") as f:
-            f.write(content)
+        write_file_atomically(file_path, content)
         
         logging.info(f"Resource file uploaded: {file.filename}")
         return {"message": f"File {file.filename} uploaded successfully", "filename": file.filename}
@@ -1,7 +1,7 @@
+import asyncio
 import logging
+import os
 import time
-import docker
-from datetime import datetime, timedelta
 
 from starlette.websockets import WebSocketDisconnect
 from model.rib import RibDump
@@ -10,48 +10,36 @@ from utils.ixpconf_util import exists_file_in_ixpconfigs, get_rib_names_from_ixp
     get_ribs_content_from_ixpconf_name
 
 from utils.responses import *
-from Kathara.exceptions import MachineNotFoundError
-from Kathara.manager.Kathara import Kathara
 from fastapi import APIRouter, status, Response, WebSocket, Query
 from utils.logs_utils import read_logs_file_content, init_logs_ws, get_ws_sync_payload, count_log_lines
 from utils.responses import success_2xx, error_4xx
 from utils.server_context import ServerContext
+from cache_manager import get_stats_cache
 from utils.lab_utils import get_running_machines_names as get_running_machines_names_from_lab, filter_machines_info, \
-    execute_command_on_machine
+    get_kathara
 from utils.docker_utils import get_docker_client, get_all_running_containers, find_container_by_name
+from utils.profiler import read_profile_history, get_profile_record
+from utils.startup_timing import get_startup_timer, get_workers_startup
+from utils.deploy_waves import get_deploy_reports, get_wave_limits
+from utils.exec_pool import get_exec_pool, ExecTimeout
+from utils.exec_channels import get_exec_channels
+from globals import BACKEND_PROFILES_FOLDER
+from fastapi.responses import FileResponse
 
 router = APIRouter(prefix="/ixp/info", tags=["IXP Info"])
 
 # ==================== CACHE SYSTEM ====================
 
-class SimpleCache:
-    def __init__(self, ttl_seconds=5):
-        self._cache = {}
-        self.ttl = timedelta(seconds=ttl_seconds)
-    
-    def get(self, key):
-        if key in self._cache:
-            data, timestamp = self._cache[key]
-            if datetime.now() - timestamp < self.ttl:
-                return data
-            else:
-                del self._cache[key]
-        return None
-    
-    def set(self, key, data):
-        self._cache[key] = (data, datetime.now())
-    
-    def clear(self):
-        self._cache.clear()
-
-# Cache globale con TTL di 5 secondi
-_stats_cache = SimpleCache(ttl_seconds=5)
+# Cache con TTL di 5 secondi, condivisa tra i worker (cache_manager.py)
+_stats_cache = get_stats_cache()
 _docker_client = None
 
 def get_docker_client():
     """Docker client singleton"""
     global _docker_client
     if _docker_client is None:
+        import docker
+
         _docker_client = docker.from_env()
     return _docker_client
 
@@ -73,22 +61,24 @@ def clear_cache():
 
 
 @router.get("/context")
-async def context(response: Response):
-    if ServerContext.get_lab() is not None:
+async def context(response: Response, lab_hash: str | None = None):
+    context = ServerContext.snapshot(lab_hash)
+    if context["lab_hash"] is not None:
         return {
-            "result": ServerContext is not None,
-            "lab": ServerContext.get_lab().name,
-            "is_discovered": ServerContext.get_is_lab_discovered(),
-            "ixpconfs": ServerContext.get_ixpconf_filename(),
-            "lab_hash": ServerContext.get_lab().hash,
-            "lab_machines": len(ServerContext.get_lab().machines) 
+            "result": True,
+            "lab": context["lab_name"],
+            "is_discovered": context["is_discovered"],
+            "ixpconfs": context["ixpconf_filename"],
+            "lab_hash": context["lab_hash"],
+            "lab_machines": context["lab_machines"],
+            "state": context["state"],
         }
     return error_4xx(response, status.HTTP_404_NOT_FOUND, message="no server context")
 
 
 @router.get("/context/ixp_conf")
-async def get_ixp_conf_context(response: Response):
-    if ixp_ctx := ServerContext.get_ixpconf_filename():
+async def get_ixp_conf_context(response: Response, lab_hash: str | None = None):
+    if ixp_ctx := ServerContext.get_ixpconf_filename(lab_hash):
         return success_2xx(message=ixp_ctx)
     else:
         return error_4xx(response=response, status_code=status.HTTP_404_NOT_FOUND, message="ixp.conf context not found")
@@ -105,21 +95,23 @@ async def get_logs(response: Response):
 
 
 @router.get("/stats/", status_code=status.HTTP_200_OK)
-async def get_machine_stats(response: Response):
+async def get_machine_stats(response: Response, lab_hash: str | None = None):
     """Stats con caching per ridurre il carico"""
-    
-    if not ServerContext.get_lab():
+    from Kathara.exceptions import MachineNotFoundError
+
+    lab = await asyncio.to_thread(ServerContext.get_lab, lab_hash)
+    if not lab:
         return error_4xx(response, message="Lab not found")
     
     # Prova cache
-    cache_key = f"stats_{ServerContext.get_lab().hash}"
+    cache_key = f"stats_{lab.hash}"
     cached_stats = _stats_cache.get(cache_key)
     
     if cached_stats is not None:
         return success_2xx(key_mess="stats", message=cached_stats)
     
     try:
-        stats_gen = Kathara.get_instance().get_machines_stats(ServerContext.get_lab().hash)
+        stats_gen = get_kathara().get_machines_stats(lab.hash)
         stats = next(stats_gen)
         
         stats_dict = {}
@@ -139,12 +131,13 @@ async def get_machine_stats(response: Response):
 
 
 @router.get("/machines/count/running", status_code=status.HTTP_200_OK)
-async def get_running_machines_count(response: Response):
-    if not ServerContext.get_lab() or not ServerContext.get_lab().hash:
+async def get_running_machines_count(response: Response, lab_hash: str | None = None):
+    lab = await asyncio.to_thread(ServerContext.get_lab, lab_hash)
+    if not lab or not lab.hash:
         return error_4xx(response, message="cannot find lab")
     
     try:
-        count = len(Kathara.get_instance().get_lab_from_api(ServerContext.get_lab().hash).machines)
+        count = len(get_kathara().get_lab_from_api(lab.hash).machines)
         return success_2xx(key_mess="count", message=count)
     except Exception as e:
         logging.error(f"Error getting running machines count: {e}")
@@ -152,19 +145,21 @@ async def get_running_machines_count(response: Response):
 
 
 @router.get("/machines/count/all/", status_code=status.HTTP_200_OK)
-async def get_total_machines_count(response: Response):
-    if not ServerContext.get_lab() or not ServerContext.get_lab().hash:
+async def get_total_machines_count(response: Response, lab_hash: str | None = None):
+    lab = await asyncio.to_thread(ServerContext.get_lab, lab_hash)
+    if not lab or not lab.hash:
         return error_4xx(response=response, message="cannot find lab")
-    return success_2xx(key_mess="count", message=len(ServerContext.get_lab().machines))
+    return success_2xx(key_mess="count", message=len(lab.machines))
 
 
 @router.get("/machines/names/all/", status_code=status.HTTP_200_OK)
-async def get_running_machines_names(response: Response):
-    if not ServerContext.get_lab() or not ServerContext.get_lab().hash:
+async def get_running_machines_names(response: Response, lab_hash: str | None = None):
+    lab = await asyncio.to_thread(ServerContext.get_lab, lab_hash)
+    if not lab or not lab.hash:
         return error_4xx(response=response, status_code=status.HTTP_404_NOT_FOUND, message="cannot find lab")
     
     try:
-        names = get_running_machines_names_from_lab(ServerContext.get_lab().hash)
+        names = get_running_machines_names_from_lab(lab.hash)
         return success_2xx(message=names)
     except Exception as e:
         logging.error(f"Error getting machine names: {e}")
@@ -213,7 +208,7 @@ async def get_docker_machines():
         return success_2xx(message=cached_machines)
     
     try:
-        docker_machines = next(Kathara.get_instance().get_machines_stats())
+        docker_machines = next(get_kathara().get_machines_stats())
         filtered = filter_machines_info(docker_machines)
         
         # Salva in cache
@@ -251,9 +246,10 @@ async def get_ribs_diff(
     response: Response, 
     machine_name: str, 
     ixp_conf_arg: str | None = None, 
-    machine_ip_type: int = Query(default=4, ge=4, le=6)
+    machine_ip_type: int = Query(default=4, ge=4, le=6),
+    lab_hash: str | None = None,
 ):
-    ixp_conf_name = ixp_conf_arg if ixp_conf_arg else ServerContext.get_ixpconf_filename()
+    ixp_conf_name = ixp_conf_arg if ixp_conf_arg else ServerContext.get_ixpconf_filename(lab_hash)
     
     if not ixp_conf_name:
         return error_4xx(
@@ -279,7 +275,13 @@ async def get_ribs_diff(
         
         # Esegui comando bgpctl show rib
         logging.info(f"Executing 'bgpctl show rib' on {machine_name}")
-        command_result = execute_command_on_machine(machine_name, "bgpctl show rib", ServerContext.get_lab())
+        try:
+            command_result = await get_exec_pool().execute_command(
+                machine_name, "bgpctl show rib", await asyncio.to_thread(ServerContext.get_lab, lab_hash)
+            )
+        except ExecTimeout as e:
+            return error_5xx(response=response, status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+                             message=f"Error getting rib diff: {e}")
         
         actual_ribs_content = command_result if isinstance(command_result, str) else str(command_result)
         
@@ -330,6 +332,65 @@ async def get_ribs_diff(
         logging.error(traceback.format_exc())
         return error_5xx(response=response, message=f"Error getting rib diff: {str(e)}")
 
+
+@router.get("/startup", status_code=status.HTTP_200_OK)
+async def get_startup_timings():
+    """Seconds from process start to imports, startup hook, lab discovery and first request, per worker"""
+    return success_2xx(key_mess="startup", message={
+        "worker": get_startup_timer().report(),
+        "workers": get_workers_startup(),
+    })
+
+
+@router.get("/deploy-waves", status_code=status.HTTP_200_OK)
+async def get_deploy_waves():
+    """Wave sizes, timings and throughput of the last deploy of each lab, with the current limits"""
+    return success_2xx(key_mess="deploy_waves", message={
+        "limits": get_wave_limits(),
+        "deploys": get_deploy_reports(),
+    })
+
+
+@router.get("/exec-pool", status_code=status.HTTP_200_OK)
+async def get_exec_pool_status():
+    """Size, timeout and counters of the executor running the device commands of this worker"""
+    return success_2xx(key_mess="exec_pool", message={
+        **get_exec_pool().status(),
+        "fast_path": get_exec_channels().status(),
+    })
+
+
+@router.get("/profiles", status_code=status.HTTP_200_OK)
+async def get_build_profiles(operation: str | None = None, limit: int = Query(20, ge=1, le=500)):
+    """Per-phase timing of the last build/reload runs, most recent first"""
+    runs = read_profile_history(operation=operation, limit=limit)
+    # Il sommario cProfile è lungo: solo nel dettaglio del singolo run
+    for run in runs:
+        if run.get("cprofile"):
+            run["cprofile"] = {"file": run["cprofile"].get("file")}
+    return success_2xx(key_mess="profiles", message=runs)
+
+
+@router.get("/profiles/{run_id}", status_code=status.HTTP_200_OK)
+async def get_build_profile(run_id: str, response: Response):
+    record = get_profile_record(run_id)
+    if record is None:
+        return error_4xx(response, status.HTTP_404_NOT_FOUND, message=f"profile {run_id} not found")
+    return success_2xx(key_mess="profile", message=record)
+
+
+@router.get("/profiles/{run_id}/cprofile", status_code=status.HTTP_200_OK)
+async def download_build_cprofile(run_id: str, response: Response):
+    """Raw cProfile stats of a run (open with pstats or snakeviz)"""
+    record = get_profile_record(run_id)
+    if record is None or not record.get("cprofile"):
+        return error_4xx(response, status.HTTP_404_NOT_FOUND, message=f"no cProfile capture for {run_id}")
+    prof_path = os.path.join(BACKEND_PROFILES_FOLDER, record["cprofile"]["file"])
+    if not os.path.exists(prof_path):
+        return error_4xx(response, status.HTTP_404_NOT_FOUND, message=f"cProfile file of {run_id} was removed")
+    return FileResponse(prof_path, media_type="application/octet-stream", filename=record["cprofile"]["file"])
+
+
 # Funzione helper per pulire la cache (esporta per uso in altri router)
 def clear_info_cache():
     """Esposta per essere chiamata da execution.py dopo wipe/start"""
@@ -8,48 +8,198 @@ from log import set_logging
 from digital_twin.ixp.configuration.frr_scenario_configuration_applier import (
     FrrScenarioConfigurationApplier,
 )
-from digital_twin.ixp.foundation.dumps.member_dump.member_dump_factory import (
-    MemberDumpFactory,
-)
-from digital_twin.ixp.foundation.dumps.table_dump.table_dump_factory import (
-    TableDumpFactory,
-)
-from globals import BACKEND_RESOURCES_FOLDER, BACKEND_IXPCONFIGS_FOLDER, get_max_devices, sync_resources_to_digital_twin
+from globals import BACKEND_IXPCONFIGS_FOLDER, sync_resources_to_digital_twin
 from digital_twin.ixp.network_scenario.network_scenario_manager import (
     NetworkScenarioManager,
 )
 from digital_twin.ixp.network_scenario.rs_manager import RouteServerManager
 from digital_twin.ixp.settings.settings import Settings, DEFAULT_SETTINGS_PATH
-from utils.dt_utils import load_settings_from_disk
+from utils.dt_utils import load_settings_from_disk, load_table_dump
+from utils.build_cache import get_build_cache, compute_build_key
+from utils.config_hash import compute_structure_hashes, save_config_hashes
+from utils.profiler import profiled_run, profile_phase
+from utils.image_prewarm import record_lab_images
+from utils.lab_scheduler import get_lab_scheduler
+from utils.deploy_waves import deploy_in_waves, get_wave_limits
+from utils.warm_pool import get_warm_pool, get_warm_pool_size
+from utils.lab_manifest import save_lab_manifest
+from utils.docker_utils import get_lab_containers
+from utils.lab_utils import get_kathara
+from utils.server_context import ServerContext, LAB_QUEUED, LAB_DEPLOYING
+from utils.jobs import (
+    Job,
+    JobCancelledError,
+    KatharaDeployListener,
+    job_phase,
+    JOB_COMPLETED,
+    JOB_FAILED,
+    JOB_CANCELLED,
+)
 from digital_twin.ixp.globals import PATH_PREFIX
 
 
-def start_deploy(net_scenario_manager: NetworkScenarioManager):
-    logging.info("Deploying lab..")
-    net_scenario_manager.undeploy()
-    net_scenario_manager.deploy_chunks()
-    logging.info("Deploy lab complete")
+def start_deploy(net_scenario_manager: NetworkScenarioManager, job: Job | None = None, wait_for: Job | None = None,
+                 lab=None, after_deploy=None, route_servers=None):
+    """
+    Deploy the lab. With lab given, the deployment first waits for admission
+    (host CPU/memory, see utils/lab_scheduler.py) and updates the lab state.
+    after_deploy(job), if given, runs once the lab is deployed, before the job
+    completes (e.g. the blue/green switchover, see utils/blue_green.py).
+    route_servers are the route server devices of the lab, captured right after
+    its build: by deploy time the Settings singleton may hold another ixpconf.
+    """
+    if wait_for is not None and not wait_for.is_finished():
+        # Stesso lab ancora in teardown: il deploy non può sovrapporsi
+        logging.info(f"Waiting for {wait_for.kind} job {wait_for.id} before deploying..")
+        with job_phase(job, f"wait {wait_for.kind}"):
+            wait_for.wait()
+
+    scheduler = get_lab_scheduler()
+    admitted = False
+    try:
+        if lab is not None:
+            ServerContext.set_lab_state(lab.hash, LAB_QUEUED)
+            with job_phase(job, "admission"):
+                scheduler.admit(lab.hash, len(lab.machines), job)
+            admitted = True
+            ServerContext.set_lab_state(lab.hash, LAB_DEPLOYING)
+
+        logging.info("Deploying lab..")
+        if job is None:
+            net_scenario_manager.undeploy()
+            net_scenario_manager.deploy_chunks()
+            logging.info("Deploy lab complete")
+            return
 
+        warm_pool = get_warm_pool()
+        with KatharaDeployListener(job, lab.hash if lab is not None else None) as listener:
+            claimed = set()
+            if lab is not None and warm_pool.has_parked(lab.hash):
+                # Container parcheggiati dallo stesso lab: riusati, niente undeploy
+                claimed = warm_pool.claim(lab, job)
+            else:
+                with job.phase("undeploy"):
+                    if lab is not None:
+                        # Solo i resti di questo hash: un altro lab (es. il "blue") può essere in esecuzione
+                        get_kathara().undeploy_lab(lab_hash=lab.hash)
+                    else:
+                        net_scenario_manager.undeploy()
+                if lab is not None and get_warm_pool_size():
+                    warm_pool.record_deploy(0, len(lab.machines))
+            with job.phase("deploy"):
+                if lab is not None and (claimed or get_wave_limits()["enabled"]):
+                    deploy_in_waves(lab, list(route_servers or ()), job, listener, claimed)
+                else:
+                    net_scenario_manager.deploy_chunks()
+        if lab is not None:
+            # Contesto del lab su disco: ripreso senza rebuild dopo un riavvio del backend
+            save_lab_manifest(lab, job.ixpconf_filename, get_lab_containers(lab.hash))
+        if after_deploy is not None:
+            if admitted:
+                # L'ammissione riguarda il deploy: l'attesa successiva non occupa lo scheduler
+                scheduler.release(lab.hash)
+                admitted = False
+            after_deploy(job)
+        job.finish(JOB_COMPLETED)
+        logging.info("Deploy lab complete")
+    except JobCancelledError:
+        logging.warning(f"Deploy job {job.id} cancelled, lab is partially deployed")
+        job.finish(JOB_CANCELLED)
+    except Exception as e:
+        if job is None:
+            raise
+        logging.error(f"Deploy job {job.id} failed: {e}")
+        job.add_failure(None, str(e))
+        job.finish(JOB_FAILED, error=str(e))
+    finally:
+        if admitted:
+            scheduler.release(lab.hash)
 
-def build_lab(ixp_configs_filename: str):
+
+def build_lab(ixp_configs_filename: str, job: Job | None = None, cprofile: bool = False,
+              scenario_suffix: str | None = None):
     """
     Build lab from IXP configuration file
 
     Args:
         ixp_configs_filename: Name of the config file (e.g., 'ixp.conf', 'prova.conf')
+        job: Optional job on which the build phases are tracked
+        cprofile: Capture a cProfile of the whole build (see utils/profiler.py)
+        scenario_suffix: Appended to the lab name, so that the lab gets its own hash
+            and can run next to one built from the same config (blue/green start)
     """
     set_logging()
 
-    # ✅ Sincronizza resources PRIMA di fare qualsiasi cosa
-    logging.info("=" * 80)
-    logging.info("🔄 SYNCING RESOURCES TO DIGITAL_TWIN")
-    logging.info("=" * 80)
-    
-    if not sync_resources_to_digital_twin():
-        error_msg = "Failed to sync resources to digital_twin. Cannot start lab."
-        logging.error(f"❌ {error_msg}")
-        raise RuntimeError(error_msg)
-    
+    with profiled_run("build", ixp_configs_filename, capture_cprofile=cprofile) as profiler:
+        if job is not None:
+            profiler.annotate(job_id=job.id)
+
+        # ✅ Sincronizza resources PRIMA di fare qualsiasi cosa
+        logging.info("=" * 80)
+        logging.info("🔄 SYNCING RESOURCES TO DIGITAL_TWIN")
+        logging.info("=" * 80)
+
+        with job_phase(job, "sync"), profiler.phase("resource_sync"):
+            if not sync_resources_to_digital_twin():
+                error_msg = "Failed to sync resources to digital_twin. Cannot start lab."
+                logging.error(f"❌ {error_msg}")
+                raise RuntimeError(error_msg)
+
+        with job_phase(job, "build"):
+            with profiler.phase("settings_loading"):
+                settings = _load_settings(ixp_configs_filename)
+                build_key = compute_build_key(ixp_configs_filename)
+            scenario_key = f"{build_key}-{scenario_suffix}" if build_key and scenario_suffix else build_key
+            cached = get_build_cache().get_scenario(scenario_key) if scenario_key else None
+            profiler.annotate(build_key=build_key, scenario_cache_hit=cached is not None)
+
+            if cached is not None:
+                # Input invariati: si passa direttamente al deploy
+                net_scenario, net_scenario_manager = cached
+                logging.info(f"♻️ Build cache HIT ({build_key}), skipping dumps loading and configuration")
+            else:
+                table_dump = load_table_dump(settings, build_key)
+                net_scenario, net_scenario_manager = _build_network_scenario(table_dump)
+                if scenario_suffix:
+                    _rename_lab(net_scenario, f"{net_scenario.name}-{scenario_suffix}")
+
+        if cached is None:
+            # Interconnessione con l'interfaccia dell'host
+            with job_phase(job, "interconnect"), profiler.phase("interconnect"):
+                net_scenario_manager.interconnect(table_dump)
+            if scenario_key:
+                get_build_cache().put_scenario(scenario_key, net_scenario, net_scenario_manager)
+            record_lab_images(ixp_configs_filename, net_scenario)
+
+        profiler.annotate(lab_hash=net_scenario.hash, machines=len(net_scenario.machines))
+
+        # Baseline per i reload: struttura dei device, configurazioni ancora da caricare
+        save_config_hashes(net_scenario.hash, compute_structure_hashes(net_scenario), {})
+
+    logging.info(f"Lab built successfully, hash: {net_scenario.hash}")
+    logging.info(f"Machines in lab: {list(net_scenario.machines.keys())}")
+
+    return net_scenario, net_scenario_manager
+
+
+def _rename_lab(net_scenario, name: str) -> None:
+    """Give the lab a new name, and the hash Kathara derives from it (containers and networks are named after it)"""
+    from Kathara import utils as kathara_utils
+
+    net_scenario.name = name
+    net_scenario.hash = kathara_utils.generate_urlsafe_hash(name)
+    logging.info(f"Lab renamed to {name} (hash {net_scenario.hash})")
+
+
+def get_route_server_types() -> dict[str, str]:
+    """Route server devices of the loaded ixpconf -> type (bird, open_bgpd)"""
+    return {name: rs.get("type") for name, rs in Settings.get_instance().route_servers.items()}
+
+
+def _load_settings(ixp_configs_filename: str):
+    """
+    Load the ixpconf into the digital_twin Settings singleton
+    """
     logging.info("=" * 80)
     logging.info("Building lab..")
     logging.info(f"Config filename received: {ixp_configs_filename}")
@@ -112,59 +262,40 @@ def build_lab(ixp_configs_filename: str):
 
     logging.info(f"Peering configuration: {settings.peering_configuration}")
 
-    # Carica member dump
-    member_dump_class = MemberDumpFactory(
-        submodule_package="digital_twin"
-    ).get_class_from_name(settings.peering_configuration["type"])
-    entries = member_dump_class().load_from_file(
-        os.path.join(BACKEND_RESOURCES_FOLDER, settings.peering_configuration["path"])
-    )
+    return settings
 
-    # Carica table dump
-    table_dump = TableDumpFactory(submodule_package="digital_twin").get_class_from_name(
-        settings.rib_dumps["type"]
-    )(entries)
-
-    for v, file in settings.rib_dumps["dumps"].items():
-        dump_path = os.path.join(BACKEND_RESOURCES_FOLDER, file)
-        logging.info(f"Loading RIB dump from: {dump_path}")
-        table_dump.load_from_file(dump_path)
-
-    # Limit entries based on MAX_DEVICES configuration (read fresh value)
-    max_devices = get_max_devices()
-    logging.info(f"DEBUG: get_max_devices() returned: {max_devices}")
-
-    if max_devices is not None and max_devices > 0:
-        original_count = len(table_dump.entries)
-        table_dump.entries = dict(list(table_dump.entries.items())[0:max_devices])
-        logging.info(f"✅ Limited devices: {original_count} -> {max_devices} (MAX_DEVICES)")
-    else:
-        logging.info(f"No device limit applied (total: {len(table_dump.entries)} devices)")
-        
+
+def _build_network_scenario(table_dump):
+    """
+    Build the network scenario and apply FRR and Route Server configurations
+    """
     # Build network scenario
     net_scenario_manager = NetworkScenarioManager()
     frr_conf = FrrScenarioConfigurationApplier(table_dump)
     rs_manager = RouteServerManager()
 
-    net_scenario = net_scenario_manager.build(table_dump)
-    frr_conf.apply_to_network_scenario(net_scenario)
-    rs_manager.apply_to_network_scenario(net_scenario)
-    net_scenario_manager.interconnect(table_dump)
-
-    logging.info(f"Lab built successfully, hash: {net_scenario.hash}")
-    logging.info(f"Machines in lab: {list(net_scenario.machines.keys())}")
+    with profile_phase("scenario_build"):
+        net_scenario = net_scenario_manager.build(table_dump)
+    with profile_phase("frr_configuration"):
+        frr_conf.apply_to_network_scenario(net_scenario)
+    with profile_phase("rs_configuration"):
+        rs_manager.apply_to_network_scenario(net_scenario)
 
     return net_scenario, net_scenario_manager
 
 
-def start_lab(net_scenario_manager):
+def start_lab(net_scenario_manager, job: Job | None = None, wait_for: Job | None = None, lab=None,
+              after_deploy=None, route_servers=None):
     """
-    Start lab deployment in a separate thread
+    Start lab deployment in a separate thread, optionally after another job (e.g. a wipe) is over
+    and, with lab given, once the scheduler admits it
     """
     deployer_thread = threading.Thread(
-        target=start_deploy, args=(net_scenario_manager,)
+        target=start_deploy, args=(net_scenario_manager, job, wait_for, lab, after_deploy, route_servers),
+        daemon=True
     )
     deployer_thread.start()
+    return deployer_thread
 
 
 # Used to test locally backend functionalities
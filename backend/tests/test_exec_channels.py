@@ -0,0 +1,27 @@
+from types import SimpleNamespace
+
+import utils.exec_channels as exec_channels
+import utils.lab_utils as lab_utils
+
+
+def test_benchmark_runs_the_same_command_on_both_paths(monkeypatch):
+    kathara_commands = []
+    fast_path_commands = []
+    channels = exec_channels.ExecChannels()
+    monkeypatch.setattr(exec_channels, "get_exec_channels", lambda: channels)
+    monkeypatch.setattr(channels, "_resolve", lambda lab_hash, device, refresh=False: {
+        "container_id": "c1", "shell": "/bin/bash",
+    })
+    monkeypatch.setattr(
+        channels, "exec", lambda lab_hash, device, command: fast_path_commands.append(command) or ("", "", 0)
+    )
+    monkeypatch.setattr(
+        lab_utils, "execute_command_on_machine",
+        lambda machine_name, command, lab: kathara_commands.append(command) or "",
+    )
+
+    report = exec_channels.benchmark_exec(SimpleNamespace(hash="h"), "rs1", "birdc show route | wc -l", iterations=2)
+
+    assert kathara_commands == [["/bin/bash", "-c", "birdc show route | wc -l"]] * 3
+    assert fast_path_commands == ["birdc show route | wc -l"] * 3
+    assert report["kathara"]["iterations"] == report["fast_path"]["iterations"] == 2
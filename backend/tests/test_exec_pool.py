@@ -0,0 +1,31 @@
+import asyncio
+
+import utils.exec_pool as exec_pool
+import utils.lab_utils as lab_utils
+from tests.test_lab_utils import FakeKathara
+
+
+def test_exec_stream_relays_events(monkeypatch):
+    kathara = FakeKathara([
+        (f"{exec_pool.STREAM_PID_MARKER} 42\nfirst ".encode(), None),
+        ("chunk \xe2".encode("latin-1"), None),  # carattere UTF-8 spezzato tra due chunk
+        (b"\x82\xac\n", b"oops\n"),
+    ])
+    monkeypatch.setattr(lab_utils, "get_kathara", lambda: kathara)
+
+    async def relay():
+        stream = exec_pool.ExecStream("rs1", "tcpdump -i eth0", "lab")
+        stream.start()
+        return [event async for event in stream.events()]
+
+    events = asyncio.run(relay())
+
+    assert events == [
+        {"type": "started", "pid": "42"},
+        {"type": "stdout", "data": "first "},
+        {"type": "stdout", "data": "chunk "},
+        {"type": "stdout", "data": "€\n"},
+        {"type": "stderr", "data": "oops\n"},
+        {"type": "end"},
+    ]
+    assert kathara.calls[0][1] == ["/bin/sh", "-c", f"echo {exec_pool.STREAM_PID_MARKER} $$; exec tcpdump -i eth0"]
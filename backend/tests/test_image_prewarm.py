@@ -0,0 +1,48 @@
+import os
+
+from utils import image_prewarm
+from utils.shared_state import SharedStateStore
+
+
+def _use_store(monkeypatch, tmp_path):
+    store = SharedStateStore(str(tmp_path / "shared_state.db"))
+    monkeypatch.setattr(image_prewarm, "get_shared_state", lambda: store)
+    monkeypatch.setattr(image_prewarm, "get_docker_client", lambda: None)
+    return store
+
+
+def test_prewarm_state_is_shared_by_workers(monkeypatch, tmp_path):
+    _use_store(monkeypatch, tmp_path)
+    owner, other = image_prewarm.ImagePrewarmer(), image_prewarm.ImagePrewarmer()
+
+    assert owner.start([], not_before=0)
+    assert other.wait(5)
+    assert other.status()["worker_pid"] == os.getpid()
+    # Il prewarm è già stato fatto dopo l'avvio dell'altro worker
+    assert not other.start(not_before=0)
+
+
+def test_running_prewarm_is_claimed_once(monkeypatch, tmp_path):
+    store = _use_store(monkeypatch, tmp_path)
+    store.put(image_prewarm.PREWARM_NAMESPACE, image_prewarm.PREWARM_KEY, {
+        "pid": os.getppid(), "state": image_prewarm.PREWARM_RUNNING,
+        "started_at": 1.0, "ended_at": None, "error": None, "images": {},
+    })
+    prewarmer = image_prewarm.ImagePrewarmer()
+
+    assert not prewarmer.start(["alpine:latest"])
+    assert not prewarmer.wait(0.1)
+    assert prewarmer.status()["state"] == image_prewarm.PREWARM_RUNNING
+
+
+def test_prewarm_of_an_exited_worker_is_failed(monkeypatch, tmp_path):
+    store = _use_store(monkeypatch, tmp_path)
+    store.put(image_prewarm.PREWARM_NAMESPACE, image_prewarm.PREWARM_KEY, {
+        "pid": 2 ** 22 + 1, "state": image_prewarm.PREWARM_RUNNING,
+        "started_at": 1.0, "ended_at": None, "error": None, "images": {},
+    })
+    prewarmer = image_prewarm.ImagePrewarmer()
+
+    assert prewarmer.status()["state"] == image_prewarm.PREWARM_FAILED
+    assert prewarmer.start([], not_before=0)
+    assert prewarmer.wait(5)
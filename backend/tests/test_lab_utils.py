@@ -0,0 +1,43 @@
+import utils.lab_utils as lab_utils
+
+
+class FakeExecStream:
+    """Same protocol as Kathara's DockerExecStream: __next__ without __iter__"""
+
+    def __init__(self, items):
+        self._items = iter(items)
+
+    def __next__(self):
+        return next(self._items)
+
+
+class FakeKathara:
+    def __init__(self, items):
+        self.items = items
+        self.calls = []
+
+    def exec(self, machine_name, command, lab=None, stream=True):
+        self.calls.append((machine_name, command, lab, stream))
+        return FakeExecStream(self.items)
+
+
+def test_stream_command_relays_chunks(monkeypatch):
+    kathara = FakeKathara([(b"line 1\n", None), None, (None, b"warning\n"), (b"line 2\n", b"error\n"), b"raw"])
+    monkeypatch.setattr(lab_utils, "get_kathara", lambda: kathara)
+
+    chunks = list(lab_utils.stream_command_on_machine("rs1", ["/bin/sh", "-c", "tcpdump"], "lab"))
+
+    assert chunks == [
+        ("stdout", b"line 1\n"),
+        ("stderr", b"warning\n"),
+        ("stdout", b"line 2\n"),
+        ("stderr", b"error\n"),
+        ("stdout", b"raw"),
+    ]
+    assert kathara.calls == [("rs1", ["/bin/sh", "-c", "tcpdump"], "lab", True)]
+
+
+def test_stream_command_stops_at_end_of_stream(monkeypatch):
+    monkeypatch.setattr(lab_utils, "get_kathara", lambda: FakeKathara([]))
+
+    assert list(lab_utils.stream_command_on_machine("rs1", "true", "lab")) == []
@@ -0,0 +1,46 @@
+import json
+import os
+import time
+
+import utils.profiler as profiler
+
+
+def _use_profiles_folder(monkeypatch, tmp_path):
+    monkeypatch.setattr(profiler, "BACKEND_PROFILES_FOLDER", str(tmp_path))
+    monkeypatch.setattr(profiler, "PROFILE_HISTORY_FILE", str(tmp_path / "history.jsonl"))
+
+
+def test_peak_rss_is_per_phase(monkeypatch, tmp_path):
+    _use_profiles_folder(monkeypatch, tmp_path)
+
+    with profiler.profiled_run("build", "ixp.conf") as run:
+        with profiler.profile_phase("large"):
+            block = bytearray(64 * 1024 * 1024)
+            block[::4096] = b"x" * len(block[::4096])
+            # La memoria resta occupata per qualche campionamento
+            time.sleep(profiler.RSS_SAMPLE_INTERVAL * 4)
+            del block
+        with profiler.profile_phase("small"):
+            pass
+
+    large, small = run.phases
+    assert large["peak_rss_mb"] - small["peak_rss_mb"] > 32
+
+
+def test_history_is_trimmed_with_its_cprofiles(monkeypatch, tmp_path):
+    _use_profiles_folder(monkeypatch, tmp_path)
+    monkeypatch.setattr(profiler, "MAX_PROFILE_HISTORY", 2)
+
+    for i in range(4):
+        run_id = f"20260101-00000{i}-abcdef"
+        (tmp_path / f"{run_id}.prof").write_text("")
+        profiler.append_profile_record({"run_id": run_id, "operation": "build", "cprofile": {"file": f"{run_id}.prof"}})
+
+    assert [record["run_id"] for record in profiler.read_profile_history()] == [
+        "20260101-000003-abcdef", "20260101-000002-abcdef",
+    ]
+    assert sorted(name for name in os.listdir(tmp_path) if name.endswith(".prof")) == [
+        "20260101-000002-abcdef.prof", "20260101-000003-abcdef.prof",
+    ]
+    with open(tmp_path / "history.jsonl") as f:
+        assert len([json.loads(line) for line in f]) == 2
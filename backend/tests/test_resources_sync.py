@@ -0,0 +1,60 @@
+import json
+import os
+
+import globals
+from utils.file_utils import write_file_atomically
+
+
+def _use_folders(monkeypatch, tmp_path):
+    resources = tmp_path / "resources"
+    synced = tmp_path / "digital_twin_resources"
+    resources.mkdir()
+    for critical_file in globals.CRITICAL_RESOURCE_FILES:
+        (resources / critical_file).write_text("")
+    monkeypatch.setattr(globals, "BACKEND_RESOURCES_FOLDER", str(resources))
+    monkeypatch.setattr(globals, "DIGITAL_TWIN_RESOURCES_FOLDER", str(synced))
+    return resources, synced
+
+
+def test_synced_copy_is_a_snapshot(monkeypatch, tmp_path):
+    resources, synced = _use_folders(monkeypatch, tmp_path)
+    (resources / "rib_v4.dump").write_text("old")
+
+    assert globals.sync_resources_to_digital_twin()
+    assert os.stat(resources / "rib_v4.dump").st_ino != os.stat(synced / "rib_v4.dump").st_ino
+
+    # Una scrittura sul posto in resources/ non tocca la copia sincronizzata
+    with open(resources / "rib_v4.dump", "w") as f:
+        f.write("new")
+    assert (synced / "rib_v4.dump").read_text() == "old"
+
+
+def test_hardlinked_files_are_copied_again(monkeypatch, tmp_path):
+    resources, synced = _use_folders(monkeypatch, tmp_path)
+    (resources / "rib_v4.dump").write_text("dump")
+    assert globals.sync_resources_to_digital_twin()
+
+    # Stato lasciato da una sincronizzazione precedente con hardlink
+    os.remove(synced / "rib_v4.dump")
+    os.link(resources / "rib_v4.dump", synced / "rib_v4.dump")
+    manifest_path = synced / globals.SYNC_MANIFEST_FILENAME
+    manifest = json.loads(manifest_path.read_text())
+    manifest["rib_v4.dump"]["method"] = "hardlink"
+    manifest_path.write_text(json.dumps(manifest))
+
+    assert globals.sync_resources_to_digital_twin()
+    assert os.stat(resources / "rib_v4.dump").st_ino != os.stat(synced / "rib_v4.dump").st_ino
+
+
+def test_write_file_atomically_replaces_the_file(tmp_path):
+    path = tmp_path / "ixp.conf"
+    path.write_text("old")
+    os.chmod(path, 0o640)
+    inode = os.stat(path).st_ino
+
+    write_file_atomically(str(path), b"new")
+
+    assert path.read_text() == "new"
+    assert os.stat(path).st_ino != inode
+    assert oct(os.stat(path).st_mode & 0o777) == oct(0o640)
+    assert os.listdir(tmp_path) == ["ixp.conf"]
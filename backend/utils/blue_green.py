@@ -0,0 +1,150 @@
+import logging
+import time
+
+from globals import get_backend_setting
+from utils.docker_utils import get_lab_containers
+from utils.jobs import Job, job_phase
+
+# Default della convergenza (sovrascrivibili in settings.json)
+DEFAULT_CONVERGENCE_TIMEOUT = 300
+DEFAULT_CONVERGENCE_INTERVAL = 5
+DEFAULT_CONVERGENCE_STABLE_POLLS = 3
+
+# Suffisso del lab "green": il nuovo lab ha un nome (e un hash) diverso da quello in esecuzione
+GREEN_SUFFIX = "green"
+
+
+class ConvergenceTimeout(Exception):
+    """The route servers of the new lab did not converge in time"""
+
+
+def blue_green_default() -> bool:
+    return bool(get_backend_setting("blue_green_switchover", False))
+
+
+def get_convergence_limits() -> dict:
+    return {
+        "timeout": float(get_backend_setting("blue_green_convergence_timeout", DEFAULT_CONVERGENCE_TIMEOUT)),
+        "interval": float(get_backend_setting("blue_green_convergence_interval", DEFAULT_CONVERGENCE_INTERVAL)),
+        "stable_polls": int(get_backend_setting("blue_green_stable_polls", DEFAULT_CONVERGENCE_STABLE_POLLS)),
+    }
+
+
+def next_scenario_suffix(running_lab_name: str) -> str | None:
+    """Suffix of the lab deployed next to running_lab_name: green and plain names alternate"""
+    return None if running_lab_name.endswith(f"-{GREEN_SUFFIX}") else GREEN_SUFFIX
+
+
+def _established_bird(output: str) -> int:
+    return sum(1 for line in output.splitlines() if " BGP " in f" {line} " and "Established" in line)
+
+
+def _established_openbgpd(output: str) -> int:
+    # bgpctl show summary: per le sessioni stabilite l'ultima colonna è il numero di prefissi ricevuti
+    return sum(1 for line in output.splitlines()[1:] if line.split() and line.split()[-1].isdigit())
+
+
+# Tipo di route server -> (comando, parser delle sessioni BGP stabilite)
+SESSION_PROBES = {
+    "bird": ("birdc show protocols", _established_bird),
+    "open_bgpd": ("bgpctl show summary", _established_openbgpd),
+}
+
+
+def count_established_sessions(container, rs_type: str) -> int | None:
+    """Established BGP sessions of a route server container (None if its type cannot be probed)"""
+    probe = SESSION_PROBES.get(rs_type)
+    if probe is None:
+        return None
+    command, parse = probe
+    result = container.exec_run(
+        [container.labels.get("shell", "/bin/bash"), "-c", command], stdout=True, stderr=False
+    )
+    return parse(result.output.decode("utf-8", errors="replace"))
+
+
+def wait_for_convergence(lab_hash: str, route_servers: dict[str, str], job: Job | None = None) -> dict:
+    """
+    Poll the route servers of a lab until their established BGP sessions are
+    non-zero and unchanged for `blue_green_stable_polls` consecutive polls.
+
+    Args:
+        lab_hash: Lab to probe
+        route_servers: Route server device -> type (bird, open_bgpd)
+
+    Returns:
+        dict: Established sessions per route server at convergence
+
+    Raises:
+        ConvergenceTimeout: Not converged within `blue_green_convergence_timeout`
+    """
+    limits = get_convergence_limits()
+    deadline = time.monotonic() + limits["timeout"]
+    containers = {
+        c.labels.get("name"): c for c in get_lab_containers(lab_hash) if c.labels.get("name") in route_servers
+    }
+    probed = {name: rs_type for name, rs_type in route_servers.items() if rs_type in SESSION_PROBES}
+    if not probed or not containers:
+        logging.warning(f"No route server of lab {lab_hash} can be probed, switching over without convergence check")
+        return {}
+
+    previous, stable = None, 0
+    while True:
+        if job is not None:
+            job.check_cancelled()
+        sessions = {}
+        for name, rs_type in probed.items():
+            try:
+                sessions[name] = count_established_sessions(containers[name], rs_type) if name in containers else 0
+            except Exception as e:
+                logging.debug(f"Session probe failed on {name}: {e}")
+                sessions[name] = 0
+
+        stable = stable + 1 if sessions == previous and all(sessions.values()) else 0
+        previous = sessions
+        if job is not None:
+            job.emit("convergence", sessions=sessions, stable_polls=stable)
+        if stable >= limits["stable_polls"]:
+            logging.info(f"🟢 Route servers of lab {lab_hash} converged: {sessions}")
+            return sessions
+        if time.monotonic() > deadline:
+            raise ConvergenceTimeout(
+                f"route servers of lab {lab_hash} not converged within {limits['timeout']}s: {sessions}"
+            )
+        time.sleep(limits["interval"])
+
+
+def switch_over(old_lab_hash: str, lab, ixpconf_filename: str, route_servers: dict[str, str],
+                job: Job | None = None) -> None:
+    """
+    Last step of a blue/green start, once the new lab is deployed: wait for its
+    route servers, make it the active lab in one store transaction, then wipe
+    the old one in background. If the new lab does not converge it is wiped
+    instead and the old one stays active.
+    """
+    from utils.server_context import ServerContext
+    from utils.teardown import start_wipe_job
+
+    try:
+        with job_phase(job, "convergence"):
+            wait_for_convergence(lab.hash, route_servers, job)
+    except Exception:
+        logging.error(f"Lab {lab.hash} not promoted, lab {old_lab_hash} stays active")
+
+        # Wipe del nuovo lab solo a job chiuso: begin_wipe annullerebbe il job stesso
+        def wipe_new_lab(*_):
+            ServerContext.begin_wipe(lab.hash, lambda: start_wipe_job(lab.hash))
+
+        if job is not None:
+            job.add_done_callback(wipe_new_lab)
+        else:
+            wipe_new_lab()
+        raise
+
+    with job_phase(job, "switchover"):
+        ServerContext.set_lab_context(lab, ixpconf_filename, is_discovered=False)
+        logging.info(f"🔀 Lab {lab.hash} is now active, wiping lab {old_lab_hash} in background")
+        if ServerContext.get_lab(old_lab_hash) is not None:
+            ServerContext.begin_wipe(old_lab_hash, lambda: start_wipe_job(old_lab_hash))
+    if job is not None:
+        job.emit("switchover", active_lab_hash=lab.hash, previous_lab_hash=old_lab_hash)
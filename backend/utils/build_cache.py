@@ -0,0 +1,265 @@
+import copy
+import hashlib
+import json
+import logging
+import os
+import pickle
+import shutil
+import threading
+import time
+from collections import OrderedDict
+
+from globals import BACKEND_IXPCONFIGS_FOLDER, BACKEND_RESOURCES_FOLDER, BACKEND_CACHE_FOLDER
+from utils.file_utils import file_digest
+from utils.member_selection import get_member_selection
+
+# Da incrementare quando cambia il formato degli artefatti salvati
+BUILD_CACHE_VERSION = 1
+
+TABLE_DUMP_CACHE_FILE = "table_dump.pickle"
+
+
+def get_referenced_resource_files(ixpconf: dict) -> list[str]:
+    """
+    Names of the files in resources/ referenced anywhere in the ixpconf
+    (peering configuration, RIB dumps, route server configs, ...)
+    """
+    found = set()
+
+    def visit(value):
+        if isinstance(value, dict):
+            for item in value.values():
+                visit(item)
+        elif isinstance(value, list):
+            for item in value:
+                visit(item)
+        elif isinstance(value, str) and 0 < len(value) < 256 and os.path.basename(value) == value:
+            if os.path.isfile(os.path.join(BACKEND_RESOURCES_FOLDER, value)):
+                found.add(value)
+
+    visit(ixpconf)
+    return sorted(found)
+
+
+def get_build_variant() -> dict:
+    """Backend settings that change the build output for the same inputs"""
+    return {"member_selection": get_member_selection()}
+
+
+def compute_build_key(ixpconf_filename: str) -> str | None:
+    """
+    Content hash of the ixpconf, of the resource files it references and of the build variant.
+
+    Returns:
+        str or None: The key, or None if the ixpconf cannot be parsed (caching disabled)
+    """
+    config_path = os.path.join(BACKEND_IXPCONFIGS_FOLDER, ixpconf_filename)
+    try:
+        with open(config_path, "rb") as file:
+            raw = file.read()
+        ixpconf = json.loads(raw)
+    except Exception as e:
+        logging.warning(f"Build cache disabled for {ixpconf_filename}: {e}")
+        return None
+
+    inputs = {
+        name: file_digest(os.path.join(BACKEND_RESOURCES_FOLDER, name))
+        for name in get_referenced_resource_files(ixpconf)
+    }
+
+    digest = hashlib.sha256()
+    digest.update(f"v{BUILD_CACHE_VERSION}".encode())
+    digest.update(raw)
+    digest.update(json.dumps(inputs, sort_keys=True).encode())
+    digest.update(json.dumps(get_build_variant(), sort_keys=True, default=str).encode())
+    build_key = digest.hexdigest()[:20]
+
+    logging.info(f"Build key for {ixpconf_filename}: {build_key} (inputs: {list(inputs.keys())})")
+    return build_key
+
+
+class BuildCache:
+    """
+    Cache of the lab build artefacts, keyed by compute_build_key().
+
+    - dumps: the table dump (with the parsed member dump), kept pickled in
+      memory and on disk, so every hit returns a fresh copy and survives a
+      backend restart
+    - scenario: the built and configured network scenario with its manager;
+      memory only, because Kathara labs live on an in-memory filesystem.
+      Kathara changes a lab while deploying it (exec commands, Docker
+      objects), so a pristine copy is kept and every hit gets its own copy
+    """
+
+    def __init__(self, max_entries=3, max_disk_entries=5):
+        self._dumps = OrderedDict()
+        self._scenarios = OrderedDict()
+        self._lock = threading.Lock()
+        self.max_entries = max_entries
+        self.max_disk_entries = max_disk_entries
+        self.hits = {"dumps": 0, "scenario": 0}
+        self.misses = {"dumps": 0, "scenario": 0}
+
+    # ==================== TABLE DUMP ====================
+
+    def get_dumps(self, build_key: str):
+        with self._lock:
+            data = self._dumps.get(build_key)
+            if data is not None:
+                self._dumps.move_to_end(build_key)
+
+        if data is None:
+            cache_file = os.path.join(BACKEND_CACHE_FOLDER, build_key, TABLE_DUMP_CACHE_FILE)
+            if os.path.exists(cache_file):
+                try:
+                    with open(cache_file, "rb") as file:
+                        data = file.read()
+                    self._remember(self._dumps, build_key, data)
+                    logging.info(f"Build cache: table dump loaded from disk ({len(data)} bytes)")
+                except Exception as e:
+                    logging.warning(f"Build cache: cannot read {cache_file}: {e}")
+                    data = None
+
+        if data is None:
+            self.misses["dumps"] += 1
+            return None
+
+        try:
+            table_dump = pickle.loads(data)
+        except Exception as e:
+            logging.warning(f"Build cache: corrupted table dump for {build_key}: {e}")
+            self.invalidate(build_key)
+            self.misses["dumps"] += 1
+            return None
+
+        self.hits["dumps"] += 1
+        return table_dump
+
+    def put_dumps(self, build_key: str, table_dump) -> None:
+        try:
+            data = pickle.dumps(table_dump, protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception as e:
+            logging.warning(f"Build cache: table dump is not picklable, not cached: {e}")
+            return
+
+        self._remember(self._dumps, build_key, data)
+
+        try:
+            cache_dir = os.path.join(BACKEND_CACHE_FOLDER, build_key)
+            os.makedirs(cache_dir, exist_ok=True)
+            tmp_file = os.path.join(cache_dir, TABLE_DUMP_CACHE_FILE + ".tmp")
+            with open(tmp_file, "wb") as file:
+                file.write(data)
+            os.replace(tmp_file, os.path.join(cache_dir, TABLE_DUMP_CACHE_FILE))
+            self._prune_disk()
+        except Exception as e:
+            logging.warning(f"Build cache: cannot persist table dump: {e}")
+
+    def get_dumps_file(self, build_key: str) -> str | None:
+        """Path of the table dump persisted on disk for build_key, if any"""
+        cache_file = os.path.join(BACKEND_CACHE_FOLDER, build_key, TABLE_DUMP_CACHE_FILE)
+        return cache_file if os.path.isfile(cache_file) else None
+
+    def restore_dumps_file(self, build_key: str, path: str) -> bool:
+        """Put back a table dump saved elsewhere (lab manifest) if the disk cache no longer has it"""
+        if self.get_dumps_file(build_key) is not None:
+            return True
+        try:
+            cache_dir = os.path.join(BACKEND_CACHE_FOLDER, build_key)
+            os.makedirs(cache_dir, exist_ok=True)
+            tmp_file = os.path.join(cache_dir, TABLE_DUMP_CACHE_FILE + ".tmp")
+            try:
+                os.link(path, tmp_file)
+            except OSError:
+                shutil.copy2(path, tmp_file)
+            os.replace(tmp_file, os.path.join(cache_dir, TABLE_DUMP_CACHE_FILE))
+            self._prune_disk()
+            return True
+        except Exception as e:
+            logging.warning(f"Build cache: cannot restore table dump of {build_key}: {e}")
+            return False
+
+    # ==================== NETWORK SCENARIO ====================
+
+    @staticmethod
+    def _copy_scenario(artefacts: tuple) -> tuple:
+        """Deep copy of (net_scenario, net_scenario_manager) sharing the in-memory filesystems"""
+        net_scenario = artefacts[0]
+        # I filesystem in memoria (con il loro lock) non si copiano: il deploy li legge soltanto
+        memo = {}
+        for owner in [net_scenario, *net_scenario.machines.values()]:
+            fs = getattr(owner, "fs", None)
+            if fs is not None:
+                memo[id(fs)] = fs
+        return copy.deepcopy(artefacts, memo)
+
+    def get_scenario(self, build_key: str):
+        with self._lock:
+            artefacts = self._scenarios.get(build_key)
+            if artefacts is not None:
+                self._scenarios.move_to_end(build_key)
+                self.hits["scenario"] += 1
+            else:
+                self.misses["scenario"] += 1
+        return self._copy_scenario(artefacts) if artefacts is not None else None
+
+    def put_scenario(self, build_key: str, net_scenario, net_scenario_manager) -> None:
+        """Keep a copy of a scenario not deployed yet (the caller goes on with the original)"""
+        try:
+            pristine = self._copy_scenario((net_scenario, net_scenario_manager))
+        except Exception as e:
+            logging.warning(f"Build cache: cannot copy the network scenario, not cached: {e}")
+            return
+        self._remember(self._scenarios, build_key, pristine)
+
+    # ==================== MAINTENANCE ====================
+
+    def _remember(self, store: OrderedDict, build_key: str, value) -> None:
+        with self._lock:
+            store[build_key] = value
+            store.move_to_end(build_key)
+            while len(store) > self.max_entries:
+                store.popitem(last=False)
+
+    def _prune_disk(self) -> None:
+        if not os.path.isdir(BACKEND_CACHE_FOLDER):
+            return
+        entries = [
+            os.path.join(BACKEND_CACHE_FOLDER, name) for name in os.listdir(BACKEND_CACHE_FOLDER)
+            if os.path.isdir(os.path.join(BACKEND_CACHE_FOLDER, name))
+        ]
+        entries.sort(key=os.path.getmtime, reverse=True)
+        for stale in entries[self.max_disk_entries:]:
+            shutil.rmtree(stale, ignore_errors=True)
+
+    def invalidate(self, build_key: str | None = None) -> None:
+        with self._lock:
+            if build_key is None:
+                self._dumps.clear()
+                self._scenarios.clear()
+            else:
+                self._dumps.pop(build_key, None)
+                self._scenarios.pop(build_key, None)
+
+        target = BACKEND_CACHE_FOLDER if build_key is None else os.path.join(BACKEND_CACHE_FOLDER, build_key)
+        shutil.rmtree(target, ignore_errors=True)
+        logging.info(f"Build cache invalidated ({build_key or 'all'})")
+
+    def info(self) -> dict:
+        with self._lock:
+            return {
+                "dumps_in_memory": list(self._dumps.keys()),
+                "scenarios_in_memory": list(self._scenarios.keys()),
+                "dumps_on_disk": sorted(os.listdir(BACKEND_CACHE_FOLDER)) if os.path.isdir(BACKEND_CACHE_FOLDER) else [],
+                "hits": dict(self.hits),
+                "misses": dict(self.misses),
+                "timestamp": time.time(),
+            }
+
+
+# Singleton
+_build_cache = BuildCache()
+
+
+def get_build_cache():
+    return _build_cache
@@ -0,0 +1,222 @@
+import json
+import logging
+import os
+import pickle
+import shutil
+import time
+import uuid
+
+from globals import BACKEND_CHECKPOINTS_FOLDER
+from utils.build_cache import get_build_cache, compute_build_key
+from utils.docker_utils import get_lab_containers, run_on_containers
+from utils.lab_manifest import save_lab_manifest
+from utils.jobs import Job, job_phase
+from utils.server_context import ServerContext
+
+CHECKPOINT_FILE = "checkpoint.json"
+CHECKPOINT_TABLE_DUMP_FILE = "table_dump.pickle"
+
+# Container fermati/avviati in parallelo
+MAX_CONTAINER_WORKERS = 32
+STOP_TIMEOUT = 5
+
+# Rilancia gli startup di Kathara dopo un `docker start`: i demoni (FRR, bird, ...)
+# non sono processi del container ma vengono avviati via exec al deploy
+RESUME_COMMAND = (
+    "if [ -f \"/hostlab/shared.startup\" ]; then /hostlab/shared.startup &>> /var/log/shared.log; fi; "
+    "if [ -f \"/hostlab/{name}.startup\" ]; then /hostlab/{name}.startup &>> /var/log/startup.log; fi; "
+    "{exec_commands}"
+)
+
+
+class CheckpointError(Exception):
+    """The checkpoint cannot be created or restored in the current state"""
+    pass
+
+
+# ==================== HELPERS ====================
+
+def _checkpoint_dir(checkpoint_id: str) -> str:
+    return os.path.join(BACKEND_CHECKPOINTS_FOLDER, checkpoint_id)
+
+
+def exec_commands_of(machine) -> str:
+    """Exec commands of a Kathara machine joined in one shell command (":" if none)"""
+    commands = machine.meta.get("exec_commands") if machine is not None else None
+    # Kathara, al primo avvio, ha già intercalato gli echo nel log: qui basta rieseguirli
+    return "; ".join(commands) if commands else ":"
+
+
+# ==================== CHECKPOINT ====================
+
+def create_checkpoint(name: str | None = None, stop: bool = False, lab_hash: str | None = None) -> dict:
+    """
+    Save the build artefacts and the device -> container map of a running lab.
+
+    Args:
+        name: Optional label of the checkpoint
+        stop: Stop (hibernate) the lab containers, keeping their filesystem and networks
+        lab_hash: Lab to checkpoint (default: the active one)
+
+    Returns:
+        dict: The checkpoint metadata
+    """
+    lab = ServerContext.get_lab(lab_hash)
+    if lab is None:
+        raise CheckpointError("no lab is running")
+
+    ixpconf_filename = ServerContext.get_ixpconf_filename(lab.hash)
+    containers = get_lab_containers(lab.hash)
+    if not containers:
+        raise CheckpointError(f"no containers found for lab {lab.hash}")
+
+    checkpoint_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}"
+    checkpoint_dir = _checkpoint_dir(checkpoint_id)
+    os.makedirs(checkpoint_dir, exist_ok=True)
+
+    # Artefatti di build: il table dump già parsato (il lab "scoperto" non ha ixpconf)
+    build_key = compute_build_key(ixpconf_filename) if ixpconf_filename else None
+    table_dump_saved = False
+    if build_key:
+        table_dump = get_build_cache().get_dumps(build_key)
+        if table_dump is not None:
+            with open(os.path.join(checkpoint_dir, CHECKPOINT_TABLE_DUMP_FILE), "wb") as file:
+                pickle.dump(table_dump, file, protocol=pickle.HIGHEST_PROTOCOL)
+            table_dump_saved = True
+
+    devices = {}
+    for container in containers:
+        device = container.labels.get("name", container.name)
+        devices[device] = {
+            "container_id": container.id,
+            "container_name": container.name,
+            "shell": container.labels.get("shell", "/bin/bash"),
+            "exec_commands": exec_commands_of(lab.machines.get(device)),
+            "status": container.status,
+        }
+
+    checkpoint = {
+        "id": checkpoint_id,
+        "name": name or checkpoint_id,
+        "created_at": time.time(),
+        "lab_hash": lab.hash,
+        "ixpconf_filename": ixpconf_filename,
+        "build_key": build_key,
+        "table_dump": table_dump_saved,
+        "stopped": False,
+        "devices": devices,
+    }
+
+    if stop:
+        logging.info(f"Stopping {len(containers)} containers of lab {lab.hash}...")
+        failures = run_on_containers(
+            containers, lambda container: container.stop(timeout=STOP_TIMEOUT), max_workers=MAX_CONTAINER_WORKERS
+        )
+        if failures:
+            logging.warning(f"Could not stop {len(failures)} containers: {failures}")
+        checkpoint["stopped"] = True
+
+        # Il lab risulta fermo, come dopo un wipe
+        ServerContext.clear_lab_context(lab.hash)
+
+    with open(os.path.join(checkpoint_dir, CHECKPOINT_FILE), "w") as file:
+        json.dump(checkpoint, file, indent=2)
+
+    logging.info(
+        f"💾 Checkpoint {checkpoint_id} created for lab {lab.hash} "
+        f"({len(devices)} devices, table dump: {table_dump_saved}, stopped: {checkpoint['stopped']})"
+    )
+    return checkpoint
+
+
+def list_checkpoints() -> list[dict]:
+    if not os.path.isdir(BACKEND_CHECKPOINTS_FOLDER):
+        return []
+    checkpoints = []
+    for checkpoint_id in os.listdir(BACKEND_CHECKPOINTS_FOLDER):
+        checkpoint = get_checkpoint(checkpoint_id)
+        if checkpoint is not None:
+            checkpoints.append({k: v for k, v in checkpoint.items() if k != "devices"} |
+                               {"devices_count": len(checkpoint["devices"])})
+    return sorted(checkpoints, key=lambda c: c["created_at"], reverse=True)
+
+
+def get_checkpoint(checkpoint_id: str) -> dict | None:
+    checkpoint_file = os.path.join(_checkpoint_dir(os.path.basename(checkpoint_id)), CHECKPOINT_FILE)
+    if not os.path.exists(checkpoint_file):
+        return None
+    try:
+        with open(checkpoint_file, "r") as file:
+            return json.load(file)
+    except Exception as e:
+        logging.warning(f"Corrupted checkpoint {checkpoint_id}: {e}")
+        return None
+
+
+def delete_checkpoint(checkpoint_id: str) -> bool:
+    """Delete the checkpoint metadata (containers are left untouched)"""
+    checkpoint_dir = _checkpoint_dir(os.path.basename(checkpoint_id))
+    if not os.path.isdir(checkpoint_dir):
+        return False
+    shutil.rmtree(checkpoint_dir, ignore_errors=True)
+    return True
+
+
+# ==================== RESTORE ====================
+
+def restore_checkpoint(checkpoint: dict, job: Job | None = None):
+    """
+    Restart the containers of a checkpoint and reattach the backend to the lab.
+    No dumps loading, scenario build or configuration rendering is done.
+
+    Returns:
+        The restored Kathara lab
+    """
+    lab_hash = checkpoint["lab_hash"]
+
+    with job_phase(job, "verify"):
+        containers = {c.labels.get("name"): c for c in get_lab_containers(lab_hash)}
+        missing = sorted(set(checkpoint["devices"]) - set(containers))
+        if missing:
+            raise CheckpointError(
+                f"{len(missing)} containers of the checkpoint no longer exist (e.g. {missing[:5]}), "
+                f"a cold start is needed"
+            )
+        to_start = [c for name, c in containers.items() if name in checkpoint["devices"] and c.status != "running"]
+        if job is not None:
+            job.set_devices_total(len(to_start))
+
+    # Il table dump torna in build cache: un successivo /start o /reload non lo ricarica
+    if checkpoint.get("table_dump") and checkpoint.get("build_key"):
+        with job_phase(job, "restore artefacts"):
+            with open(os.path.join(_checkpoint_dir(checkpoint["id"]), CHECKPOINT_TABLE_DUMP_FILE), "rb") as file:
+                get_build_cache().put_dumps(checkpoint["build_key"], pickle.load(file))
+
+    def resume(container):
+        container.start()
+        device = checkpoint["devices"][container.labels.get("name")]
+        command = RESUME_COMMAND.format(name=container.labels.get("name"), exec_commands=device["exec_commands"])
+        container.exec_run([device["shell"], "-c", command], detach=True, privileged=False)
+
+    with job_phase(job, "start containers"):
+        logging.info(f"Starting {len(to_start)} stopped containers of lab {lab_hash}...")
+        failures = run_on_containers(to_start, resume, job, max_workers=MAX_CONTAINER_WORKERS)
+        if failures:
+            raise CheckpointError(f"{len(failures)} containers failed to start: {failures}")
+
+    with job_phase(job, "reattach"):
+        # Se lo scenario è ancora in memoria si riusa, altrimenti si ricostruisce il lab dalle API
+        cached = get_build_cache().get_scenario(checkpoint["build_key"]) if checkpoint.get("build_key") else None
+        if cached is not None and cached[0].hash == lab_hash:
+            lab, discovered = cached[0], False
+        else:
+            from Kathara.manager.Kathara import Kathara
+
+            lab, discovered = Kathara.get_instance().get_lab_from_api(lab_hash), True
+        ServerContext.set_lab_context(lab, checkpoint.get("ixpconf_filename"), is_discovered=discovered)
+        save_lab_manifest(
+            lab, checkpoint.get("ixpconf_filename"), get_lab_containers(lab_hash), checkpoint.get("build_key")
+        )
+
+    logging.info(f"♻️ Checkpoint {checkpoint['id']} restored, lab {lab_hash} is ready")
+    return lab
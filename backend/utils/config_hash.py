@@ -0,0 +1,165 @@
+import hashlib
+import ipaddress
+import json
+import logging
+import os
+import threading
+import time
+
+from globals import BACKEND_STATE_FOLDER
+from utils.file_utils import file_digest
+
+# Da incrementare quando cambia il modo in cui vengono calcolati gli hash
+CONFIG_HASH_VERSION = 1
+
+CONFIG_HASHES_FOLDER = os.path.join(BACKEND_STATE_FOLDER, "config_hashes")
+
+# Oltre questa profondità gli oggetti vengono confrontati tramite str() (evita cicli)
+MAX_CANONICAL_DEPTH = 8
+
+_store_lock = threading.Lock()
+
+
+def _canonical(value, depth: int = 0):
+    """
+    JSON-serializable, order-independent form of a rendered configuration.
+    Strings pointing to local files are replaced by the file content digest,
+    so that configurations rendered to disk are compared by content.
+    """
+    if depth > MAX_CANONICAL_DEPTH:
+        return str(value)
+    if isinstance(value, dict):
+        return {str(key): _canonical(item, depth + 1) for key, item in sorted(value.items(), key=lambda kv: str(kv[0]))}
+    if isinstance(value, (list, tuple)):
+        return [_canonical(item, depth + 1) for item in value]
+    if isinstance(value, (set, frozenset)):
+        return sorted((_canonical(item, depth + 1) for item in value), key=repr)
+    if isinstance(value, bytes):
+        return hashlib.sha256(value).hexdigest()
+    if isinstance(value, str):
+        if 0 < len(value) < 4096 and os.path.isabs(value) and os.path.isfile(value):
+            return {"file": value, "sha256": file_digest(value)}
+        return value
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    if isinstance(value, (ipaddress._BaseAddress, ipaddress._BaseNetwork)):
+        return str(value)
+    if hasattr(value, "__dict__"):
+        return {"type": type(value).__name__, "attrs": _canonical(vars(value), depth + 1)}
+    return str(value)
+
+
+def hash_value(value) -> str:
+    digest = hashlib.sha256(f"v{CONFIG_HASH_VERSION}".encode())
+    digest.update(json.dumps(_canonical(value), sort_keys=True, default=str).encode())
+    return digest.hexdigest()[:20]
+
+
+def machine_structure_hash(machine) -> str:
+    """
+    Hash of what is fixed when the container is created (image and
+    interfaces): if it changes the device must be recreated, a config push
+    is not enough. Meta is left out, since it is filled in by the FRR
+    configuration applier only for the devices being deployed.
+    """
+    interfaces = {
+        num: {
+            "link": interface.link.name if getattr(interface, "link", None) is not None else None,
+            "mac": getattr(interface, "mac_address", None),
+        }
+        for num, interface in machine.interfaces.items()
+    }
+    return hash_value({"image": machine.get_image(), "interfaces": interfaces})
+
+
+def compute_structure_hashes(net_scenario) -> dict[str, str]:
+    return {name: machine_structure_hash(machine) for name, machine in net_scenario.machines.items()}
+
+
+def compute_config_hashes(device_info) -> dict[str, str] | None:
+    """
+    Per-device hashes of the device info passed to copy_and_exec_by_device_info.
+
+    Returns:
+        dict or None: None if device_info is not keyed by device (cannot be split)
+    """
+    if not isinstance(device_info, dict):
+        return None
+    return {str(device): hash_value(info) for device, info in device_info.items()}
+
+
+def diff_hashes(previous: dict[str, str] | None, current: dict[str, str]) -> dict[str, list[str]]:
+    """Split devices into added, removed, changed and unchanged comparing two hash maps"""
+    previous = previous or {}
+    return {
+        "added": sorted(set(current) - set(previous)),
+        "removed": sorted(set(previous) - set(current)),
+        "changed": sorted(name for name in current if name in previous and previous[name] != current[name]),
+        "unchanged": sorted(name for name in current if previous.get(name) == current[name]),
+    }
+
+
+def estimate_payload_bytes(value, depth: int = 0) -> int:
+    """Approximate bytes a device info entry uploads: content of referenced files, size of inline strings"""
+    if depth > MAX_CANONICAL_DEPTH:
+        return 0
+    if isinstance(value, dict):
+        return sum(estimate_payload_bytes(item, depth + 1) for item in value.values())
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return sum(estimate_payload_bytes(item, depth + 1) for item in value)
+    if isinstance(value, bytes):
+        return len(value)
+    if isinstance(value, str):
+        if 0 < len(value) < 4096 and os.path.isabs(value) and os.path.isfile(value):
+            return os.path.getsize(value)
+        return len(value.encode())
+    if hasattr(value, "__dict__") and not isinstance(value, type):
+        return estimate_payload_bytes(vars(value), depth + 1)
+    return 0
+
+
+# ==================== MANIFEST ====================
+
+def _manifest_path(lab_hash: str) -> str:
+    return os.path.join(CONFIG_HASHES_FOLDER, f"{lab_hash}.json")
+
+
+def load_config_hashes(lab_hash: str) -> dict | None:
+    """
+    Hashes of what is running in the lab, as saved after the last start/reload:
+    {"structure": {device: hash}, "config": {kind: {device: hash}}}
+    """
+    path = _manifest_path(lab_hash)
+    try:
+        with _store_lock, open(path, "r") as file:
+            manifest = json.load(file)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logging.warning(f"Could not read config hashes of lab {lab_hash}: {e}")
+        return None
+    if manifest.get("version") != CONFIG_HASH_VERSION:
+        return None
+    return manifest
+
+
+def save_config_hashes(lab_hash: str, structure: dict[str, str], config: dict[str, dict[str, str]]) -> None:
+    manifest = {
+        "version": CONFIG_HASH_VERSION,
+        "lab_hash": lab_hash,
+        "updated_at": time.time(),
+        "structure": structure,
+        "config": config,
+    }
+    path = _manifest_path(lab_hash)
+    try:
+        with _store_lock:
+            os.makedirs(CONFIG_HASHES_FOLDER, exist_ok=True)
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "w") as file:
+                json.dump(manifest, file)
+            os.replace(tmp_path, path)
+    except Exception as e:
+        logging.warning(f"Could not save config hashes of lab {lab_hash}: {e}")
+
+
@@ -0,0 +1,123 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from globals import get_backend_setting
+
+# Device aggiornati in parallelo (sovrascrivibile con "push_concurrency" in settings.json)
+DEFAULT_PUSH_CONCURRENCY = 16
+# Secondi concessi a ogni device per copia e reload (sovrascrivibile con "push_timeout")
+DEFAULT_PUSH_TIMEOUT = 120
+
+PUSH_OK = "ok"
+PUSH_FAILED = "failed"
+PUSH_TIMEOUT = "timeout"
+
+# Ogni quanto il ciclo di attesa controlla timeout e cancellazione
+_POLL_INTERVAL = 0.5
+
+
+def get_push_limits() -> tuple[int, float]:
+    concurrency = int(get_backend_setting("push_concurrency", DEFAULT_PUSH_CONCURRENCY))
+    timeout = float(get_backend_setting("push_timeout", DEFAULT_PUSH_TIMEOUT))
+    return max(1, concurrency), timeout
+
+
+def push_device_info(net_scenario_manager, device_info: dict, job=None,
+                     concurrency: int | None = None, timeout: float | None = None) -> dict[str, dict]:
+    """
+    Copy the files and run the reload commands of each device in parallel,
+    one copy_and_exec_by_device_info call per device.
+
+    Args:
+        net_scenario_manager: Manager of the running lab
+        device_info: Device name -> info, as returned by get_device_info
+        job: Optional job on which per-device progress and failures are reported
+        concurrency: Devices updated at the same time (default "push_concurrency")
+        timeout: Seconds per device, counted from when its push starts (default "push_timeout")
+
+    Returns:
+        dict: Device name -> {"status", "return_code", "duration", "error"}
+    """
+    default_concurrency, default_timeout = get_push_limits()
+    concurrency = concurrency or default_concurrency
+    timeout = timeout or default_timeout
+
+    results = {}
+    if not device_info:
+        return results
+
+    started_at = {}
+    started_lock = threading.Lock()
+
+    def push(device):
+        with started_lock:
+            started_at[device] = time.monotonic()
+        return net_scenario_manager.copy_and_exec_by_device_info({device: device_info[device]})
+
+    def record(device, status, return_code=None, error=None):
+        begin = started_at.get(device)
+        results[device] = {
+            "status": status,
+            "return_code": return_code,
+            "duration": round(time.monotonic() - begin, 3) if begin is not None else None,
+            "error": error,
+        }
+        if job is None:
+            return
+        if status == PUSH_OK:
+            job.device_completed(device)
+        else:
+            job.add_failure(device, error)
+
+    # Niente context manager: un device bloccato non deve trattenere il reload allo shutdown del pool
+    pool = ThreadPoolExecutor(max_workers=min(concurrency, len(device_info)), thread_name_prefix="config-push")
+    try:
+        pending = {pool.submit(push, device): device for device in device_info}
+        while pending:
+            done, _ = wait(pending, timeout=_POLL_INTERVAL, return_when=FIRST_COMPLETED)
+            for future in done:
+                device = pending.pop(future)
+                try:
+                    return_code = future.result()
+                    if return_code in (0, None):
+                        record(device, PUSH_OK, return_code)
+                    else:
+                        record(device, PUSH_FAILED, return_code, f"return code {return_code}")
+                except Exception as e:
+                    record(device, PUSH_FAILED, error=str(e))
+
+            now = time.monotonic()
+            with started_lock:
+                expired = [
+                    future for future, device in pending.items()
+                    if device in started_at and now - started_at[device] > timeout
+                ]
+            for future in expired:
+                # Il thread non può essere interrotto: il risultato viene ignorato
+                device = pending.pop(future)
+                logging.warning(f"Config push to {device} timed out after {timeout}s")
+                record(device, PUSH_TIMEOUT, error=f"timed out after {timeout}s")
+
+            if job is not None and job.is_cancelled():
+                for future in pending:
+                    future.cancel()
+                job.check_cancelled()
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    return results
+
+
+def summarize_push(results: dict[str, dict]) -> dict:
+    """Counts per status and the slowest devices"""
+    summary = {PUSH_OK: 0, PUSH_FAILED: 0, PUSH_TIMEOUT: 0}
+    for result in results.values():
+        summary[result["status"]] += 1
+    slowest = sorted(
+        ((device, result["duration"]) for device, result in results.items() if result["duration"] is not None),
+        key=lambda item: item[1], reverse=True,
+    )
+    summary["slowest"] = [{"device": device, "duration": duration} for device, duration in slowest[:5]]
+    return summary
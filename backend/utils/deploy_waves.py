@@ -0,0 +1,187 @@
+import logging
+import math
+import time
+
+from globals import get_backend_setting
+from utils.lab_scheduler import get_host_resources, get_admission_limits
+from utils.shared_state import get_shared_state
+
+# Default delle ondate di deploy (sovrascrivibili in settings.json)
+DEFAULT_WAVE_MIN_SIZE = 2
+DEFAULT_WAVE_MAX_SIZE = 96
+DEFAULT_WAVE_MAX_LOAD = 0.85
+DEFAULT_WAVE_DOCKER_LATENCY_MS = 250
+
+# Ultimo report di deploy di ogni lab, condiviso tra i worker (utils/shared_state.py)
+DEPLOY_WAVES_NAMESPACE = "deploy_waves"
+DEPLOY_WAVES_TTL = 7 * 24 * 3600
+
+
+def get_wave_limits() -> dict:
+    admission = get_admission_limits()
+    return {
+        "enabled": bool(get_backend_setting("deploy_waves_enabled", True)),
+        "min_size": max(1, int(get_backend_setting("deploy_wave_min_size", DEFAULT_WAVE_MIN_SIZE))),
+        "max_size": max(1, int(get_backend_setting("deploy_wave_max_size", DEFAULT_WAVE_MAX_SIZE))),
+        "max_load": float(get_backend_setting("deploy_wave_max_load", DEFAULT_WAVE_MAX_LOAD)),
+        "docker_latency_ms": float(get_backend_setting("deploy_wave_docker_latency_ms", DEFAULT_WAVE_DOCKER_LATENCY_MS)),
+        "device_memory_mb": admission["device_memory_mb"],
+        "memory_reserve_mb": admission["memory_reserve_mb"],
+    }
+
+
+def measure_docker_latency() -> float | None:
+    """Round trip of a ping to the Docker daemon, in milliseconds (None if it does not answer)"""
+    from utils.docker_utils import get_docker_client
+
+    try:
+        started = time.perf_counter()
+        get_docker_client().ping()
+        return round((time.perf_counter() - started) * 1000, 1)
+    except Exception as e:
+        logging.warning(f"Docker daemon ping failed: {e}")
+        return None
+
+
+class WaveSizer:
+    """
+    Size of the next deploy wave, from the host state measured before each wave
+    and the throughput of the previous ones:
+    - never more devices than the free memory can take;
+    - halved when the host load or the Docker daemon latency are over the limits;
+    - grown by half while the host has headroom and throughput keeps up;
+    - shrunk by a quarter when throughput drops below 80% of the best wave.
+    """
+
+    def __init__(self, limits: dict, cpus: int):
+        self.limits = limits
+        # Partenza: metà dei core, così un host piccolo non va in thrashing alla prima ondata
+        self.size = self._clamp(cpus // 2)
+        self.best_throughput = 0.0
+        self.last_throughput = None
+
+    def _clamp(self, size: int) -> int:
+        return max(self.limits["min_size"], min(self.limits["max_size"], size))
+
+    def next_size(self, host: dict, docker_latency_ms: float | None) -> tuple[int, str]:
+        """Size of the next wave and why it was chosen"""
+        limits = self.limits
+        if host["load_ratio"] > limits["max_load"]:
+            self.size, reason = self._clamp(self.size // 2), f"load {host['load_ratio']} > {limits['max_load']}"
+        elif docker_latency_ms is not None and docker_latency_ms > limits["docker_latency_ms"]:
+            self.size, reason = self._clamp(self.size // 2), f"docker latency {docker_latency_ms}ms"
+        elif self.last_throughput is None:
+            reason = "initial"
+        elif self.last_throughput < 0.8 * self.best_throughput:
+            self.size, reason = self._clamp(math.floor(self.size * 0.75)), "throughput dropped"
+        elif host["load_ratio"] < 0.75 * limits["max_load"]:
+            self.size, reason = self._clamp(math.ceil(self.size * 1.5)), "headroom"
+        else:
+            reason = "steady"
+
+        memory_free = host["memory_available_mb"] - limits["memory_reserve_mb"]
+        memory_cap = int(memory_free // limits["device_memory_mb"]) if limits["device_memory_mb"] > 0 else self.size
+        if memory_cap < self.size:
+            self.size, reason = max(limits["min_size"], memory_cap), f"memory ({round(memory_free)}MB free)"
+        return self.size, reason
+
+    def record(self, throughput: float) -> None:
+        """Record the throughput (devices/s) of a completed wave"""
+        self.last_throughput = throughput
+        self.best_throughput = max(self.best_throughput, throughput)
+
+
+def deploy_in_waves(lab, route_servers: list[str], job=None, listener=None, exclude=frozenset()) -> dict:
+    """
+    Deploy the lab in waves sized on the host CPU load, free memory and Docker
+    daemon latency: route servers first, then the other devices.
+
+    Args:
+        lab: Kathara lab to deploy
+        route_servers: Names of the route server devices of the lab
+        job: Job (optional) on which the waves are reported and cancellation is checked
+        listener: KatharaDeployListener of the job, told how many waves are expected
+        exclude: Devices already running (e.g. claimed from the warm pool), not deployed
+
+    Returns:
+        dict: Deploy report (wave sizes, timings and throughput), also kept in the shared state store
+    """
+    from utils.lab_utils import get_kathara
+
+    limits = get_wave_limits()
+    route_servers = [name for name in route_servers if name in lab.machines and name not in exclude]
+    members = [name for name in lab.machines if name not in set(route_servers) and name not in exclude]
+    host = get_host_resources()
+    sizer = WaveSizer(limits, host["cpus"])
+
+    report = {
+        "lab_hash": lab.hash,
+        "devices": len(route_servers) + len(members),
+        "cpus": host["cpus"],
+        "started_at": time.time(),
+        "waves": [],
+    }
+    started = time.perf_counter()
+
+    def deploy_wave(names: list[str], kind: str, host: dict, latency: float | None, reason: str):
+        if job is not None:
+            job.check_cancelled()
+        wave_started = time.perf_counter()
+        get_kathara().deploy_lab(lab, selected_machines=set(names))
+        duration = time.perf_counter() - wave_started
+        throughput = len(names) / duration if duration > 0 else float(len(names))
+        if kind == "members":
+            sizer.record(throughput)
+        wave = {
+            "index": len(report["waves"]) + 1,
+            "kind": kind,
+            "size": len(names),
+            "reason": reason,
+            "duration_s": round(duration, 2),
+            "throughput": round(throughput, 2),
+            "load_ratio": host["load_ratio"],
+            "memory_available_mb": host["memory_available_mb"],
+            "docker_latency_ms": latency,
+        }
+        report["waves"].append(wave)
+        logging.info(
+            f"🌊 Wave {wave['index']} ({kind}): {wave['size']} devices in {wave['duration_s']}s "
+            f"({wave['throughput']} dev/s, {reason})"
+        )
+        if job is not None:
+            job.emit("deploy_wave", **wave)
+
+    # I route server per primi: i membri trovano le sessioni BGP già disponibili
+    if route_servers:
+        if listener is not None:
+            listener.expected_chunks = 1 + math.ceil(len(members) / sizer.size)
+        deploy_wave(route_servers, "route_servers", host, measure_docker_latency(), "route servers first")
+
+    position = 0
+    while position < len(members):
+        host = get_host_resources()
+        latency = measure_docker_latency()
+        size, reason = sizer.next_size(host, latency)
+        if listener is not None:
+            listener.expected_chunks = len(report["waves"]) + math.ceil((len(members) - position) / size)
+        deploy_wave(members[position:position + size], "members", host, latency, reason)
+        position += size
+
+    report["duration_s"] = round(time.perf_counter() - started, 2)
+    report["throughput"] = round(report["devices"] / report["duration_s"], 2) if report["duration_s"] else None
+    report["wave_sizes"] = [wave["size"] for wave in report["waves"]]
+    logging.info(
+        f"🌊 Lab {lab.hash} deployed in {len(report['waves'])} waves {report['wave_sizes']}, "
+        f"{report['duration_s']}s ({report['throughput']} dev/s)"
+    )
+    try:
+        get_shared_state().put(DEPLOY_WAVES_NAMESPACE, lab.hash, report, ttl=DEPLOY_WAVES_TTL)
+    except Exception as e:
+        logging.warning(f"Could not store the deploy report of lab {lab.hash}: {e}")
+    return report
+
+
+def get_deploy_reports() -> list[dict]:
+    """Last deploy report of each lab, most recent first"""
+    reports = get_shared_state().items(DEPLOY_WAVES_NAMESPACE).values()
+    return sorted(reports, key=lambda report: report["started_at"], reverse=True)
@@ -1,5 +1,5 @@
-import docker
 import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 _docker_client = None
 
@@ -10,10 +10,19 @@ def get_docker_client():
     """
     global _docker_client
     if _docker_client is None:
+        # Import al primo uso: il Docker SDK non rallenta l'avvio del backend
+        import docker
+
         _docker_client = docker.from_env()
     return _docker_client
 
 
+def reset_docker_client():
+    """Drop the Docker client singleton: the next get_docker_client() opens a new connection"""
+    global _docker_client
+    _docker_client = None
+
+
 def get_all_running_containers():
     """
     Ottieni tutti i container in esecuzione in una sola query
@@ -43,3 +52,60 @@ def find_container_by_name(containers, device_name, lab_hash):
         if device_name in container.name and lab_hash in container.name:
             return container
     return None
+
+
+def get_lab_containers(lab_hash):
+    """
+    Tutti i container (anche fermi) di un lab Kathara, tramite le label
+    """
+    return get_docker_client().containers.list(
+        all=True, filters={"label": ["app=kathara", f"lab_hash={lab_hash}"]}, ignore_removed=True
+    )
+
+
+def get_kathara_containers():
+    """
+    Tutti i container Kathara dell'host (anche fermi), raggruppati per hash del lab, in una sola query
+    """
+    labs = {}
+    for container in get_docker_client().containers.list(
+        all=True, filters={"label": "app=kathara"}, ignore_removed=True
+    ):
+        lab_hash = container.labels.get("lab_hash")
+        if lab_hash:
+            labs.setdefault(lab_hash, []).append(container)
+    return labs
+
+
+def run_on_containers(containers, action, job=None, max_workers=32):
+    """
+    Esegue action(container) in parallelo, con al massimo max_workers thread
+    
+    Args:
+        containers: Lista di container docker
+        action: Funzione da eseguire su ogni container
+        job: Job (opzionale) su cui riportare avanzamento e fallimenti
+        max_workers: Concorrenza massima
+        
+    Returns:
+        dict: Nome device -> errore, per i container su cui action è fallita
+    """
+    failures = {}
+    if not containers:
+        return failures
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(containers)))) as pool:
+        futures = {
+            pool.submit(action, container): container.labels.get("name", container.name)
+            for container in containers
+        }
+        for future in as_completed(futures):
+            device = futures[future]
+            try:
+                future.result()
+                if job is not None:
+                    job.device_completed(device)
+            except Exception as e:
+                failures[device] = str(e)
+                if job is not None:
+                    job.add_failure(device, str(e))
+    return failures
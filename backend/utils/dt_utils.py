@@ -1,9 +1,16 @@
 import os
 import json
+import logging
 import ipaddress
 
-from globals import BACKEND_RESOURCES_FOLDER, BACKEND_IXPCONFIGS_FOLDER
+from globals import BACKEND_RESOURCES_FOLDER, BACKEND_IXPCONFIGS_FOLDER, get_backend_setting
 from digital_twin.ixp.settings.settings import Settings
+from digital_twin.ixp.foundation.dumps.member_dump.member_dump_factory import MemberDumpFactory
+from digital_twin.ixp.foundation.dumps.table_dump.table_dump_factory import TableDumpFactory
+from utils.build_cache import get_build_cache
+from utils.parallel_load import load_table_dump_parallel
+from utils.profiler import profile_phase, profile_annotate
+from utils.member_selection import apply_member_selection
 
 
 """
@@ -33,4 +40,83 @@ def load_settings_from_disk(setting_obj: Settings, filename):
         setting_obj.quarantine["probe_ips"]["4"] = ipaddress.ip_address(setting_obj.quarantine["probe_ips"]["4"])
     if setting_obj.quarantine["probe_ips"]["6"]:
         setting_obj.quarantine["probe_ips"]["6"] = ipaddress.ip_address(setting_obj.quarantine["probe_ips"]["6"])
-    
\ No newline at end of file
+
+
+def load_table_dump(settings: Settings, build_key: str | None = None):
+    """
+    Load the member dump and all the RIB dumps configured in settings into a
+    table dump, limited by the member selection (see utils/member_selection.py).
+
+    If build_key is given, the result is served from/stored into the build cache.
+    """
+    if build_key is not None:
+        with profile_phase("dumps_cache_lookup"):
+            table_dump = get_build_cache().get_dumps(build_key)
+        if table_dump is not None:
+            logging.info(f"♻️ Table dump served from build cache ({len(table_dump.entries)} devices)")
+            profile_annotate(dumps_cache_hit=True, devices=len(table_dump.entries))
+            return table_dump
+
+    table_dump = None
+    if get_backend_setting("parallel_dump_loading", True):
+        try:
+            with profile_phase("dumps_loading_parallel"):
+                table_dump = load_table_dump_parallel(settings)
+        except Exception as e:
+            logging.warning(f"⚠️ Parallel dumps loading failed ({e}), falling back to sequential loading")
+            profile_annotate(dumps_loading_fallback=f"parallel loading failed: {e}")
+            table_dump = None
+
+    # Modalità effettiva nei metadati del profilo: un fallback al sequenziale resta visibile
+    profile_annotate(dumps_loading_mode="parallel" if table_dump is not None else "sequential")
+    if table_dump is None:
+        table_dump = _load_table_dump_sequential(settings)
+
+    # Limit entries with the configured member selection (default: first MAX_DEVICES)
+    with profile_phase("member_selection"):
+        selection_summary = apply_member_selection(table_dump)
+
+    profile_annotate(dumps_cache_hit=False, devices=len(table_dump.entries), member_selection=selection_summary)
+
+    if build_key is not None:
+        get_build_cache().put_dumps(build_key, table_dump)
+
+    return table_dump
+
+
+def _load_table_dump_sequential(settings: Settings):
+    """
+    Load the member dump and then every RIB dump, one after another
+    """
+    # Load member dump
+    try:
+        with profile_phase("member_dump_parsing"):
+            member_dump_class = MemberDumpFactory(submodule_package="digital_twin").get_class_from_name(
+                settings.peering_configuration["type"]
+            )
+            entries = member_dump_class().load_from_file(
+                os.path.join(BACKEND_RESOURCES_FOLDER, settings.peering_configuration["path"])
+            )
+        logging.info(f"Loaded {len(entries)} member entries")
+    except Exception as e:
+        logging.error(f"Failed to load member dump: {e}")
+        raise
+
+    # Load table dump
+    try:
+        table_dump = TableDumpFactory(submodule_package="digital_twin").get_class_from_name(
+            settings.rib_dumps["type"]
+        )(entries)
+
+        for v, file in settings.rib_dumps["dumps"].items():
+            dump_path = os.path.join(BACKEND_RESOURCES_FOLDER, file)
+            logging.info(f"Loading RIB dump (IPv{v}): {dump_path}")
+            with profile_phase(f"table_dump_loading_ipv{v}", size_bytes=os.path.getsize(dump_path)):
+                table_dump.load_from_file(dump_path)
+
+        logging.info(f"Loaded RIB dumps for {len(settings.rib_dumps['dumps'])} IP versions")
+    except Exception as e:
+        logging.error(f"Failed to load RIB dumps: {e}")
+        raise
+
+    return table_dump
@@ -0,0 +1,192 @@
+import logging
+import statistics
+import threading
+import time
+
+from globals import get_backend_setting
+from utils.docker_utils import get_docker_client, get_lab_containers, reset_docker_client
+
+# Iterazioni massime di un benchmark, per non occupare a lungo il device
+MAX_BENCHMARK_ITERATIONS = 200
+
+
+class DeviceNotRunning(Exception):
+    """No running container for the device in the lab"""
+
+
+def fast_path_enabled() -> bool:
+    return bool(get_backend_setting("exec_fast_path", True))
+
+
+class ExecChannels:
+    """
+    Fast path for the device commands: Docker exec called directly, without Kathara.
+
+    Kathara.exec looks up the lab and the machine through the Docker API at
+    every call before creating the exec instance. Here the device -> container
+    id map of a lab is fetched with one query and kept, so a command costs only
+    the exec create/start/inspect round trips, with stdout and stderr demuxed
+    and the real exit code. The map of a lab is fetched again when a container
+    is gone (lab reloaded or restarted), and the Docker client is reopened when
+    the connection to the daemon drops; in both cases the command is retried once.
+
+    A persistent shell per device would also save the exec creation, but the
+    commands would share shell state and their output boundaries would have to
+    be guessed from the stream: a Docker exec per command keeps them isolated.
+    """
+
+    def __init__(self):
+        self._containers = {}
+        self._lock = threading.Lock()
+        self._stats = {"commands": 0, "lookups": 0, "reconnects": 0}
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self._stats[name] += 1
+
+    def _resolve(self, lab_hash: str, device: str, refresh: bool = False) -> dict:
+        with self._lock:
+            channel = None if refresh else self._containers.get(lab_hash, {}).get(device)
+        if channel is not None:
+            return channel
+
+        # Una sola query per tutti i device del lab
+        self._count("lookups")
+        channels = {
+            c.labels.get("name"): {"container_id": c.id, "shell": c.labels.get("shell", "/bin/bash")}
+            for c in get_lab_containers(lab_hash) if c.status == "running"
+        }
+        with self._lock:
+            self._containers[lab_hash] = channels
+        if device not in channels:
+            raise DeviceNotRunning(f"device {device} not running in lab {lab_hash}")
+        return channels[device]
+
+    def shell(self, lab_hash: str, device: str) -> str:
+        """Shell the commands of a device run in (its Kathara `shell` label)"""
+        return self._resolve(lab_hash, device)["shell"]
+
+    def forget(self, lab_hash: str) -> None:
+        with self._lock:
+            self._containers.pop(lab_hash, None)
+
+    def exec(self, lab_hash: str, device: str, command: str) -> tuple[str, str, int | None]:
+        """
+        Run command in the shell of a device
+
+        Returns:
+            tuple: stdout, stderr, exit code
+        """
+        import docker.errors
+        import requests.exceptions
+
+        self._count("commands")
+        for attempt in range(2):
+            channel = self._resolve(lab_hash, device, refresh=attempt > 0)
+            try:
+                api = get_docker_client().api
+                exec_id = api.exec_create(
+                    channel["container_id"], [channel["shell"], "-c", command], stdout=True, stderr=True
+                )["Id"]
+                stdout, stderr = api.exec_start(exec_id, demux=True)
+                exit_code = api.exec_inspect(exec_id).get("ExitCode")
+                return (
+                    stdout.decode("utf-8", errors="replace") if stdout else "",
+                    stderr.decode("utf-8", errors="replace") if stderr else "",
+                    exit_code,
+                )
+            except docker.errors.NotFound:
+                if attempt:
+                    raise
+                logging.info(f"Container of {device} gone, looking up lab {lab_hash} again")
+            except requests.exceptions.ConnectionError as e:
+                if attempt:
+                    raise
+                logging.warning(f"Docker connection lost ({e}), reconnecting")
+                self._count("reconnects")
+                reset_docker_client()
+
+    def execute_command(self, machine_name: str, command: str, lab) -> str:
+        """Fast path of execute_command_on_machine, with the same output format"""
+        from utils.lab_utils import format_command_output
+
+        stdout, stderr, exit_code = self.exec(lab.hash, machine_name, command)
+        return format_command_output(stdout, exit_code, stderr)
+
+    def status(self) -> dict:
+        with self._lock:
+            return {
+                "enabled": fast_path_enabled(),
+                "labs": len(self._containers),
+                "devices": sum(len(channels) for channels in self._containers.values()),
+                **self._stats,
+            }
+
+
+# Singleton
+_exec_channels = ExecChannels()
+
+
+def get_exec_channels():
+    return _exec_channels
+
+
+def _latency_summary(samples: list[float]) -> dict:
+    ordered = sorted(samples)
+    return {
+        "iterations": len(samples),
+        "min_ms": round(ordered[0] * 1000, 2),
+        "p50_ms": round(statistics.median(ordered) * 1000, 2),
+        "p95_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000, 2),
+        "mean_ms": round(statistics.fmean(ordered) * 1000, 2),
+        "max_ms": round(ordered[-1] * 1000, 2),
+    }
+
+
+def benchmark_exec(lab, machine_name: str, command: str, iterations: int = 20) -> dict:
+    """
+    Per-command latency of the Kathara path and of the fast path, on the same
+    device and command (both run it in the device shell), one after the other
+    (one warm-up call each)
+
+    Returns:
+        dict: Latency summary of each path and p50 speedup of the fast path
+    """
+    from utils.lab_utils import execute_command_on_machine
+
+    iterations = max(1, min(iterations, MAX_BENCHMARK_ITERATIONS))
+    channels = get_exec_channels()
+    # Stesso argv sui due percorsi: il fast path esegue il comando in `<shell> -c`
+    argv = [channels.shell(lab.hash, machine_name), "-c", command]
+    paths = {
+        "kathara": lambda: execute_command_on_machine(machine_name, argv, lab),
+        "fast_path": lambda: channels.execute_command(machine_name, command, lab),
+    }
+
+    results = {}
+    for name, run in paths.items():
+        if name == "fast_path":
+            # La prima chiamata include la ricerca dei container del lab
+            channels.forget(lab.hash)
+        started = time.perf_counter()
+        run()
+        cold = time.perf_counter() - started
+        samples = []
+        for _ in range(iterations):
+            started = time.perf_counter()
+            run()
+            samples.append(time.perf_counter() - started)
+        results[name] = {"cold_ms": round(cold * 1000, 2), **_latency_summary(samples)}
+
+    fast_p50 = results["fast_path"]["p50_ms"]
+    report = {
+        "device": machine_name,
+        "command": command,
+        **results,
+        "speedup_p50": round(results["kathara"]["p50_ms"] / fast_p50, 2) if fast_p50 else None,
+    }
+    logging.info(
+        f"⏱️ Exec benchmark on {machine_name}: kathara p50 {results['kathara']['p50_ms']}ms, "
+        f"fast path p50 {fast_p50}ms (x{report['speedup_p50']})"
+    )
+    return report
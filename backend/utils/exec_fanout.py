@@ -0,0 +1,108 @@
+import asyncio
+import fnmatch
+import logging
+import time
+import uuid
+
+from globals import get_backend_setting
+from utils.exec_pool import get_exec_pool, ExecTimeout, tracked_command, kill_tracked_command
+
+# Default del fan-out (sovrascrivibile in settings.json e per richiesta)
+DEFAULT_FANOUT_CONCURRENCY = 16
+
+# Ruoli selezionabili oltre al tipo di route server (bird, open_bgpd)
+ROLE_ROUTE_SERVER = "route_server"
+ROLE_MEMBER = "member"
+
+
+def get_fanout_concurrency() -> int:
+    return max(1, int(get_backend_setting("exec_fanout_concurrency", DEFAULT_FANOUT_CONCURRENCY)))
+
+
+def select_devices(running: list[str], route_servers: dict[str, str], devices: list[str] | None = None,
+                   glob: str | None = None, role: str | None = None) -> list[str]:
+    """
+    Running devices matching all the given selectors
+
+    Args:
+        running: Names of the running devices of the lab
+        route_servers: Route server devices of the lab ixpconf -> type
+        devices: Explicit device names
+        glob: Shell-style pattern on the device name (e.g. `as6*`)
+        role: `route_server`, `member` or a route server type (`bird`, `open_bgpd`)
+    """
+    selected = sorted(running)
+    if devices is not None:
+        wanted = set(devices)
+        selected = [name for name in selected if name in wanted]
+    if glob:
+        selected = [name for name in selected if fnmatch.fnmatchcase(name, glob)]
+    if role == ROLE_ROUTE_SERVER:
+        selected = [name for name in selected if name in route_servers]
+    elif role == ROLE_MEMBER:
+        selected = [name for name in selected if name not in route_servers]
+    elif role:
+        selected = [name for name in selected if route_servers.get(name) == role]
+    return selected
+
+
+def exec_on_container(container, command: str) -> dict:
+    """Run command in a device container, with its exit code, output and duration"""
+    started = time.perf_counter()
+    result = container.exec_run(
+        [container.labels.get("shell", "/bin/bash"), "-c", command], stdout=True, stderr=True, demux=True
+    )
+    stdout, stderr = result.output if result.output else (None, None)
+    return {
+        "exit_code": result.exit_code,
+        "duration_s": round(time.perf_counter() - started, 3),
+        "stdout": stdout.decode("utf-8", errors="replace") if stdout else "",
+        "stderr": stderr.decode("utf-8", errors="replace") if stderr else "",
+    }
+
+
+async def fan_out(containers: dict, command: str, concurrency: int | None = None, timeout: float | None = None):
+    """
+    Run command on many devices, at most `concurrency` at a time, on the exec
+    executor (utils/exec_pool.py). The containers come from a single Docker
+    query, so no Kathara lookup is made per device.
+
+    Args:
+        containers: Device name -> Docker container
+        concurrency: Devices running the command at the same time (default `exec_fanout_concurrency`)
+        timeout: Seconds each device has to complete (default `exec_timeout`), then the command is killed
+
+    Yields:
+        dict: Result of each device as soon as it completes (device, exit_code, duration_s, stdout, stderr, error)
+    """
+    semaphore = asyncio.Semaphore(concurrency or get_fanout_concurrency())
+    pool = get_exec_pool()
+
+    async def run(device: str, container) -> dict:
+        async with semaphore:
+            started = time.perf_counter()
+            tag = uuid.uuid4().hex
+            try:
+                result = await pool.run(
+                    exec_on_container, container, tracked_command(command, tag), timeout=timeout,
+                    on_abort=lambda: exec_on_container(container, kill_tracked_command(tag)),
+                )
+                return {"device": device, **result, "error": None}
+            except ExecTimeout as e:
+                error = str(e)
+            except Exception as e:
+                logging.warning(f"Command failed on {device}: {e}")
+                error = str(e)
+            return {
+                "device": device, "exit_code": None, "duration_s": round(time.perf_counter() - started, 3),
+                "stdout": "", "stderr": "", "error": error,
+            }
+
+    tasks = [asyncio.create_task(run(device, container)) for device, container in containers.items()]
+    try:
+        for completed in asyncio.as_completed(tasks):
+            yield await completed
+    finally:
+        # Client disconnesso: i device ancora in coda non vengono eseguiti
+        for task in tasks:
+            task.cancel()
@@ -0,0 +1,312 @@
+import asyncio
+import codecs
+import concurrent.futures
+import logging
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from globals import get_backend_setting
+
+# Default dell'executor dei comandi (sovrascrivibili in settings.json)
+DEFAULT_EXEC_CONCURRENCY = 32
+DEFAULT_EXEC_TIMEOUT = 60
+DEFAULT_EXEC_STREAMS = 16
+DEFAULT_EXEC_STREAM_BUFFER = 64
+
+# Prima riga dello stdout di un comando in streaming: il pid della shell, per poterlo interrompere
+STREAM_PID_MARKER = "__exec_stream_pid__"
+
+# Nel container: pid della shell di un comando in esecuzione, per poterlo interrompere allo scadere del timeout
+EXEC_PID_FILE = "/tmp/.exec-{tag}.pid"
+
+
+class ExecTimeout(Exception):
+    """A command did not complete (or did not get a worker) within its timeout"""
+
+
+class ExecStreamLimit(Exception):
+    """All the streaming slots of the worker are taken"""
+
+
+def get_exec_limits() -> dict:
+    return {
+        "concurrency": max(1, int(get_backend_setting("exec_concurrency", DEFAULT_EXEC_CONCURRENCY))),
+        "timeout": float(get_backend_setting("exec_timeout", DEFAULT_EXEC_TIMEOUT)),
+        "streams": max(1, int(get_backend_setting("exec_streams", DEFAULT_EXEC_STREAMS))),
+        "stream_buffer": max(1, int(get_backend_setting("exec_stream_buffer", DEFAULT_EXEC_STREAM_BUFFER))),
+    }
+
+
+def tracked_command(command: str, tag: str) -> str:
+    """Shell script running command after recording its pid, so that kill_tracked_command(tag) can stop it"""
+    pid_file = EXEC_PID_FILE.format(tag=tag)
+    return f"echo $$ > {pid_file}\n{command}\nrc=$?; rm -f {pid_file}; exit $rc"
+
+
+def kill_tracked_command(tag: str) -> str:
+    """Shell script killing the tracked command tag and its children, if still running"""
+    pid_file = EXEC_PID_FILE.format(tag=tag)
+    return (f"if [ -f {pid_file} ]; then pid=$(cat {pid_file}); pkill -P $pid; kill $pid; rm -f {pid_file}; fi; "
+            f"exit 0")
+
+
+class ExecPool:
+    """
+    Bounded executor for the Kathara exec calls of the API.
+
+    Kathara.exec blocks until the command ends, so the async endpoints hand it
+    to these threads and await the result: the event loop keeps serving the
+    other requests (health checks, stats) while a slow `bgpctl` runs, and
+    concurrent commands run in parallel up to `exec_concurrency`.
+
+    Each call has a timeout that also covers the wait for a free worker. A call
+    timed out or cancelled (e.g. by the client going away) before it starts is
+    dropped; for one already running the caller's on_abort kills the command in
+    the container (see tracked_command), so that a hung `tcpdump` frees its
+    worker instead of holding it until it exits.
+    """
+
+    def __init__(self):
+        self._executor = None
+        self._concurrency = None
+        self._lock = threading.Lock()
+        self._aborts = set()
+        self._stats = {"submitted": 0, "running": 0, "completed": 0, "failed": 0, "timeouts": 0, "cancelled": 0,
+                       "killed": 0, "streaming": 0, "streams": 0}
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._concurrency = get_exec_limits()["concurrency"]
+                self._executor = ThreadPoolExecutor(max_workers=self._concurrency, thread_name_prefix="kathara-exec")
+            return self._executor
+
+    def _count(self, name: str, increment: int = 1) -> None:
+        with self._lock:
+            self._stats[name] += increment
+
+    def _run(self, function, args):
+        self._count("running")
+        try:
+            return function(*args)
+        finally:
+            self._count("running", -1)
+
+    def _abort(self, on_abort) -> None:
+        """Run on_abort outside the executor (its workers may all be hung), without waiting for it"""
+        async def abort():
+            try:
+                await asyncio.wait_for(asyncio.to_thread(on_abort), timeout=get_exec_limits()["timeout"])
+                self._count("killed")
+            except Exception as e:
+                logging.warning(f"Could not stop an aborted command: {e}")
+
+        task = asyncio.get_running_loop().create_task(abort())
+        # Riferimento fino alla fine, altrimenti il task può essere raccolto dal GC
+        self._aborts.add(task)
+        task.add_done_callback(self._aborts.discard)
+
+    async def run(self, function, *args, timeout: float | None = None, on_abort=None):
+        """
+        Run function(*args) on the exec executor and await its result.
+
+        Args:
+            on_abort: Called (on another thread) when the call times out or is cancelled, to stop the command
+
+        Raises:
+            ExecTimeout: Not completed within timeout (default `exec_timeout` seconds)
+        """
+        timeout = get_exec_limits()["timeout"] if timeout is None else timeout
+        loop = asyncio.get_running_loop()
+        self._count("submitted")
+        future = loop.run_in_executor(self._get_executor(), self._run, function, args)
+        try:
+            result = await asyncio.wait_for(future, timeout=timeout if timeout > 0 else None)
+        except asyncio.TimeoutError:
+            self._count("timeouts")
+            if on_abort is not None:
+                self._abort(on_abort)
+            raise ExecTimeout(f"command not completed within {timeout}s")
+        except asyncio.CancelledError:
+            self._count("cancelled")
+            if on_abort is not None:
+                self._abort(on_abort)
+            raise
+        except Exception:
+            self._count("failed")
+            raise
+        self._count("completed")
+        return result
+
+    async def execute_command(self, machine_name: str, command: str, lab, timeout: float | None = None) -> str:
+        """
+        Command output as execute_command_on_machine, on the exec executor: through
+        the Docker fast path (utils/exec_channels.py) unless `exec_fast_path` is off.
+        The command runs in a shell, killed in the container when the call times out
+        """
+        from utils.exec_channels import get_exec_channels, fast_path_enabled, DeviceNotRunning
+        from utils.lab_utils import execute_command_on_machine
+
+        def execute(script: str) -> str:
+            if fast_path_enabled():
+                try:
+                    return get_exec_channels().execute_command(machine_name, script, lab)
+                except DeviceNotRunning:
+                    # Device non trovato tra i container: decide Kathara (e il suo messaggio d'errore)
+                    pass
+            return execute_command_on_machine(machine_name, ["/bin/sh", "-c", script], lab)
+
+        tag = uuid.uuid4().hex
+        try:
+            return await self.run(
+                execute, tracked_command(command, tag), timeout=timeout,
+                on_abort=lambda: execute(kill_tracked_command(tag)),
+            )
+        except ExecTimeout:
+            logging.warning(f"⏱️ Command on {machine_name} timed out: {command}")
+            raise
+
+    def open_stream(self, machine_name: str, command: str, lab) -> "ExecStream":
+        """
+        Start streaming the output of a command on its own thread.
+
+        Raises:
+            ExecStreamLimit: `exec_streams` commands are already streaming on this worker
+        """
+        with self._lock:
+            if self._stats["streaming"] >= get_exec_limits()["streams"]:
+                raise ExecStreamLimit(f"{self._stats['streaming']} commands already streaming, retry later")
+            self._stats["streaming"] += 1
+            self._stats["streams"] += 1
+        stream = ExecStream(machine_name, command, lab, on_close=lambda: self._count("streaming", -1))
+        stream.start()
+        return stream
+
+    def status(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+        return {
+            "concurrency": self._concurrency or get_exec_limits()["concurrency"],
+            "timeout": get_exec_limits()["timeout"],
+            "stream_limit": get_exec_limits()["streams"],
+            **stats,
+        }
+
+
+class ExecStream:
+    """
+    Output of a command relayed chunk by chunk (Kathara exec with stream=True).
+
+    A dedicated thread reads the chunks from Docker and puts them in a bounded
+    queue read by the endpoint: when the client is slow the queue fills up and
+    the thread stops reading, so Docker stops sending (flow control) instead of
+    the output piling up in memory. The command runs as `sh -c 'echo <pid>; exec
+    <command>'`, so that cancel() can kill it in the container: a `tcpdump`
+    left running would keep its thread blocked on the next chunk.
+    """
+
+    def __init__(self, machine_name: str, command: str, lab, on_close=None):
+        self.machine_name = machine_name
+        self.command = command
+        self.lab = lab
+        self.pid = None
+        self._on_close = on_close
+        self._cancelled = threading.Event()
+        self._done = threading.Event()
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue(maxsize=get_exec_limits()["stream_buffer"])
+
+    def start(self) -> None:
+        threading.Thread(target=self._pump, name=f"kathara-stream-{self.machine_name}", daemon=True).start()
+
+    def _put(self, event: dict) -> bool:
+        """Hand an event to the loop, blocking while the queue is full (False if cancelled meanwhile)"""
+        future = asyncio.run_coroutine_threadsafe(self._queue.put(event), self._loop)
+        while True:
+            try:
+                future.result(timeout=0.5)
+                return True
+            except concurrent.futures.TimeoutError:
+                if self._cancelled.is_set():
+                    future.cancel()
+                    return False
+
+    def _pump(self) -> None:
+        from utils.lab_utils import stream_command_on_machine
+
+        decoders = {kind: codecs.getincrementaldecoder("utf-8")(errors="replace") for kind in ("stdout", "stderr")}
+        head = ""
+        chunks = stream_command_on_machine(
+            self.machine_name, ["/bin/sh", "-c", f"echo {STREAM_PID_MARKER} $$; exec {self.command}"], self.lab
+        )
+        try:
+            for kind, data in chunks:
+                if self._cancelled.is_set():
+                    break
+                text = decoders[kind].decode(data)
+                if kind == "stdout" and self.pid is None:
+                    # Il marker può arrivare spezzato: si accumula fino alla prima riga completa
+                    head += text
+                    if "\n" not in head:
+                        continue
+                    line, text = head.split("\n", 1)
+                    self.pid = line.removeprefix(STREAM_PID_MARKER).strip()
+                    if not self._put({"type": "started", "pid": self.pid}):
+                        break
+                if text and not self._put({"type": kind, "data": text}):
+                    break
+            else:
+                self._put({"type": "end"})
+        except Exception as e:
+            logging.error(f"Error streaming command on {self.machine_name}: {e}")
+            self._put({"type": "error", "message": str(e)})
+        finally:
+            chunks.close()
+            self._done.set()
+            if self._cancelled.is_set():
+                self._loop.call_soon_threadsafe(self._finish, {"type": "cancelled"})
+            if self._on_close is not None:
+                self._on_close()
+
+    def _finish(self, event: dict) -> None:
+        # Sul loop: l'evento finale entra anche a coda piena, al posto del chunk più vecchio
+        if self._queue.full():
+            self._queue.get_nowait()
+        self._queue.put_nowait(event)
+
+    async def events(self):
+        """Events of the stream: started, stdout, stderr, then one of end, error, cancelled"""
+        while True:
+            event = await self._queue.get()
+            yield event
+            if event["type"] in ("end", "error", "cancelled"):
+                return
+
+    async def cancel(self) -> None:
+        """Stop relaying the output and kill the command in the container"""
+        if self._cancelled.is_set() or self._done.is_set():
+            return
+        self._cancelled.set()
+        # Svuota la coda: il thread bloccato su una put vede la cancellazione e termina
+        while not self._queue.empty():
+            self._queue.get_nowait()
+        if self.pid and self.pid.isdigit():
+            from utils.lab_utils import execute_command_on_machine
+
+            try:
+                await asyncio.wait_for(asyncio.to_thread(
+                    execute_command_on_machine, self.machine_name,
+                    ["/bin/sh", "-c", f"pkill -P {self.pid}; kill {self.pid}"], self.lab,
+                ), timeout=get_exec_limits()["timeout"])
+            except Exception as e:
+                logging.warning(f"Could not kill command {self.pid} on {self.machine_name}: {e}")
+        logging.info(f"✋ Command streaming on {self.machine_name} cancelled")
+
+
+# Singleton
+_exec_pool = ExecPool()
+
+
+def get_exec_pool():
+    return _exec_pool
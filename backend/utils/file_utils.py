@@ -1,9 +1,17 @@
+import hashlib
 import json
 import logging
 import os.path
+import stat
+import tempfile
+import threading
 
 from globals import BACKEND_IXPCONFIGS_FOLDER, BACKEND_RESOURCES_FOLDER
 
+# (path, size, mtime_ns) -> digest, evita di ri-calcolare l'hash di file invariati
+_digest_cache: dict[tuple, str] = {}
+_digest_cache_lock = threading.Lock()
+
 
 def exists_file_in_directory(filename, path):
     logging.debug(f"Checking the existence of '{filename}' in '{path}'")
@@ -19,6 +27,25 @@ def exists_file_in_directory(filename, path):
     return result
 
 
+def write_file_atomically(file_path, content: str | bytes) -> None:
+    """
+    Write content to file_path through a temporary file renamed over it: a
+    build reading the file meanwhile sees the old or the new content, never a
+    truncated one
+    """
+    directory = os.path.dirname(os.path.abspath(file_path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(file_path)}-", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as file:
+            file.write(content if isinstance(content, bytes) else content.encode("utf-8"))
+        # mkstemp crea il file con permessi 0600: si mantengono quelli del file sostituito
+        os.chmod(tmp_path, stat.S_IMODE(os.stat(file_path).st_mode) if os.path.exists(file_path) else 0o644)
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
 def create_file_in_directory(filename, content, path):
     logging.info(f"Attempting creation of file '{filename}' in '{path}'")
     if not os.path.isdir(path):
@@ -26,11 +53,10 @@ def create_file_in_directory(filename, content, path):
         return False
     file_path = os.path.join(path, filename)
     try:
-        with open(file_path, "w") as file:
-            logging.info(f"Creating file {filename} in '{path}'")
-            file.write(content)
-            logging.info("File successfully created and content added")
-            return True
+        logging.info(f"Creating file {filename} in '{path}'")
+        write_file_atomically(file_path, content)
+        logging.info("File successfully created and content added")
+        return True
     except Exception as e:
         logging.error(f"An error occurred creating file {filename} in '{path}': {e}")
         return False
@@ -58,3 +84,46 @@ def get_resource_file_lines(filename):
 
 def get_ixpconf_file(filename):
     return json.loads(get_file_content(filename, BACKEND_IXPCONFIGS_FOLDER))
+
+
+def file_digest(path: str) -> str:
+    """
+    SHA-256 digest of a file, memoized on (path, size, mtime) so unchanged
+    multi-hundred-MB dumps are hashed only once per process
+    """
+    abs_path = os.path.abspath(path)
+    stat = os.stat(abs_path)
+    key = (abs_path, stat.st_size, stat.st_mtime_ns)
+    with _digest_cache_lock:
+        if key in _digest_cache:
+            return _digest_cache[key]
+
+    digest = hashlib.sha256()
+    with open(abs_path, "rb") as file:
+        for block in iter(lambda: file.read(1024 * 1024), b""):
+            digest.update(block)
+    result = digest.hexdigest()
+
+    with _digest_cache_lock:
+        # Rimuovi eventuali versioni precedenti dello stesso file
+        for stale_key in [k for k in _digest_cache if k[0] == abs_path]:
+            del _digest_cache[stale_key]
+        _digest_cache[key] = result
+    return result
+
+
+def seed_file_digest(path: str, size: int, mtime_ns: int, digest: str) -> bool:
+    """
+    Reuse a digest computed by a previous process (e.g. stored in a lab manifest)
+    if the file still has the same size and mtime. Returns False if it changed.
+    """
+    abs_path = os.path.abspath(path)
+    try:
+        stat = os.stat(abs_path)
+    except OSError:
+        return False
+    if stat.st_size != size or stat.st_mtime_ns != mtime_ns:
+        return False
+    with _digest_cache_lock:
+        _digest_cache[(abs_path, size, mtime_ns)] = digest
+    return True
@@ -0,0 +1,208 @@
+import logging
+import os
+import threading
+import time
+
+from globals import get_backend_setting
+from utils.docker_utils import get_docker_client
+from utils.shared_state import get_shared_state, process_alive
+
+PREWARM_IDLE = "idle"
+PREWARM_RUNNING = "running"
+PREWARM_READY = "ready"
+PREWARM_FAILED = "failed"
+
+# Immagini usate dai lab costruiti, per ixpconf (nello store condiviso, che sopravvive ai riavvii)
+LAB_IMAGES_NAMESPACE = "lab_images"
+# Immagini aggiuntive da preparare sempre
+PREWARM_IMAGES_SETTING = "prewarm_images"
+# Stato del prewarm condiviso tra i worker (uno solo lo esegue)
+PREWARM_NAMESPACE = "image_prewarm"
+PREWARM_KEY = "status"
+PREWARM_WAIT_POLL = 1.0
+
+
+def record_lab_images(ixpconf_filename: str, net_scenario) -> None:
+    """Remember the images a built lab needs, so that the next backend startup can prewarm them"""
+    try:
+        images = sorted({machine.get_image() for machine in net_scenario.machines.values()})
+        store = get_shared_state()
+        if store.get(LAB_IMAGES_NAMESPACE, ixpconf_filename) != images:
+            store.put(LAB_IMAGES_NAMESPACE, ixpconf_filename, images)
+    except Exception as e:
+        logging.warning(f"Could not record images of {ixpconf_filename}: {e}")
+
+
+def get_required_images(ixpconf_filename: str | None = None) -> list[str]:
+    """
+    Images needed by an ixpconf (or by every known ixpconf), as recorded by
+    previous builds, plus the `prewarm_images` option and the Kathara default image
+    """
+    store = get_shared_state()
+    images = set(get_backend_setting(PREWARM_IMAGES_SETTING, []))
+    if ixpconf_filename is None:
+        for recorded in store.items(LAB_IMAGES_NAMESPACE).values():
+            images.update(recorded)
+    else:
+        images.update(store.get(LAB_IMAGES_NAMESPACE, ixpconf_filename, []))
+
+    try:
+        from Kathara.setting.Setting import Setting
+        images.add(Setting.get_instance().image)
+    except Exception:
+        pass
+    return sorted(images)
+
+
+class ImagePrewarmer:
+    """
+    Makes sure the lab images are present locally and unpacked before the
+    first deploy, pulling the missing ones and creating a throwaway container
+    per image (so that layer extraction and snapshot setup are not paid during
+    deployment).
+
+    The prewarm is claimed through the shared store, so that a single worker
+    runs it, and its state is published there for every worker to read.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @staticmethod
+    def _store():
+        return get_shared_state()
+
+    @staticmethod
+    def _running(prewarm: dict | None) -> bool:
+        return prewarm is not None and prewarm["state"] == PREWARM_RUNNING and process_alive(prewarm["pid"])
+
+    def start(self, images: list[str] | None = None, not_before: float | None = None) -> bool:
+        """
+        Claim the prewarm and run it in background. Returns False if a worker is
+        already prewarming or, with not_before, if a prewarm ended after that time
+        (another worker did it since this process started).
+        """
+        store = self._store()
+        with self._lock, store.transaction():
+            current = store.get(PREWARM_NAMESPACE, PREWARM_KEY)
+            if self._running(current):
+                return False
+            if not_before is not None and current is not None:
+                if current["ended_at"] is not None and current["ended_at"] >= not_before:
+                    return False
+            prewarm = {
+                "pid": os.getpid(),
+                "state": PREWARM_RUNNING,
+                "started_at": time.time(),
+                "ended_at": None,
+                "error": None,
+                "images": {},
+            }
+            store.put(PREWARM_NAMESPACE, PREWARM_KEY, prewarm)
+        self._thread = threading.Thread(target=self._run, args=(images, prewarm), name="image-prewarm", daemon=True)
+        self._thread.start()
+        return True
+
+    def _publish(self, prewarm: dict):
+        """Write the prewarm state, unless another worker has claimed a new prewarm meanwhile"""
+        store = self._store()
+        with store.transaction():
+            current = store.get(PREWARM_NAMESPACE, PREWARM_KEY)
+            if current is None or (current["pid"] == prewarm["pid"] and current["started_at"] == prewarm["started_at"]):
+                store.put(PREWARM_NAMESPACE, PREWARM_KEY, prewarm)
+
+    def _run(self, images: list[str] | None, prewarm: dict):
+        try:
+            images = images if images is not None else get_required_images()
+            logging.info(f"🔥 Prewarming {len(images)} images: {images}")
+            client = get_docker_client()
+            for image in images:
+                self._prewarm_image(client, image, prewarm)
+
+            failed = [name for name, info in prewarm["images"].items() if info["status"] == "error"]
+            prewarm["state"] = PREWARM_FAILED if failed else PREWARM_READY
+            prewarm["error"] = f"images not available: {failed}" if failed else None
+        except Exception as e:
+            logging.error(f"Image prewarm failed: {e}")
+            prewarm["state"] = PREWARM_FAILED
+            prewarm["error"] = str(e)
+        finally:
+            prewarm["ended_at"] = time.time()
+            self._publish(prewarm)
+            logging.info(f"🔥 Image prewarm finished: {prewarm['state']}")
+
+    def _prewarm_image(self, client, image: str, prewarm: dict):
+        from docker.errors import ImageNotFound
+        from docker.utils import parse_repository_tag
+
+        started = time.perf_counter()
+        info = {"status": "checking", "pulled": False}
+        prewarm["images"][image] = info
+        self._publish(prewarm)
+        try:
+            try:
+                client.images.get(image)
+            except ImageNotFound:
+                repository, tag = parse_repository_tag(image)
+                logging.info(f"Pulling image {image}...")
+                client.images.pull(repository, tag=tag or "latest")
+                info["pulled"] = True
+
+            # Container "usa e getta": forza estrazione dei layer e preparazione dello snapshot
+            container = client.containers.create(image, entrypoint=["true"], labels={"app": "ixp-prewarm"})
+            container.remove(force=True)
+            info["status"] = "ready"
+        except Exception as e:
+            logging.warning(f"Could not prewarm image {image}: {e}")
+            info["status"] = "error"
+            info["error"] = str(e)
+        finally:
+            info["duration"] = round(time.perf_counter() - started, 3)
+            self._publish(prewarm)
+
+    def is_ready(self) -> bool:
+        return self.status()["state"] == PREWARM_READY
+
+    def wait(self, timeout: float | None = None) -> bool:
+        """Wait for a running prewarm, of any worker. Returns True if images are ready"""
+        store = self._store()
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        version = store.version(PREWARM_NAMESPACE)
+        while self._running(store.get(PREWARM_NAMESPACE, PREWARM_KEY)):
+            remaining = deadline - time.monotonic() if deadline is not None else PREWARM_WAIT_POLL
+            if remaining <= 0:
+                break
+            version = store.wait_for_change(PREWARM_NAMESPACE, version, min(remaining, PREWARM_WAIT_POLL))
+        return self.is_ready()
+
+    def status(self, ixpconf_filename: str | None = None) -> dict:
+        prewarm = self._store().get(PREWARM_NAMESPACE, PREWARM_KEY)
+        if prewarm is None:
+            prewarm = {"pid": None, "state": PREWARM_IDLE, "started_at": None, "ended_at": None, "error": None, "images": {}}
+        elif prewarm["state"] == PREWARM_RUNNING and not process_alive(prewarm["pid"]):
+            # Il worker che lo eseguiva è terminato prima di finire
+            prewarm["state"] = PREWARM_FAILED
+            prewarm["error"] = f"prewarm interrupted, worker {prewarm['pid']} exited"
+        images = prewarm["images"]
+        status = {
+            "state": prewarm["state"],
+            "worker_pid": prewarm["pid"],
+            "started_at": prewarm["started_at"],
+            "ended_at": prewarm["ended_at"],
+            "error": prewarm["error"],
+            "images": images,
+        }
+        if ixpconf_filename is not None:
+            required = get_required_images(ixpconf_filename)
+            status["required"] = required
+            status["missing"] = [name for name in required if images.get(name, {}).get("status") != "ready"]
+        return status
+
+
+# Singleton
+_image_prewarmer = ImagePrewarmer()
+
+
+def get_image_prewarmer():
+    return _image_prewarmer
@@ -156,3 +156,17 @@ def get_ribs_content_from_ixpconf_name(ixpconf_name: str):
         if ribs_names
         else None
     )
+
+
+def get_route_servers_from_ixpconf_name(ixpconf_name: str) -> dict[str, str]:
+    """
+    Route server devices configurati nel file di configurazione -> tipo (bird, open_bgpd)
+    """
+    if not ixpconf_name or not exists_file_in_ixpconfigs(ixpconf_name):
+        return {}
+    try:
+        route_servers = get_ixpconf_file(ixpconf_name).get("route_servers", {})
+        return {name: rs.get("type") for name, rs in route_servers.items()}
+    except Exception as e:
+        logging.error(f"Error getting route servers from {ixpconf_name}: {e}")
+        return {}
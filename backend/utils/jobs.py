@@ -0,0 +1,640 @@
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager, nullcontext
+
+from utils.shared_state import get_shared_state, process_alive
+
+
+JOB_PENDING = "pending"
+JOB_RUNNING = "running"
+JOB_COMPLETED = "completed"
+JOB_FAILED = "failed"
+JOB_CANCELLED = "cancelled"
+
+FINISHED_STATUSES = (JOB_COMPLETED, JOB_FAILED, JOB_CANCELLED)
+
+# Numero massimo di eventi mantenuti in memoria per ogni job
+MAX_JOB_EVENTS = 2000
+
+# Intervallo minimo tra due pubblicazioni di un job nello store condiviso: gli eventi
+# per device arrivano a raffica durante i deploy e vengono scritti a blocchi
+JOB_PUBLISH_INTERVAL = 0.25
+
+# Eventi pubblicati subito, senza attendere l'intervallo
+IMMEDIATE_EVENTS = ("job_started", "job_finished")
+
+# Namespace dello store condiviso tra i worker (utils/shared_state.py)
+JOBS_NAMESPACE = "jobs"
+JOB_CANCEL_NAMESPACE = "job_cancel"
+
+
+def _events_stream(job_id: str) -> str:
+    return f"job:{job_id}"
+
+
+class JobCancelledError(Exception):
+    """Raised inside a job pipeline when a cancellation has been requested"""
+    pass
+
+
+class Job:
+    """
+    Long running lab operation (deploy, reload, wipe, ...) tracked by the backend.
+
+    The pipeline running the job reports phases, device progress and failures,
+    while API handlers read a consistent snapshot through to_dict() and
+    events_since(). Cancellation is cooperative: the pipeline must call
+    check_cancelled() at safe points.
+    """
+
+    def __init__(self, kind: str, lab_hash: str | None = None, ixpconf_filename: str | None = None):
+        self.id = uuid.uuid4().hex[:12]
+        self.kind = kind
+        self.lab_hash = lab_hash
+        self.ixpconf_filename = ixpconf_filename
+        self.status = JOB_PENDING
+        self.created_at = time.time()
+        self.started_at = None
+        self.ended_at = None
+        self.current_phase = None
+        self.phases = []
+        self.devices_total = 0
+        self.devices_completed = 0
+        self.failures = []
+        self.error = None
+        self.owner_pid = os.getpid()
+        self._events = []
+        self._next_seq = 0
+        self._lock = threading.RLock()
+        self._cancel_event = threading.Event()
+        self._done_event = threading.Event()
+        self._done_callbacks = []
+        # Impostato dal JobRegistry: pubblica snapshot ed eventi per gli altri worker
+        self._publisher = None
+        self._publish_lock = threading.Lock()
+        self._unpublished = []
+        self._published_at = 0.0
+        self._publish_timer = None
+
+    # ==================== EVENTS ====================
+
+    def emit(self, event_type: str, **data) -> None:
+        event = {
+            "seq": None,
+            "type": event_type,
+            "time": time.time(),
+            "data": data,
+        }
+        with self._lock:
+            event["seq"] = self._next_seq
+            self._events.append(event)
+            self._next_seq += 1
+            if len(self._events) > MAX_JOB_EVENTS:
+                del self._events[0:len(self._events) - MAX_JOB_EVENTS]
+            if self._publisher is not None:
+                self._unpublished.append(event)
+        self.publish(force=event_type in IMMEDIATE_EVENTS)
+
+    def publish(self, force: bool = False) -> None:
+        """
+        Share the current snapshot and the new events with the other workers, at
+        most once every JOB_PUBLISH_INTERVAL seconds (unless forced): the events
+        emitted meanwhile are written together by a timer.
+        """
+        if self._publisher is None:
+            return
+        # Lo snapshot è preso sotto lock: l'ultimo a scrivere pubblica sempre lo stato più recente
+        with self._publish_lock:
+            wait = JOB_PUBLISH_INTERVAL - (time.monotonic() - self._published_at)
+            if not force and wait > 0:
+                if self._publish_timer is None:
+                    self._publish_timer = threading.Timer(wait, self._flush)
+                    self._publish_timer.daemon = True
+                    self._publish_timer.start()
+                return
+            with self._lock:
+                events, self._unpublished = self._unpublished, []
+            try:
+                self._publisher(self, events)
+                self._published_at = time.monotonic()
+            except Exception as e:
+                logging.warning(f"Could not publish job {self.id} to the shared state: {e}")
+                with self._lock:
+                    self._unpublished[:0] = events
+
+    def _flush(self) -> None:
+        with self._publish_lock:
+            self._publish_timer = None
+        with self._lock:
+            pending = bool(self._unpublished)
+        if pending:
+            self.publish(force=True)
+
+    def events_since(self, seq: int = 0) -> list[dict]:
+        with self._lock:
+            return [event for event in self._events if event["seq"] >= seq]
+
+    # ==================== LIFECYCLE ====================
+
+    def start(self) -> None:
+        with self._lock:
+            self.status = JOB_RUNNING
+            self.started_at = time.time()
+        self.emit("job_started", kind=self.kind, lab_hash=self.lab_hash)
+
+    def finish(self, status: str, error: str | None = None) -> None:
+        with self._lock:
+            if self.status in FINISHED_STATUSES:
+                return
+            self.status = status
+            self.error = error
+            self.ended_at = time.time()
+            self.current_phase = None
+        self.emit("job_finished", status=status, error=error)
+        self._done_event.set()
+        logging.info(f"Job {self.id} ({self.kind}) finished with status '{status}'")
+
+        with self._lock:
+            callbacks, self._done_callbacks = self._done_callbacks, []
+        for callback in callbacks:
+            self._run_callback(callback)
+
+    def add_done_callback(self, callback) -> None:
+        """Call callback(job) once the job is finished (immediately if it already is)"""
+        with self._lock:
+            if not self.is_finished():
+                self._done_callbacks.append(callback)
+                return
+        self._run_callback(callback)
+
+    def _run_callback(self, callback) -> None:
+        try:
+            callback(self)
+        except Exception as e:
+            logging.error(f"Error in done callback of job {self.id}: {e}")
+
+    def is_finished(self) -> bool:
+        return self.status in FINISHED_STATUSES
+
+    def wait(self, timeout: float | None = None) -> bool:
+        return self._done_event.wait(timeout)
+
+    def cancel(self) -> bool:
+        """Request a cooperative cancellation. Returns False if the job is already over"""
+        if self.is_finished():
+            return False
+        self._cancel_event.set()
+        self.emit("cancel_requested")
+        logging.info(f"Cancellation requested for job {self.id}")
+        return True
+
+    def is_cancelled(self) -> bool:
+        return self._cancel_event.is_set()
+
+    def check_cancelled(self) -> None:
+        if self._cancel_event.is_set():
+            raise JobCancelledError(f"job {self.id} cancelled")
+
+    # ==================== PHASES AND PROGRESS ====================
+
+    @contextmanager
+    def phase(self, name: str):
+        """Track a pipeline phase, recording its timing and outcome"""
+        self.check_cancelled()
+        record = {"name": name, "status": JOB_RUNNING, "started_at": time.time(), "ended_at": None, "duration": None}
+        with self._lock:
+            self.phases.append(record)
+            self.current_phase = name
+        self.emit("phase_started", phase=name)
+        try:
+            yield record
+        except JobCancelledError:
+            self._close_phase(record, JOB_CANCELLED)
+            raise
+        except Exception as e:
+            self._close_phase(record, JOB_FAILED, str(e))
+            raise
+        else:
+            self._close_phase(record, JOB_COMPLETED)
+
+    def _close_phase(self, record: dict, status: str, error: str | None = None) -> None:
+        with self._lock:
+            record["status"] = status
+            record["ended_at"] = time.time()
+            record["duration"] = round(record["ended_at"] - record["started_at"], 3)
+            if error:
+                record["error"] = error
+            if self.current_phase == record["name"]:
+                self.current_phase = None
+        self.emit("phase_ended", phase=record["name"], status=status, duration=record["duration"])
+
+    def set_devices_total(self, total: int) -> None:
+        with self._lock:
+            self.devices_total = total
+        self.emit("devices_total", total=total)
+
+    def device_completed(self, device_name: str) -> None:
+        with self._lock:
+            self.devices_completed += 1
+            completed = self.devices_completed
+        self.emit("device_completed", device=device_name, completed=completed, total=self.devices_total)
+
+    def add_failure(self, device_name: str | None, error: str) -> None:
+        with self._lock:
+            self.failures.append({"device": device_name, "error": error, "time": time.time()})
+        self.emit("device_failed", device=device_name, error=error)
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            now = self.ended_at or time.time()
+            return {
+                "id": self.id,
+                "kind": self.kind,
+                "lab_hash": self.lab_hash,
+                "ixpconf_filename": self.ixpconf_filename,
+                "status": self.status,
+                "cancel_requested": self.is_cancelled(),
+                "created_at": self.created_at,
+                "started_at": self.started_at,
+                "ended_at": self.ended_at,
+                "elapsed": round(now - self.started_at, 3) if self.started_at else 0.0,
+                "current_phase": self.current_phase,
+                "phases": [dict(p) for p in self.phases],
+                "devices_total": self.devices_total,
+                "devices_completed": self.devices_completed,
+                "progress_percent": round(self.devices_completed / self.devices_total * 100, 1)
+                if self.devices_total else 0.0,
+                "failures": list(self.failures),
+                "error": self.error,
+                "last_event_seq": self._next_seq - 1,
+                "worker_pid": self.owner_pid,
+            }
+
+
+class RemoteJob:
+    """
+    Job run by another uvicorn worker, seen through the shared state store.
+
+    It exposes the read side of Job (status, to_dict(), events_since(), wait())
+    plus cancel(), which is delivered to the owner worker. A job whose worker
+    is gone is reported as failed.
+    """
+
+    def __init__(self, snapshot: dict):
+        self._snapshot = snapshot
+
+    @staticmethod
+    def load(job_id: str) -> "RemoteJob | None":
+        snapshot = get_shared_state().get(JOBS_NAMESPACE, job_id)
+        return RemoteJob(snapshot) if snapshot is not None else None
+
+    def refresh(self) -> None:
+        snapshot = get_shared_state().get(JOBS_NAMESPACE, self.id)
+        if snapshot is not None:
+            self._snapshot = snapshot
+
+    @property
+    def id(self) -> str:
+        return self._snapshot["id"]
+
+    @property
+    def kind(self) -> str:
+        return self._snapshot["kind"]
+
+    @property
+    def lab_hash(self) -> str | None:
+        return self._snapshot.get("lab_hash")
+
+    @property
+    def ixpconf_filename(self) -> str | None:
+        return self._snapshot.get("ixpconf_filename")
+
+    @property
+    def created_at(self) -> float:
+        return self._snapshot["created_at"]
+
+    @property
+    def failures(self) -> list:
+        return self._snapshot.get("failures", [])
+
+    def _orphaned(self) -> bool:
+        return self._snapshot["status"] not in FINISHED_STATUSES and not process_alive(self._snapshot.get("worker_pid"))
+
+    @property
+    def status(self) -> str:
+        return JOB_FAILED if self._orphaned() else self._snapshot["status"]
+
+    @property
+    def error(self) -> str | None:
+        if self._orphaned():
+            return f"worker {self._snapshot.get('worker_pid')} exited"
+        return self._snapshot.get("error")
+
+    def is_finished(self) -> bool:
+        self.refresh()
+        return self.status in FINISHED_STATUSES
+
+    def is_cancelled(self) -> bool:
+        return bool(self._snapshot.get("cancel_requested"))
+
+    def wait(self, timeout: float | None = None) -> bool:
+        store = get_shared_state()
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        version = 0
+        while not self.is_finished():
+            remaining = deadline - time.monotonic() if deadline is not None else None
+            if remaining is not None and remaining <= 0:
+                return False
+            # Lo stato del worker proprietario è ricontrollato almeno ogni 5 secondi
+            version = store.wait_for_change(JOBS_NAMESPACE, version, min(remaining or 5.0, 5.0))
+        return True
+
+    def cancel(self) -> bool:
+        if self.is_finished():
+            return False
+        get_shared_state().put(JOB_CANCEL_NAMESPACE, self.id, {"requested_at": time.time()})
+        logging.info(f"Cancellation requested for job {self.id} (worker {self._snapshot.get('worker_pid')})")
+        return True
+
+    def add_done_callback(self, callback) -> None:
+        def wait_and_call():
+            self.wait()
+            try:
+                callback(self)
+            except Exception as e:
+                logging.error(f"Error in done callback of job {self.id}: {e}")
+
+        threading.Thread(target=wait_and_call, daemon=True).start()
+
+    def events_since(self, seq: int = 0) -> list[dict]:
+        return get_shared_state().events_since(_events_stream(self.id), seq)
+
+    def to_dict(self) -> dict:
+        return {**self._snapshot, "status": self.status, "error": self.error}
+
+
+class JobRegistry:
+    """
+    Thread-safe registry of the jobs created by the backend.
+
+    Jobs run in the worker that created them; their snapshots and events are
+    published to the shared state store, so get()/list() also return the jobs
+    of the other uvicorn workers (as RemoteJob) and cancellations requested
+    from any worker reach the owner.
+    """
+
+    def __init__(self, max_finished_jobs=50):
+        self._jobs: dict[str, Job] = {}
+        self._lock = threading.Lock()
+        self._cancel_watcher = None
+        self.max_finished_jobs = max_finished_jobs
+
+    def create(self, kind: str, lab_hash: str | None = None, ixpconf_filename: str | None = None) -> Job:
+        job = Job(kind, lab_hash=lab_hash, ixpconf_filename=ixpconf_filename)
+        job._publisher = self._publish
+        with self._lock:
+            self._jobs[job.id] = job
+            self._prune()
+            self._start_cancel_watcher()
+        # Lo store non va mai usato tenendo self._lock (un altro thread può avere il suo lock)
+        self._prune_shared()
+        job.publish(force=True)
+        logging.info(f"Created job {job.id} ({kind})")
+        return job
+
+    def _publish(self, job: Job, events: list[dict]) -> None:
+        store = get_shared_state()
+        with store.transaction():
+            store.put(JOBS_NAMESPACE, job.id, job.to_dict())
+            store.append_events(_events_stream(job.id), events, keep=MAX_JOB_EVENTS)
+
+    def get(self, job_id: str) -> Job | RemoteJob | None:
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is not None:
+            return job
+        try:
+            return RemoteJob.load(job_id)
+        except Exception as e:
+            logging.warning(f"Could not read job {job_id} from the shared state: {e}")
+            return None
+
+    def get_active(self, kind: str | None = None) -> list[Job | RemoteJob]:
+        return [job for job in self.list(kind) if not job.is_finished()]
+
+    # Definito dopo get_active: nel corpo della classe `list` oscura il builtin
+    def list(self, kind: str | None = None) -> list[Job | RemoteJob]:
+        with self._lock:
+            jobs = list(self._jobs.values())
+        local_ids = {job.id for job in jobs}
+        try:
+            jobs += [
+                RemoteJob(snapshot) for job_id, snapshot in get_shared_state().items(JOBS_NAMESPACE).items()
+                if job_id not in local_ids
+            ]
+        except Exception as e:
+            logging.warning(f"Could not read jobs from the shared state: {e}")
+        if kind:
+            jobs = [job for job in jobs if job.kind == kind]
+        return sorted(jobs, key=lambda job: job.created_at, reverse=True)
+
+    def _prune(self):
+        finished = sorted(
+            (job for job in self._jobs.values() if job.is_finished()),
+            key=lambda job: job.created_at
+        )
+        for job in finished[:max(0, len(finished) - self.max_finished_jobs)]:
+            del self._jobs[job.id]
+
+    def _prune_shared(self):
+        """Same limit on the shared jobs, including those of the workers that exited"""
+        try:
+            store = get_shared_state()
+            with store.transaction():
+                shared = [RemoteJob(snapshot) for snapshot in store.items(JOBS_NAMESPACE).values()]
+                shared_finished = sorted(
+                    (job for job in shared if job.status in FINISHED_STATUSES), key=lambda job: job.created_at
+                )
+                for job in shared_finished[:max(0, len(shared_finished) - self.max_finished_jobs)]:
+                    store.delete(JOBS_NAMESPACE, job.id)
+                    store.delete_events(_events_stream(job.id))
+        except Exception as e:
+            logging.warning(f"Could not prune shared jobs: {e}")
+
+    def _start_cancel_watcher(self):
+        if self._cancel_watcher is None:
+            self._cancel_watcher = threading.Thread(
+                target=self._watch_cancellations, name="job-cancel-watcher", daemon=True
+            )
+            self._cancel_watcher.start()
+
+    def _watch_cancellations(self):
+        """Apply the cancellations requested from other workers to the jobs of this one"""
+        store = get_shared_state()
+        version = 0
+        while True:
+            try:
+                version = store.wait_for_change(JOB_CANCEL_NAMESPACE, version, timeout=30)
+                for job_id in store.items(JOB_CANCEL_NAMESPACE):
+                    with self._lock:
+                        job = self._jobs.get(job_id)
+                    if job is not None:
+                        job.cancel()
+                        store.delete(JOB_CANCEL_NAMESPACE, job_id)
+                        continue
+                    # Richiesta per un job non più in esecuzione
+                    remote = RemoteJob.load(job_id)
+                    if remote is None or remote.status in FINISHED_STATUSES:
+                        store.delete(JOB_CANCEL_NAMESPACE, job_id)
+            except Exception as e:
+                logging.error(f"Error watching job cancellations: {e}")
+                time.sleep(1)
+
+
+class KatharaDeployListener:
+    """
+    Subscribes a job to the Kathara EventDispatcher, so that progress of
+    deploy_chunks()/undeploy() is reported device by device.
+
+    Every `machines_deploy_started` event corresponds to one chunk deployed
+    by Kathara. Raising JobCancelledError from the callbacks aborts the
+    Kathara worker pool at the next device boundary.
+
+    The dispatcher is process-wide and two labs can deploy at the same time
+    (see utils/lab_scheduler.py): events of devices of another lab are
+    ignored, so a job neither counts them nor aborts their deploy.
+    """
+
+    EVENTS = {
+        "machines_deploy_started": "on_chunk_started",
+        "machines_deploy_ended": "on_chunk_ended",
+        "machine_deployed": "on_machine_deployed",
+        "machine_undeployed": "on_machine_undeployed",
+    }
+
+    def __init__(self, job: Job, lab_hash: str | None = None):
+        self.job = job
+        self.lab_hash = lab_hash or job.lab_hash
+        # Device del chunk aperto non ancora deployati (gli eventi di fine chunk non dicono di che lab sono)
+        self._chunk_pending = set()
+        self.chunk_index = 0
+        self.chunk_size = None
+        # Numero di chunk noto a priori (deploy a ondate, utils/deploy_waves.py)
+        self.expected_chunks = None
+        self._chunk_phase = None
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        from Kathara.event.EventDispatcher import EventDispatcher
+
+        dispatcher = EventDispatcher.get_instance()
+        for event, method in self.EVENTS.items():
+            dispatcher.register(event, self, method)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        from Kathara.event.EventDispatcher import EventDispatcher
+
+        dispatcher = EventDispatcher.get_instance()
+        for event, method in self.EVENTS.items():
+            callbacks = dispatcher.events.get(event, [])
+            dispatcher.events[event] = [
+                item for item in callbacks if getattr(item[0], "__self__", None) is not self
+            ]
+        self._close_chunk_phase(exc_val)
+        return False
+
+    def estimated_chunks(self) -> int:
+        if self.expected_chunks:
+            return max(self.expected_chunks, self.chunk_index)
+        if not self.chunk_size or not self.job.devices_total:
+            return max(self.chunk_index, 1)
+        return max(-(-self.job.devices_total // self.chunk_size), self.chunk_index)
+
+    @staticmethod
+    def _lab_hash_of(item) -> str | None:
+        """Lab of an event item: Kathara machine, (name, machine) pair or Docker container"""
+        if isinstance(item, tuple) and len(item) == 2:
+            item = item[1]
+        lab = getattr(item, "lab", None)
+        if lab is not None:
+            return getattr(lab, "hash", None)
+        labels = getattr(item, "labels", None)
+        return labels.get("lab_hash") if isinstance(labels, dict) else None
+
+    def _is_own(self, item) -> bool:
+        if self.lab_hash is None:
+            return True
+        item_lab_hash = self._lab_hash_of(item)
+        return item_lab_hash is None or item_lab_hash == self.lab_hash
+
+    @staticmethod
+    def _device_name_of(item) -> str:
+        if isinstance(item, tuple) and len(item) == 2:
+            return item[0]
+        labels = getattr(item, "labels", None)
+        if isinstance(labels, dict) and "name" in labels:
+            return labels["name"]
+        return getattr(item, "name", "unknown")
+
+    def on_chunk_started(self, items=None, **kwargs):
+        items = list(items or [])
+        if items and not any(self._is_own(item) for item in items):
+            return
+        with self._lock:
+            self._close_chunk_phase()
+            self.chunk_index += 1
+            if self.chunk_size is None and items:
+                self.chunk_size = len(items)
+            self._chunk_pending = {self._device_name_of(item) for item in items}
+            name = f"deploy chunk {self.chunk_index}/{self.estimated_chunks()}"
+            self._chunk_phase = self.job.phase(name)
+            self._chunk_phase.__enter__()
+
+    def on_chunk_ended(self, items=None, **kwargs):
+        if items and not any(self._is_own(item) for item in items):
+            return
+        with self._lock:
+            # Senza items l'evento può essere di un altro lab: si chiude solo un chunk già completato
+            if items or not self._chunk_pending:
+                self._close_chunk_phase()
+
+    def on_machine_deployed(self, item=None, **kwargs):
+        if not self._is_own(item):
+            return
+        name = item.name if item is not None else "unknown"
+        with self._lock:
+            self._chunk_pending.discard(name)
+        self.job.device_completed(name)
+        self.job.check_cancelled()
+
+    def on_machine_undeployed(self, item=None, **kwargs):
+        if not self._is_own(item):
+            return
+        name = item.labels.get("name", item.name) if item is not None and hasattr(item, "labels") else "unknown"
+        self.job.emit("device_undeployed", device=name)
+        self.job.check_cancelled()
+
+    def _close_chunk_phase(self, exc=None):
+        if self._chunk_phase is not None:
+            phase, self._chunk_phase = self._chunk_phase, None
+            if exc is None:
+                phase.__exit__(None, None, None)
+            else:
+                phase.__exit__(type(exc), exc, exc.__traceback__)
+
+
+def job_phase(job: Job | None, name: str):
+    """Track a phase on the job, if any"""
+    return job.phase(name) if job is not None else nullcontext()
+
+
+# Singleton
+_job_registry = JobRegistry()
+
+
+def get_job_registry():
+    return _job_registry
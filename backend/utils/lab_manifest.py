@@ -0,0 +1,177 @@
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+
+from globals import BACKEND_STATE_FOLDER, BACKEND_IXPCONFIGS_FOLDER, BACKEND_RESOURCES_FOLDER
+from utils.build_cache import get_build_cache, compute_build_key, get_referenced_resource_files
+from utils.file_utils import file_digest, seed_file_digest
+
+# Da incrementare quando cambia il formato del manifest
+LAB_MANIFEST_VERSION = 1
+
+LAB_MANIFESTS_FOLDER = os.path.join(BACKEND_STATE_FOLDER, "labs")
+MANIFEST_FILE = "manifest.json"
+MANIFEST_TABLE_DUMP_FILE = "table_dump.pickle"
+
+_manifest_lock = threading.Lock()
+
+
+def _manifest_dir(lab_hash: str) -> str:
+    return os.path.join(LAB_MANIFESTS_FOLDER, lab_hash)
+
+
+def _input_entry(path: str) -> dict:
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": file_digest(path)}
+
+
+def get_input_files(ixpconf_filename: str) -> dict[str, dict]:
+    """
+    Size, mtime and digest of the ixpconf and of the resource files it references
+    (digests are memoized, so right after a build they are not computed again)
+    """
+    config_path = os.path.join(BACKEND_IXPCONFIGS_FOLDER, ixpconf_filename)
+    inputs = {f"ixpconfigs/{ixpconf_filename}": _input_entry(config_path)}
+    with open(config_path, "r") as file:
+        ixpconf = json.load(file)
+    for name in get_referenced_resource_files(ixpconf):
+        inputs[f"resources/{name}"] = _input_entry(os.path.join(BACKEND_RESOURCES_FOLDER, name))
+    return inputs
+
+
+def _input_path(name: str) -> str:
+    folder, filename = name.split("/", 1)
+    base = BACKEND_IXPCONFIGS_FOLDER if folder == "ixpconfigs" else BACKEND_RESOURCES_FOLDER
+    return os.path.join(base, filename)
+
+
+def save_lab_manifest(lab, ixpconf_filename: str | None, containers: list, build_key: str | None = None) -> dict | None:
+    """
+    Persist what is needed to take a running lab back after a backend restart:
+    its ixpconf, the input files it was built from, the device -> container
+    map and the parsed table dump (linked from the build cache).
+
+    Args:
+        lab: Running Kathara lab
+        ixpconf_filename: ixpconf the lab was built from (None for a discovered lab: nothing is saved)
+        containers: Docker containers of the lab
+        build_key: Build key of the lab (computed again if not given)
+
+    Returns:
+        dict: The manifest, or None if it could not be saved
+    """
+    if not ixpconf_filename:
+        return None
+    try:
+        build_key = build_key or compute_build_key(ixpconf_filename)
+        manifest = {
+            "version": LAB_MANIFEST_VERSION,
+            "lab_hash": lab.hash,
+            "lab_name": lab.name,
+            "ixpconf_filename": ixpconf_filename,
+            "build_key": build_key,
+            "saved_at": time.time(),
+            "inputs": get_input_files(ixpconf_filename),
+            "devices": {
+                container.labels.get("name", container.name): {
+                    "container_id": container.id,
+                    "container_name": container.name,
+                    "shell": container.labels.get("shell", "/bin/bash"),
+                }
+                for container in containers
+            },
+            "table_dump": False,
+        }
+
+        manifest_dir = _manifest_dir(lab.hash)
+        with _manifest_lock:
+            os.makedirs(manifest_dir, exist_ok=True)
+            # Il table dump del build cache può essere rimosso dal pruning: il lab ne tiene un link
+            dumps_file = get_build_cache().get_dumps_file(build_key) if build_key else None
+            if dumps_file is not None:
+                target = os.path.join(manifest_dir, MANIFEST_TABLE_DUMP_FILE)
+                tmp_target = f"{target}.tmp"
+                try:
+                    os.link(dumps_file, tmp_target)
+                except OSError:
+                    shutil.copy2(dumps_file, tmp_target)
+                os.replace(tmp_target, target)
+                manifest["table_dump"] = True
+
+            path = os.path.join(manifest_dir, MANIFEST_FILE)
+            with open(f"{path}.tmp", "w") as file:
+                json.dump(manifest, file, indent=2)
+            os.replace(f"{path}.tmp", path)
+
+        logging.info(f"💾 Lab manifest saved for {lab.hash} ({len(manifest['devices'])} devices)")
+        return manifest
+    except Exception as e:
+        logging.warning(f"Could not save the manifest of lab {lab.hash}: {e}")
+        return None
+
+
+def load_lab_manifest(lab_hash: str) -> dict | None:
+    try:
+        with open(os.path.join(_manifest_dir(lab_hash), MANIFEST_FILE), "r") as file:
+            manifest = json.load(file)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logging.warning(f"Invalid manifest for lab {lab_hash}: {e}")
+        return None
+    if manifest.get("version") != LAB_MANIFEST_VERSION:
+        return None
+    return manifest
+
+
+def list_lab_manifests() -> dict[str, dict]:
+    if not os.path.isdir(LAB_MANIFESTS_FOLDER):
+        return {}
+    manifests = {}
+    for lab_hash in os.listdir(LAB_MANIFESTS_FOLDER):
+        manifest = load_lab_manifest(lab_hash)
+        if manifest is not None:
+            manifests[lab_hash] = manifest
+    return manifests
+
+
+def delete_lab_manifest(lab_hash: str) -> None:
+    with _manifest_lock:
+        shutil.rmtree(_manifest_dir(lab_hash), ignore_errors=True)
+
+
+def match_containers(manifest: dict, containers: list) -> str | None:
+    """Why the running containers are not the ones recorded in the manifest (None if they are)"""
+    running = {
+        container.labels.get("name", container.name): container
+        for container in containers if container.status == "running"
+    }
+    devices = manifest["devices"]
+    if set(running) != set(devices):
+        missing = sorted(set(devices) - set(running))
+        extra = sorted(set(running) - set(devices))
+        return f"devices differ (missing: {missing[:5]}, unexpected: {extra[:5]})"
+    for device, info in devices.items():
+        if running[device].id != info["container_id"]:
+            return f"container of {device} was recreated"
+    return None
+
+
+def reattach_artefacts(manifest: dict) -> dict:
+    """
+    Make the build artefacts of a reattached lab available again: the input
+    digests (no rehashing of unchanged dumps on the next reload) and the table
+    dump in the build cache. Returns which inputs changed since the deploy.
+    """
+    changed = [
+        name for name, entry in manifest["inputs"].items()
+        if not seed_file_digest(_input_path(name), entry["size"], entry["mtime_ns"], entry["sha256"])
+    ]
+    if manifest.get("table_dump") and manifest.get("build_key") and not changed:
+        get_build_cache().restore_dumps_file(
+            manifest["build_key"], os.path.join(_manifest_dir(manifest["lab_hash"]), MANIFEST_TABLE_DUMP_FILE)
+        )
+    return {"inputs_changed": changed}
@@ -0,0 +1,45 @@
+import logging
+
+from globals import get_backend_setting
+from utils.build_cache import compute_build_key
+from utils.config_hash import load_config_hashes
+from utils.docker_utils import get_lab_containers
+from utils.lab_manifest import load_lab_manifest, match_containers
+
+# Esito di uno /ixp/start che riusa i container del lab in esecuzione
+RECYCLED_IDENTICAL = "identical"
+RECYCLED_DIFF = "diff"
+
+
+def recycling_enabled() -> bool:
+    return bool(get_backend_setting("recycle_containers", True))
+
+
+def recycle_blocker(lab_hash: str) -> str | None:
+    """
+    Why the containers of a running lab cannot be reused by a start (None if they can):
+    the backend needs the structure hashes saved at its last start/reload to know
+    which containers still match.
+    """
+    hashes = load_config_hashes(lab_hash)
+    if not hashes or not hashes.get("structure"):
+        return "no structure hashes (lab not started by this backend)"
+    return None
+
+
+def is_identical_lab(lab_hash: str, ixpconf_filename: str) -> bool:
+    """
+    Whether the running lab is exactly what ixpconf_filename would build: same
+    build key (ixpconf content, resource files, member selection) and all the
+    containers recorded at its deploy still running.
+    """
+    manifest = load_lab_manifest(lab_hash)
+    if manifest is None or not manifest.get("build_key"):
+        return False
+    if compute_build_key(ixpconf_filename) != manifest["build_key"]:
+        return False
+    mismatch = match_containers(manifest, get_lab_containers(lab_hash))
+    if mismatch is not None:
+        logging.info(f"Lab {lab_hash} has the same inputs but {mismatch}: not reusable as is")
+        return False
+    return True
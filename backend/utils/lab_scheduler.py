@@ -0,0 +1,198 @@
+import logging
+import os
+import threading
+import time
+
+from globals import get_backend_setting
+from utils.shared_state import get_shared_state, process_alive
+
+# Default dei limiti di ammissione (sovrascrivibili in settings.json)
+DEFAULT_DEVICE_MEMORY_MB = 64
+DEFAULT_MEMORY_RESERVE_MB = 1024
+DEFAULT_MAX_LOAD = 0.9
+DEFAULT_MAX_CONCURRENT_DEPLOYS = 2
+DEFAULT_ADMISSION_TIMEOUT = 1800
+
+# Ogni quanto una richiesta in coda ricontrolla le risorse dell'host
+_POLL_INTERVAL = 2.0
+
+# Deploy ammessi, condivisi tra i worker (utils/shared_state.py)
+ADMISSIONS_NAMESPACE = "lab_admissions"
+
+
+class AdmissionTimeout(Exception):
+    """The host did not free enough resources for the lab in time"""
+
+
+def get_admission_limits() -> dict:
+    return {
+        "enabled": bool(get_backend_setting("admission_enabled", True)),
+        "device_memory_mb": float(get_backend_setting("lab_device_memory_mb", DEFAULT_DEVICE_MEMORY_MB)),
+        "memory_reserve_mb": float(get_backend_setting("admission_memory_reserve_mb", DEFAULT_MEMORY_RESERVE_MB)),
+        "max_load": float(get_backend_setting("admission_max_load", DEFAULT_MAX_LOAD)),
+        "max_concurrent_deploys": int(get_backend_setting("max_concurrent_deploys", DEFAULT_MAX_CONCURRENT_DEPLOYS)),
+        "timeout": float(get_backend_setting("admission_timeout", DEFAULT_ADMISSION_TIMEOUT)),
+    }
+
+
+def get_host_resources() -> dict:
+    """CPU count, load average and memory of the host (from /proc/meminfo when available)"""
+    cpus = os.cpu_count() or 1
+    try:
+        load1 = os.getloadavg()[0]
+    except OSError:
+        load1 = 0.0
+
+    memory = {}
+    try:
+        with open("/proc/meminfo", "r") as f:
+            for line in f:
+                name, value = line.split(":", 1)
+                if name in ("MemTotal", "MemAvailable"):
+                    memory[name] = int(value.split()[0]) / 1024
+    except OSError:
+        page_size = os.sysconf("SC_PAGE_SIZE")
+        memory["MemTotal"] = os.sysconf("SC_PHYS_PAGES") * page_size / (1024 * 1024)
+        memory["MemAvailable"] = os.sysconf("SC_AVPHYS_PAGES") * page_size / (1024 * 1024)
+
+    return {
+        "cpus": cpus,
+        "load1": round(load1, 2),
+        "load_ratio": round(load1 / cpus, 3),
+        "memory_total_mb": round(memory.get("MemTotal", 0)),
+        "memory_available_mb": round(memory.get("MemAvailable", 0)),
+    }
+
+
+class LabScheduler:
+    """
+    Admission control for lab deployments: a lab is deployed only when the
+    host load and free memory (minus what admitted deployments will still
+    take) allow it, otherwise it waits in a FIFO queue.
+
+    Admitted deployments are kept in the shared state store, so the limits
+    hold across uvicorn workers; the queue order is per worker.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._queue = []
+
+    def admit(self, lab_hash: str, devices: int, job=None) -> dict:
+        """
+        Block until the lab can be deployed. Call release() once its deploy is over.
+
+        Raises:
+            AdmissionTimeout: The lab waited longer than the "admission_timeout" setting
+            JobCancelledError: job was cancelled while waiting
+        """
+        limits = get_admission_limits()
+        request = {
+            "lab_hash": lab_hash,
+            "devices": devices,
+            "memory_mb": round(devices * limits["device_memory_mb"]),
+            "job_id": job.id if job is not None else None,
+            "enqueued_at": time.time(),
+            "waiting_for": None,
+            "worker_pid": os.getpid(),
+        }
+        deadline = time.monotonic() + limits["timeout"]
+
+        with self._condition:
+            self._queue.append(request)
+            try:
+                while True:
+                    if job is not None:
+                        job.check_cancelled()
+                    if self._queue[0] is request:
+                        reason = self._try_admit(request, limits)
+                        if reason is None:
+                            self._queue.pop(0)
+                            waited = round(request["admitted_at"] - request["enqueued_at"], 1)
+                            logging.info(f"🚦 Lab {lab_hash} admitted ({devices} devices) after {waited}s")
+                            return request
+                        request["waiting_for"] = reason
+                    else:
+                        request["waiting_for"] = "queue"
+
+                    if time.monotonic() > deadline:
+                        raise AdmissionTimeout(
+                            f"lab {lab_hash} not admitted within {limits['timeout']}s: {request['waiting_for']}"
+                        )
+                    self._condition.wait(_POLL_INTERVAL)
+            finally:
+                if request in self._queue:
+                    self._queue.remove(request)
+                self._condition.notify_all()
+
+    def release(self, lab_hash: str) -> None:
+        try:
+            get_shared_state().delete(ADMISSIONS_NAMESPACE, lab_hash)
+        except Exception as e:
+            logging.error(f"Could not release the admission of lab {lab_hash}: {e}")
+        with self._condition:
+            self._condition.notify_all()
+
+    @staticmethod
+    def _admitted() -> dict[str, dict]:
+        """Deployments in progress on the host (those of workers that exited are dropped)"""
+        store = get_shared_state()
+        admitted = {}
+        for lab_hash, request in store.items(ADMISSIONS_NAMESPACE).items():
+            if process_alive(request.get("worker_pid")):
+                admitted[lab_hash] = request
+            else:
+                store.delete(ADMISSIONS_NAMESPACE, lab_hash)
+        return admitted
+
+    def _try_admit(self, request: dict, limits: dict) -> str | None:
+        """Admit request if the host allows it, atomically across workers. Returns why it cannot be admitted"""
+        store = get_shared_state()
+        with store.transaction():
+            reason = self._blocking_reason(request, limits, self._admitted()) if limits["enabled"] else None
+            if reason is None:
+                request["admitted_at"] = time.time()
+                request["waiting_for"] = None
+                store.put(ADMISSIONS_NAMESPACE, request["lab_hash"], request)
+        return reason
+
+    @staticmethod
+    def _blocking_reason(request: dict, limits: dict, admitted: dict[str, dict]) -> str | None:
+        """Why request cannot be admitted now (None if it can)"""
+        if len(admitted) >= limits["max_concurrent_deploys"]:
+            return f"{len(admitted)} deployments in progress"
+
+        host = get_host_resources()
+        if host["load_ratio"] > limits["max_load"]:
+            return f"host load {host['load_ratio']} > {limits['max_load']}"
+
+        reserved = sum(other["memory_mb"] for other in admitted.values())
+        free = host["memory_available_mb"] - reserved - limits["memory_reserve_mb"]
+        if request["memory_mb"] > free:
+            # Un lab che non entra neanche nell'host vuoto non verrebbe mai ammesso
+            if not admitted and request["memory_mb"] > host["memory_total_mb"] - limits["memory_reserve_mb"]:
+                logging.warning(
+                    f"Lab {request['lab_hash']} needs ~{request['memory_mb']}MB, more than the host has: admitting anyway"
+                )
+                return None
+            return f"memory: needs ~{request['memory_mb']}MB, {round(free)}MB free"
+        return None
+
+    def status(self) -> dict:
+        with self._condition:
+            queue = [{**request, "position": position} for position, request in enumerate(self._queue)]
+        admitted = list(self._admitted().values())
+        return {
+            "queue": queue,
+            "deploying": admitted,
+            "host": get_host_resources(),
+            "limits": get_admission_limits(),
+        }
+
+
+# Singleton
+_lab_scheduler = LabScheduler()
+
+
+def get_lab_scheduler():
+    return _lab_scheduler
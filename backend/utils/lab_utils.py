@@ -1,17 +1,31 @@
-from Kathara.manager.Kathara import Kathara, Lab
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+from utils.docker_utils import get_kathara_containers
+
+if TYPE_CHECKING:
+    from Kathara.model.Lab import Lab
+
+
+def get_kathara():
+    """Kathara manager, imported on first use so that Kathara (and the Docker SDK) do not slow down the startup"""
+    from Kathara.manager.Kathara import Kathara
+
+    return Kathara.get_instance()
 
 
 def get_running_machines_names(lab_hash: str) -> list[str]:
-    return list(Kathara.get_instance().get_lab_from_api(lab_hash).machines.keys())
+    return list(get_kathara().get_lab_from_api(lab_hash).machines.keys())
 
 
-def execute_command_on_machine(machine_name: str, command: str, lab: Lab) -> str:
+def execute_command_on_machine(machine_name: str, command: str | list[str], lab: Lab) -> str:
     """
     Execute a command on a machine and return the output as a string
     
     Args:
         machine_name: Name of the machine
-        command: Command to execute
+        command: Command to execute (string or argv list)
         lab: Lab instance
         
     Returns:
@@ -23,7 +37,7 @@ def execute_command_on_machine(machine_name: str, command: str, lab: Lab) -> str
         logging.info(f"Executing command on {machine_name}: {command}")
         
         # Kathara.exec restituisce un generatore
-        result = Kathara.get_instance().exec(
+        result = get_kathara().exec(
             machine_name, 
             command, 
             lab=lab, 
@@ -72,18 +86,8 @@ def execute_command_on_machine(machine_name: str, command: str, lab: Lab) -> str
             # Altrimenti, prova a convertire in stringa
             output_text += str(item)
         
-        # Se l'output è vuoto
-        if not output_text or output_text.strip() == "":
-            output_text = "(Command executed successfully - no output)"
-        else:
-            output_text = output_text.strip()
-        
-        # Aggiungi info sull'exit code se diverso da 0
-        if exit_code is not None and exit_code != 0:
-            output_text = f"⚠️ Command exited with code {exit_code}\n\n{output_text}"
-        
         logging.info(f"Command completed on {machine_name}")
-        return output_text
+        return format_command_output(output_text, exit_code)
         
     except Exception as e:
         logging.error(f"Error executing command on {machine_name}: {e}")
@@ -92,6 +96,57 @@ def execute_command_on_machine(machine_name: str, command: str, lab: Lab) -> str
         raise Exception(f"Failed to execute command: {str(e)}")
 
 
+def format_command_output(output_text: str, exit_code: int | None = None, stderr_text: str = "") -> str:
+    """
+    Output of a command as returned by the API: stderr after a separator, a
+    placeholder when empty, a warning on top when the exit code is not 0
+    """
+    if stderr_text:
+        output_text += "\n--- STDERR ---\n" + stderr_text
+
+    # Se l'output è vuoto
+    if not output_text or output_text.strip() == "":
+        output_text = "(Command executed successfully - no output)"
+    else:
+        output_text = output_text.strip()
+
+    # Aggiungi info sull'exit code se diverso da 0
+    if exit_code is not None and exit_code != 0:
+        output_text = f"⚠️ Command exited with code {exit_code}\n\n{output_text}"
+    return output_text
+
+
+def stream_command_on_machine(machine_name: str, command: str | list[str], lab: Lab):
+    """
+    Execute a command on a machine, yielding its output as it is produced
+
+    Args:
+        machine_name: Name of the machine
+        command: Command to execute (string or argv list)
+        lab: Lab instance
+
+    Yields:
+        tuple: ("stdout" | "stderr", bytes) for each chunk of output
+    """
+    # Con stream=True Kathara restituisce un DockerExecStream: supporta next() ma non l'iterazione,
+    # ogni elemento è una tupla (stdout, stderr) man mano che arrivano
+    result = get_kathara().exec(machine_name, command, lab=lab, stream=True)
+    while True:
+        try:
+            item = next(result)
+        except StopIteration:
+            return
+        if item is None:
+            continue
+        if isinstance(item, bytes):
+            yield "stdout", item
+        elif isinstance(item, (tuple, list)) and len(item) >= 2:
+            if item[0]:
+                yield "stdout", item[0] if isinstance(item[0], bytes) else str(item[0]).encode()
+            if item[1]:
+                yield "stderr", item[1] if isinstance(item[1], bytes) else str(item[1]).encode()
+
+
 def filter_machines_info(machines_info):
     machines = {}
     for name, infos in machines_info.items():
@@ -104,26 +159,23 @@ def filter_machines_info(machines_info):
     return machines
 
 
-def discover_running_lab():
+def discover_running_labs():
+    """
+    Hash dei lab Kathara con almeno una macchina in esecuzione, nell'ordine in cui vengono trovati.
+    Usa le label dei container (una sola query) invece delle statistiche di ogni macchina
+    """
     try:
-        filtered_machines = filter_machines_info(
-            next(Kathara.get_instance().get_machines_stats())
-        )
-        lab = None
-        for stats in filtered_machines.values():
-            lab = (
-                stats["network_scenario_id"]
-                if stats["network_scenario_id"] and stats["status"] == "running"
-                else None
-            )
-            if lab:  # Esci non appena trovi un lab
-                break
-        return lab
-    except StopIteration:
-        # Nessuna macchina in esecuzione
-        return None
+        return [
+            lab_hash for lab_hash, containers in get_kathara_containers().items()
+            if any(container.status == "running" for container in containers)
+        ]
     except Exception as e:
         import logging
 
-        logging.error(f"Error discovering running lab: {e}")
-        return None
+        logging.error(f"Error discovering running labs: {e}")
+        return []
+
+
+def discover_running_lab():
+    labs = discover_running_labs()
+    return labs[0] if labs else None
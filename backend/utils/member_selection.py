@@ -0,0 +1,204 @@
+import logging
+import random
+
+from globals import get_backend_setting, get_max_devices
+
+STRATEGY_FIRST_N = "first_n"
+STRATEGY_ASN_LIST = "asn_list"
+STRATEGY_TOP_N = "top_n"
+STRATEGY_STRATIFIED = "stratified"
+STRATEGY_PREFIX_BUDGET = "prefix_budget"
+
+STRATEGIES = (STRATEGY_FIRST_N, STRATEGY_ASN_LIST, STRATEGY_TOP_N, STRATEGY_STRATIFIED, STRATEGY_PREFIX_BUDGET)
+
+DEFAULT_STRATA = 4
+
+# Attributi delle entry del table dump letti dalle strategie (nessun fallback: se mancano la selezione fallisce)
+ENTRY_ASN_ATTRIBUTE = "as_num"
+ENTRY_PREFIXES_ATTRIBUTE = "prefixes"
+
+
+class MemberSelectionError(Exception):
+    """The member selection configured in settings.json is not valid"""
+    pass
+
+
+# ==================== CONFIGURATION ====================
+
+def get_member_selection() -> dict:
+    """
+    Member selection configured in settings.json ("member_selection"),
+    falling back to the first max_devices members.
+    """
+    selection = get_backend_setting("member_selection", None)
+    if not selection or not selection.get("strategy"):
+        return {"strategy": STRATEGY_FIRST_N, "count": get_max_devices()}
+    selection = dict(selection)
+    if selection.get("count") is None and selection["strategy"] != STRATEGY_ASN_LIST:
+        selection["count"] = get_max_devices()
+    return selection
+
+
+def validate_member_selection(selection: dict) -> None:
+    strategy = selection.get("strategy")
+    if strategy not in STRATEGIES:
+        raise MemberSelectionError(f"unknown strategy '{strategy}', expected one of {', '.join(STRATEGIES)}")
+
+    count = selection.get("count")
+    if count is not None and (not isinstance(count, int) or count < 1):
+        raise MemberSelectionError("count must be a positive integer or null")
+
+    if strategy == STRATEGY_ASN_LIST:
+        if not selection.get("asns"):
+            raise MemberSelectionError("asn_list strategy needs a non empty 'asns' list")
+        invalid = [asn for asn in selection["asns"] if not str(asn).upper().removeprefix("AS").isdigit()]
+        if invalid:
+            raise MemberSelectionError(f"invalid ASNs: {invalid}")
+    if strategy == STRATEGY_STRATIFIED:
+        strata = selection.get("strata", DEFAULT_STRATA)
+        if not isinstance(strata, int) or strata < 1:
+            raise MemberSelectionError("strata must be a positive integer")
+        if count is None:
+            raise MemberSelectionError("stratified strategy needs a 'count' (or max_devices)")
+    if strategy == STRATEGY_TOP_N and count is None:
+        raise MemberSelectionError("top_n strategy needs a 'count' (or max_devices)")
+    if strategy == STRATEGY_PREFIX_BUDGET:
+        budget = selection.get("prefix_budget")
+        if not isinstance(budget, int) or budget < 1:
+            raise MemberSelectionError("prefix_budget strategy needs a positive 'prefix_budget'")
+
+
+# ==================== TABLE DUMP INSPECTION ====================
+
+def _entry_attribute(key, entry, name: str):
+    value = entry.get(name) if isinstance(entry, dict) else getattr(entry, name, None)
+    if value is None:
+        raise MemberSelectionError(f"table dump entry {key} has no '{name}', cannot select members by it")
+    return value
+
+
+def count_prefixes(key, entry) -> int:
+    """
+    Number of distinct prefixes announced by a member: its `prefixes` attribute,
+    a collection of prefixes or a dict IP version -> collection of prefixes
+
+    Raises:
+        MemberSelectionError: The entry has no prefixes attribute
+    """
+    prefixes = _entry_attribute(key, entry, ENTRY_PREFIXES_ATTRIBUTE)
+    if isinstance(prefixes, dict):
+        return len({str(prefix) for afi_prefixes in prefixes.values() for prefix in afi_prefixes})
+    return len({str(prefix) for prefix in prefixes})
+
+
+def get_member_asn(key, entry) -> int:
+    """
+    AS number of a table dump entry, from its `as_num` attribute
+
+    Raises:
+        MemberSelectionError: The entry has no AS number, or not a valid one
+    """
+    asn = _entry_attribute(key, entry, ENTRY_ASN_ATTRIBUTE)
+    try:
+        return int(str(asn).upper().removeprefix("AS"))
+    except ValueError:
+        raise MemberSelectionError(f"table dump entry {key} has an invalid '{ENTRY_ASN_ATTRIBUTE}': {asn}")
+
+
+# ==================== STRATEGIES ====================
+
+def _top_n(counts: dict, count: int) -> list:
+    return sorted(counts, key=lambda key: counts[key], reverse=True)[:count]
+
+
+def _stratified(counts: dict, count: int, strata: int, seed) -> list:
+    """Sample evenly from `strata` buckets of members ordered by prefix count"""
+    ordered = sorted(counts, key=lambda key: counts[key])
+    strata = max(1, min(strata, len(ordered)))
+    rng = random.Random(seed)
+
+    buckets = [ordered[i * len(ordered) // strata:(i + 1) * len(ordered) // strata] for i in range(strata)]
+    selected = []
+    for i, bucket in enumerate(buckets):
+        # Distribuisci il resto sui bucket con i prefix count più alti
+        quota = count // strata + (1 if i >= strata - count % strata else 0)
+        selected.extend(rng.sample(bucket, min(quota, len(bucket))))
+
+    # Bucket troppo piccoli: completa con i membri rimasti
+    chosen = set(selected)
+    remaining = [key for key in reversed(ordered) if key not in chosen]
+    selected.extend(remaining[:max(0, count - len(selected))])
+    return selected
+
+
+def _prefix_budget(counts: dict, budget: int, count: int | None) -> list:
+    """Largest members first, while the total number of prefixes stays within budget"""
+    selected = []
+    total = 0
+    for key in sorted(counts, key=lambda key: counts[key], reverse=True):
+        if count is not None and len(selected) >= count:
+            break
+        if total + counts[key] <= budget:
+            selected.append(key)
+            total += counts[key]
+    return selected
+
+
+def select_members(entries: dict, selection: dict) -> tuple[dict, dict]:
+    """
+    Apply a member selection strategy to the table dump entries.
+
+    Returns:
+        The selected entries (in the original order) and a summary of the selection
+    """
+    validate_member_selection(selection)
+    strategy = selection["strategy"]
+    count = selection.get("count")
+
+    if strategy == STRATEGY_FIRST_N:
+        keys = list(entries.keys())[:count] if count else list(entries.keys())
+        counts = None
+    elif strategy == STRATEGY_ASN_LIST:
+        wanted = {int(str(asn).upper().removeprefix("AS")) for asn in selection["asns"]}
+        keys = [key for key, entry in entries.items() if get_member_asn(key, entry) in wanted]
+        found = {get_member_asn(key, entries[key]) for key in keys}
+        if wanted - found:
+            logging.warning(f"Member selection: ASNs not found in the dumps: {sorted(wanted - found)}")
+        if count:
+            keys = keys[:count]
+        counts = None
+    else:
+        counts = {key: count_prefixes(key, entry) for key, entry in entries.items()}
+        if strategy == STRATEGY_TOP_N:
+            keys = _top_n(counts, count)
+        elif strategy == STRATEGY_STRATIFIED:
+            keys = _stratified(counts, count, selection.get("strata", DEFAULT_STRATA), selection.get("seed", 0))
+        else:
+            keys = _prefix_budget(counts, selection["prefix_budget"], count)
+
+    keys = set(keys)
+    selected = {key: entry for key, entry in entries.items() if key in keys}
+
+    summary = {"strategy": strategy, "members_total": len(entries), "members_selected": len(selected)}
+    if counts is not None:
+        summary["prefixes_total"] = sum(counts.values())
+        summary["prefixes_selected"] = sum(counts[key] for key in selected)
+    return selected, summary
+
+
+def apply_member_selection(table_dump) -> dict:
+    """
+    Restrict table_dump.entries according to the configured member selection.
+
+    Returns:
+        The selection summary
+    """
+    selection = get_member_selection()
+    selected, summary = select_members(table_dump.entries, selection)
+    table_dump.entries = selected
+    logging.info(
+        f"✅ Member selection '{summary['strategy']}': "
+        f"{summary['members_total']} -> {summary['members_selected']} devices"
+        + (f", {summary['prefixes_selected']}/{summary['prefixes_total']} prefixes" if "prefixes_total" in summary else "")
+    )
+    return summary
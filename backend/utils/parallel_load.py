@@ -0,0 +1,128 @@
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+
+from globals import BACKEND_RESOURCES_FOLDER, get_backend_setting
+from utils.profiler import profile_annotate
+from digital_twin.ixp.foundation.dumps.member_dump.member_dump_factory import MemberDumpFactory
+from digital_twin.ixp.foundation.dumps.table_dump.table_dump_factory import TableDumpFactory
+
+# Secondi concessi a ogni RIB dump prima di tornare al caricamento sequenziale
+DEFAULT_PARALLEL_DUMP_TIMEOUT = 300
+
+
+def _get_context():
+    """
+    Start method of the pool: never `fork`, the uvicorn worker has other threads
+    running and a child forked while one of them holds a lock would hang on it
+    """
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+
+
+# ==================== WORKERS ====================
+# Eseguiti nei processi del pool: devono essere funzioni top-level (picklable)
+
+def _rib_dump_worker(table_type: str, entries, dump_path: str):
+    """
+    Load a single RIB dump on a table dump of the given member entries.
+
+    Returns:
+        tuple: The entries of the table dump (only the data of this AFI), load time
+    """
+    started = time.perf_counter()
+    table_dump = TableDumpFactory(submodule_package="digital_twin").get_class_from_name(table_type)(entries)
+    table_dump.load_from_file(dump_path)
+    return table_dump.entries, time.perf_counter() - started
+
+
+def _stop_pool(pool: ProcessPoolExecutor) -> None:
+    """Drop the pending loads and kill the workers still running (a hung parse would block shutdown)"""
+    pool.shutdown(wait=False, cancel_futures=True)
+    # ProcessPoolExecutor non espone un modo pubblico per terminare i worker prima di Python 3.14
+    for process in list((getattr(pool, "_processes", None) or {}).values()):
+        process.terminate()
+
+
+# ==================== ENTRY POINT ====================
+
+def load_table_dump_parallel(settings):
+    """
+    Parse the member dump once, then load every RIB dump concurrently in a
+    process pool, each on its own table dump of the member entries. The workers
+    send back only the entries of their AFI, which are merged into a single
+    table dump through its `merge(entries)` method.
+
+    Returns:
+        The table dump, or None if parallel loading is not possible (the
+        caller must then fall back to sequential loading)
+
+    Raises:
+        TimeoutError: A RIB dump was not loaded within `parallel_dump_timeout` seconds
+    """
+    dumps = settings.rib_dumps["dumps"]
+    if len(dumps) < 2:
+        profile_annotate(dumps_loading_fallback="less than 2 RIB dumps")
+        return None
+
+    table_dump_class = TableDumpFactory(submodule_package="digital_twin").get_class_from_name(
+        settings.rib_dumps["type"]
+    )
+    if not callable(getattr(table_dump_class, "merge", None)):
+        # Senza un merge del modello i risultati dei worker non si possono combinare in modo affidabile
+        logging.warning(
+            f"⚠️ {table_dump_class.__name__} has no merge(entries): parallel_dump_loading is on, "
+            f"but RIB dumps are loaded sequentially"
+        )
+        profile_annotate(dumps_loading_fallback=f"{table_dump_class.__name__} has no merge(entries)")
+        return None
+
+    started = time.perf_counter()
+    member_dump_class = MemberDumpFactory(submodule_package="digital_twin").get_class_from_name(
+        settings.peering_configuration["type"]
+    )
+    entries = member_dump_class().load_from_file(
+        os.path.join(BACKEND_RESOURCES_FOLDER, settings.peering_configuration["path"])
+    )
+    member_time = time.perf_counter() - started
+    logging.info(f"Loaded {len(entries)} member entries ({member_time:.2f}s)")
+
+    timeout = float(get_backend_setting("parallel_dump_timeout", DEFAULT_PARALLEL_DUMP_TIMEOUT))
+    loaded = {}
+    rib_times = {}
+    pool = ProcessPoolExecutor(max_workers=len(dumps), mp_context=_get_context())
+    try:
+        futures = {}
+        for v, file in dumps.items():
+            dump_path = os.path.join(BACKEND_RESOURCES_FOLDER, file)
+            logging.info(f"Loading RIB dump (IPv{v}) in parallel: {dump_path}")
+            futures[v] = pool.submit(_rib_dump_worker, settings.rib_dumps["type"], entries, dump_path)
+
+        deadline = time.monotonic() + timeout
+        for v, future in futures.items():
+            try:
+                loaded[v], rib_times[v] = future.result(timeout=max(0.0, deadline - time.monotonic()))
+            except FutureTimeoutError:
+                raise TimeoutError(f"RIB dump IPv{v} not loaded within {timeout}s")
+            logging.info(f"Loaded RIB dump IPv{v} ({rib_times[v]:.2f}s)")
+    except BaseException:
+        _stop_pool(pool)
+        raise
+    pool.shutdown()
+
+    # Tempi dei singoli worker (il wall della fase è il massimo, non la somma)
+    profile_annotate(
+        parallel_member_dump_s=round(member_time, 4),
+        parallel_rib_dump_s={v: round(t, 4) for v, t in rib_times.items()},
+    )
+
+    table_dump = table_dump_class(entries)
+    for afi_entries in loaded.values():
+        table_dump.merge(afi_entries)
+
+    logging.info(
+        f"Loaded RIB dumps for {len(dumps)} IP versions in parallel ({time.perf_counter() - started:.2f}s)"
+    )
+    return table_dump
@@ -0,0 +1,292 @@
+import contextvars
+import cProfile
+import fcntl
+import io
+import json
+import logging
+import os
+import pstats
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager, nullcontext
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from globals import BACKEND_PROFILES_FOLDER, get_backend_setting
+
+PROFILE_HISTORY_FILE = os.path.join(BACKEND_PROFILES_FOLDER, "history.jsonl")
+MAX_PROFILE_HISTORY = 500
+CPROFILE_TOP_ENTRIES = 40
+# Intervallo di campionamento dell'RSS durante un run (picco per fase)
+RSS_SAMPLE_INTERVAL = 0.05
+
+_active_profiler = contextvars.ContextVar("active_profiler", default=None)
+
+
+def _current_rss_mb() -> float | None:
+    try:
+        with open("/proc/self/statm", "r") as f:
+            pages = int(f.read().split()[1])
+        return round(pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024), 2)
+    except Exception:
+        return None
+
+
+def _children_cpu() -> float:
+    if resource is None:
+        return 0.0
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+class BuildProfiler:
+    """
+    Per-phase profiler of a build/reload run: wall clock, CPU (including the
+    dump-parsing worker processes) and RSS of every phase, with an optional
+    cProfile capture of the whole run. Each run is appended to the history
+    in profiles/history.jsonl.
+
+    The peak RSS of a phase is sampled while it runs (every RSS_SAMPLE_INTERVAL
+    seconds): ru_maxrss and VmHWM are process-lifetime high-water marks, and
+    resetting VmHWM would break the peak of the enclosing phases and of the
+    runs going on in other threads.
+    """
+
+    def __init__(self, operation: str, ixpconf_filename: str | None, capture_cprofile: bool = False):
+        self.run_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}"
+        self.operation = operation
+        self.ixpconf_filename = ixpconf_filename
+        self.capture_cprofile = capture_cprofile
+        self.phases = []
+        self.metadata = {}
+        self.started_at = None
+        self._wall_start = None
+        self._cpu_start = None
+        self._children_cpu_start = None
+        self._cprofile = None
+        self._peak_rss = None
+        self._open_phases = []
+        self._sampling = threading.Event()
+        self._sampler = None
+
+    # ==================== RSS ====================
+
+    def _sample_rss(self) -> None:
+        rss = _current_rss_mb()
+        if rss is None:
+            return
+        self._peak_rss = max(self._peak_rss or 0.0, rss)
+        for record in list(self._open_phases):
+            record["peak_rss_mb"] = max(record.get("peak_rss_mb") or 0.0, rss)
+
+    def _sample_loop(self) -> None:
+        while not self._sampling.wait(RSS_SAMPLE_INTERVAL):
+            self._sample_rss()
+
+    # ==================== PHASES ====================
+
+    @contextmanager
+    def phase(self, name: str, **metadata):
+        record = {"name": name, **metadata}
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        children_start = _children_cpu()
+        record["peak_rss_mb"] = _current_rss_mb()
+        self._open_phases.append(record)
+        status = "completed"
+        try:
+            yield record
+        except Exception:
+            status = "failed"
+            raise
+        finally:
+            record["status"] = status
+            record["wall_s"] = round(time.perf_counter() - wall_start, 4)
+            record["cpu_s"] = round(time.process_time() - cpu_start, 4)
+            record["children_cpu_s"] = round(_children_cpu() - children_start, 4)
+            self._sample_rss()
+            self._open_phases.remove(record)
+            record["rss_mb"] = _current_rss_mb()
+            self.phases.append(record)
+            logging.info(f"⏱️ {self.operation}/{name}: {record['wall_s']}s wall, {record['cpu_s']}s cpu")
+
+    def annotate(self, **metadata) -> None:
+        self.metadata.update(metadata)
+
+    # ==================== RUN ====================
+
+    def start(self) -> None:
+        self.started_at = time.time()
+        self._wall_start = time.perf_counter()
+        self._cpu_start = time.process_time()
+        self._children_cpu_start = _children_cpu()
+        self._peak_rss = _current_rss_mb()
+        self._sampler = threading.Thread(target=self._sample_loop, name=f"rss-{self.run_id}", daemon=True)
+        self._sampler.start()
+        if self.capture_cprofile:
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+
+    def finish(self, status: str, error: str | None = None) -> dict:
+        self._sampling.set()
+        self._sample_rss()
+        record = {
+            "run_id": self.run_id,
+            "operation": self.operation,
+            "ixpconf_filename": self.ixpconf_filename,
+            "status": status,
+            "error": error,
+            "started_at": self.started_at,
+            "wall_s": round(time.perf_counter() - self._wall_start, 4),
+            "cpu_s": round(time.process_time() - self._cpu_start, 4),
+            "children_cpu_s": round(_children_cpu() - self._children_cpu_start, 4),
+            "peak_rss_mb": self._peak_rss,
+            "phases": self.phases,
+            "metadata": self.metadata,
+            "cprofile": None,
+        }
+
+        if self._cprofile is not None:
+            self._cprofile.disable()
+            record["cprofile"] = self._save_cprofile()
+
+        try:
+            append_profile_record(record)
+        except Exception as e:
+            logging.warning(f"Could not persist profile {self.run_id}: {e}")
+
+        logging.info(f"⏱️ {self.operation} run {self.run_id}: {record['wall_s']}s total ({status})")
+        return record
+
+    def _save_cprofile(self) -> dict | None:
+        try:
+            os.makedirs(BACKEND_PROFILES_FOLDER, exist_ok=True)
+            prof_path = os.path.join(BACKEND_PROFILES_FOLDER, f"{self.run_id}.prof")
+            self._cprofile.dump_stats(prof_path)
+
+            summary = io.StringIO()
+            stats = pstats.Stats(self._cprofile, stream=summary)
+            stats.sort_stats("cumulative").print_stats(CPROFILE_TOP_ENTRIES)
+            return {"file": os.path.basename(prof_path), "summary": summary.getvalue()}
+        except Exception as e:
+            logging.warning(f"Could not save cProfile capture: {e}")
+            return None
+
+
+@contextmanager
+def profiled_run(operation: str, ixpconf_filename: str | None, capture_cprofile: bool = False):
+    """
+    Profile a whole build/reload run. Phases opened with profile_phase() in
+    the same context (also in nested helpers) are attached to this run.
+    The cProfile capture is on if requested or if "cprofile_builds" is set in settings.json.
+    """
+    capture_cprofile = capture_cprofile or bool(get_backend_setting("cprofile_builds", False))
+    profiler = BuildProfiler(operation, ixpconf_filename, capture_cprofile)
+    token = _active_profiler.set(profiler)
+    profiler.start()
+    try:
+        yield profiler
+    except Exception as e:
+        profiler.finish("failed", error=str(e))
+        raise
+    else:
+        profiler.finish("completed")
+    finally:
+        _active_profiler.reset(token)
+
+
+def profile_phase(name: str, **metadata):
+    """Time a phase on the active profiler, if any"""
+    profiler = _active_profiler.get()
+    return profiler.phase(name, **metadata) if profiler is not None else nullcontext({})
+
+
+def profile_annotate(**metadata) -> None:
+    """Attach metadata (config size, cache hits, ...) to the active run, if any"""
+    profiler = _active_profiler.get()
+    if profiler is not None:
+        profiler.annotate(**metadata)
+
+
+# ==================== HISTORY ====================
+
+@contextmanager
+def _history_lock():
+    """Exclusive lock on the history, shared by all the processes of the backend"""
+    os.makedirs(BACKEND_PROFILES_FOLDER, exist_ok=True)
+    with open(PROFILE_HISTORY_FILE + ".lock", "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        yield
+
+
+def _prune_cprofiles(records: list[dict]) -> None:
+    """Remove the .prof captures of the runs no longer in the history"""
+    kept = {(record.get("cprofile") or {}).get("file") for record in records}
+    # Le catture dei run più recenti del più vecchio conservato possono essere di run non ancora registrati
+    oldest = min((record.get("run_id") or "" for record in records), default="")
+    for name in os.listdir(BACKEND_PROFILES_FOLDER):
+        if name.endswith(".prof") and name not in kept and name < oldest:
+            try:
+                os.unlink(os.path.join(BACKEND_PROFILES_FOLDER, name))
+            except OSError as e:
+                logging.warning(f"Could not remove cProfile capture {name}: {e}")
+
+
+def append_profile_record(record: dict) -> None:
+    with _history_lock():
+        with open(PROFILE_HISTORY_FILE, "a") as f:
+            f.write(json.dumps(record, default=str) + "\n")
+
+        # Mantieni solo gli ultimi MAX_PROFILE_HISTORY run
+        with open(PROFILE_HISTORY_FILE, "r") as f:
+            lines = f.readlines()
+        if len(lines) <= MAX_PROFILE_HISTORY:
+            return
+        lines = lines[-MAX_PROFILE_HISTORY:]
+        # Sostituzione atomica: chi legge vede la history vecchia o quella nuova, mai un file troncato
+        fd, tmp_path = tempfile.mkstemp(dir=BACKEND_PROFILES_FOLDER, prefix=".history-", suffix=".jsonl")
+        try:
+            with os.fdopen(fd, "w") as f:
+                f.writelines(lines)
+            os.replace(tmp_path, PROFILE_HISTORY_FILE)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+        records = []
+        for line in lines:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                continue
+        _prune_cprofiles(records)
+
+
+def read_profile_history(operation: str | None = None, limit: int | None = None) -> list[dict]:
+    """Profiled runs, most recent first"""
+    if not os.path.exists(PROFILE_HISTORY_FILE):
+        return []
+    records = []
+    with open(PROFILE_HISTORY_FILE, "r") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # Riga in corso di scrittura da un altro processo
+                continue
+            if operation is None or record.get("operation") == operation:
+                records.append(record)
+    records.reverse()
+    return records[:limit] if limit else records
+
+
+def get_profile_record(run_id: str) -> dict | None:
+    for record in read_profile_history():
+        if record.get("run_id") == run_id:
+            return record
+    return None
@@ -0,0 +1,77 @@
+import statistics
+
+from utils.profiler import read_profile_history
+
+# Reload completati usati per la stima
+ESTIMATE_HISTORY_RUNS = 10
+
+# Fasi del reload il cui costo dipende dal numero di device
+DEPLOY_PHASES = ("frr_configuration", "deploy_devices", "interconnect")
+UNDEPLOY_PHASES = ("undeploy_devices",)
+PUSH_PHASES = ("rs_config_push", "peering_config_push")
+
+
+def _phase_wall(record: dict, names: tuple[str, ...]) -> float:
+    return sum(phase.get("wall_s", 0) for phase in record.get("phases", []) if phase.get("name") in names)
+
+
+def _pushed_devices(metadata: dict) -> int:
+    return sum(
+        sum(metadata.get(f"{kind}_push", {}).get(status, 0) for status in ("ok", "failed", "timeout"))
+        for kind in ("rs", "peering")
+    )
+
+
+def _median(values: list[float]) -> float | None:
+    return round(statistics.median(values), 4) if values else None
+
+
+def get_reload_rates(ixpconf_filename: str | None = None) -> dict:
+    """
+    Per-device costs of the last completed reloads (median): fixed overhead,
+    seconds per deployed, undeployed and reconfigured device.
+    Runs of the same ixpconf are preferred when available.
+    """
+    runs = [record for record in read_profile_history("reload") if record.get("status") == "completed"]
+    same_config = [record for record in runs if record.get("ixpconf_filename") == ixpconf_filename]
+    runs = (same_config or runs)[:ESTIMATE_HISTORY_RUNS]
+
+    fixed, deploy, undeploy, push = [], [], [], []
+    for record in runs:
+        metadata = record.get("metadata", {})
+        deploy_s = _phase_wall(record, DEPLOY_PHASES)
+        undeploy_s = _phase_wall(record, UNDEPLOY_PHASES)
+        push_s = _phase_wall(record, PUSH_PHASES)
+        fixed.append(max(0.0, record.get("wall_s", 0) - deploy_s - undeploy_s - push_s))
+
+        if metadata.get("new_devices"):
+            deploy.append(deploy_s / metadata["new_devices"])
+        undeployed = metadata.get("removed_devices", 0) + metadata.get("recreated_devices", 0)
+        if undeployed:
+            undeploy.append(undeploy_s / undeployed)
+        pushed = _pushed_devices(metadata)
+        if pushed:
+            push.append(push_s / pushed)
+
+    return {
+        "runs": len(runs),
+        "fixed_s": _median(fixed),
+        "deploy_per_device_s": _median(deploy),
+        "undeploy_per_device_s": _median(undeploy),
+        "push_per_device_s": _median(push),
+    }
+
+
+def estimate_reload_duration(rates: dict, new: int, undeployed: int, pushed: int) -> float | None:
+    """Estimated reload wall time in seconds, None without history"""
+    if not rates["runs"]:
+        return None
+    estimate = rates["fixed_s"] or 0.0
+    for count, rate in (
+        (new, rates["deploy_per_device_s"]),
+        (undeployed, rates["undeploy_per_device_s"]),
+        (pushed, rates["push_per_device_s"]),
+    ):
+        if count and rate is not None:
+            estimate += count * rate
+    return round(estimate, 2)
@@ -1,41 +1,545 @@
-from Kathara.model.Lab import Lab
-from Kathara.model.Machine import Machine
+from __future__ import annotations
+
+import logging
+import os
+import threading
+import time
+from typing import TYPE_CHECKING
+
+from utils.jobs import Job, get_job_registry
+from utils.shared_state import get_shared_state, process_alive
+
+if TYPE_CHECKING:
+    from Kathara.model.Lab import Lab
+    from Kathara.model.Machine import Machine
+
+# Stati del ciclo di vita del lab
+LAB_IDLE = "idle"
+LAB_DISCOVERING = "discovering"
+LAB_BUILDING = "building"
+LAB_QUEUED = "queued"
+LAB_DEPLOYING = "deploying"
+LAB_RUNNING = "running"
+LAB_RELOADING = "reloading"
+LAB_WIPING = "wiping"
+
+# Namespace dello store condiviso tra i worker (utils/shared_state.py)
+LABS_NAMESPACE = "labs"
+CONTEXT_NAMESPACE = "lab_context"
+
+# Secondi prima di richiedere di nuovo a Kathara un lab in deploy o non trovato
+LAB_LOOKUP_RETRY = 2.0
+WIPES_NAMESPACE = "lab_wipes"
+
+# Attesa massima della discovery all'avvio da parte degli endpoint che cambiano i lab
+DISCOVERY_WAIT_TIMEOUT = 60
+
+
+class LabTransitionConflict(Exception):
+    """Another lifecycle operation is in progress and the requested one cannot run now"""
+
+    def __init__(self, operation: str, current: dict):
+        self.operation = operation
+        self.current = current
+        super().__init__(
+            f"cannot {operation}: {current['operation']} ({current['key']}) in progress, lab is {current['state']}"
+        )
+
+
+def _lab_record(lab_hash: str, lab_name: str, lab_machines: int, ixpconf_filename: str | None,
+                is_discovered: bool | None, state: str, previous: dict | None) -> dict:
+    """State of one lab known to the backend, as kept in the shared state store"""
+    return {
+        "lab_hash": lab_hash,
+        "lab_name": lab_name,
+        "lab_machines": lab_machines,
+        "ixpconf_filename": ixpconf_filename,
+        "is_discovered": is_discovered,
+        "state": state,
+        "job_id": previous["job_id"] if previous else None,
+        "added_at": previous["added_at"] if previous else time.time(),
+        # Cambia a ogni set_lab_context: invalida gli oggetti Lab tenuti dai worker
+        "revision": previous["revision"] + 1 if previous else 1,
+    }
 
 
 class ServerContext:
-    lab: Lab | None
-    ixpconf_filename: str | None
-    is_lab_discovered: bool | None
-    total_machines: dict[str, Machine] | None
+    """
+    Labs known to the backend, keyed by hash, shared by request handlers,
+    background jobs and all the uvicorn workers.
+
+    The lab records, the active lab, the lifecycle transition and the wipes
+    live in the shared state store, so every worker gives the same answers;
+    each worker only keeps the Kathara Lab objects, rebuilt from the running
+    containers (get_lab_from_api) for labs started by another worker.
+
+    Getters take an optional lab_hash; without it they refer to the active lab
+    (the last one started, restored or selected). Use snapshot() for a
+    consistent view of several fields.
+
+    begin_transition() serializes start builds, reloads and restores, which
+    share the digital_twin singletons; once built, labs are deployed, run and
+    wiped independently (see begin_wipe()).
+    """
+    _lab_objects: dict[str, tuple[int, Lab]] = {}
+    # Ultima ricerca su Kathara di un lab non ancora completo (in deploy) o non trovato
+    _lab_lookups: dict[str, tuple[int, float, Lab | None]] = {}
+
+    _lock = threading.RLock()
+
+    @staticmethod
+    def _store():
+        return get_shared_state()
 
     @staticmethod
-    def get_lab() -> Lab | None:
-        return ServerContext.lab
+    def _active_hash() -> str | None:
+        return ServerContext._store().get(CONTEXT_NAMESPACE, "active_lab_hash")
+
+    @staticmethod
+    def _record(lab_hash: str | None = None) -> dict | None:
+        target = lab_hash or ServerContext._active_hash()
+        return ServerContext._store().get(LABS_NAMESPACE, target) if target else None
+
+    @staticmethod
+    def _lab_of(record: dict | None) -> Lab | None:
+        if record is None:
+            return None
+        lab_hash = record["lab_hash"]
+        with ServerContext._lock:
+            cached = ServerContext._lab_objects.get(lab_hash)
+            lookup = ServerContext._lab_lookups.get(lab_hash)
+        if cached is not None and cached[0] == record["revision"]:
+            return cached[1]
+        # Lab in deploy o non trovato: una sola ricerca su Kathara ogni LAB_LOOKUP_RETRY secondi
+        if lookup is not None and lookup[0] == record["revision"] and time.monotonic() - lookup[1] < LAB_LOOKUP_RETRY:
+            return lookup[2]
+
+        # Lab registrato da un altro worker: ricostruito dai container in esecuzione
+        from Kathara.manager.Kathara import Kathara
+
+        try:
+            lab = Kathara.get_instance().get_lab_from_api(lab_hash)
+        except Exception as e:
+            logging.warning(f"Could not load lab {lab_hash} from Kathara: {e}")
+            lab = None
+        with ServerContext._lock:
+            # Un lab ancora in deploy non va tenuto: mancano dei device
+            if lab is not None and len(lab.machines) >= record["lab_machines"]:
+                ServerContext._lab_objects[lab_hash] = (record["revision"], lab)
+                ServerContext._lab_lookups.pop(lab_hash, None)
+            else:
+                ServerContext._lab_lookups[lab_hash] = (record["revision"], time.monotonic(), lab)
+        return lab
 
     @staticmethod
-    def set_lab(lab: Lab | None) -> None:
-        ServerContext.lab = lab
+    def get_lab(lab_hash: str | None = None) -> Lab | None:
+        return ServerContext._lab_of(ServerContext._record(lab_hash))
 
     @staticmethod
-    def get_ixpconf_filename() -> str | None:
-        return ServerContext.ixpconf_filename
+    def get_ixpconf_filename(lab_hash: str | None = None) -> str | None:
+        record = ServerContext._record(lab_hash)
+        return record["ixpconf_filename"] if record is not None else None
 
     @staticmethod
-    def set_ixpconf_filename(ixpconf_filename: str | None) -> None:
-        ServerContext.ixpconf_filename = ixpconf_filename
+    def get_total_machines(lab_hash: str | None = None) -> dict[str, Machine] | None:
+        lab = ServerContext.get_lab(lab_hash)
+        return lab.machines if lab is not None else None
 
     @staticmethod
-    def get_total_machines() -> dict[str, Machine]:
-        return ServerContext.total_machines
+    def get_is_lab_discovered(lab_hash: str | None = None) -> bool | None:
+        record = ServerContext._record(lab_hash)
+        return record["is_discovered"] if record is not None else None
 
     @staticmethod
-    def set_total_machines(total_machines: dict[str, Machine]) -> None:
-        ServerContext.total_machines = total_machines
+    def get_current_job_id() -> str | None:
+        return ServerContext._store().get(CONTEXT_NAMESPACE, "current_job_id")
 
     @staticmethod
-    def get_is_lab_discovered() -> bool | None:
-        return ServerContext.is_lab_discovered
+    def set_current_job_id(job_id: str | None) -> None:
+        ServerContext._store().put(CONTEXT_NAMESPACE, "current_job_id", job_id)
 
     @staticmethod
-    def set_is_lab_discovered(is_discovered: bool | None) -> None:
-        ServerContext.is_lab_discovered = is_discovered
+    def get_active_lab_hash() -> str | None:
+        return ServerContext._active_hash()
+
+    @staticmethod
+    def select_lab(lab_hash: str) -> bool:
+        """Make a known lab the active one. Returns False if it is unknown"""
+        store = ServerContext._store()
+        with ServerContext._lock, store.transaction():
+            if store.get(LABS_NAMESPACE, lab_hash) is None:
+                return False
+            store.put(CONTEXT_NAMESPACE, "active_lab_hash", lab_hash)
+            return True
+
+    # ==================== ATOMIC UPDATES ====================
+
+    @staticmethod
+    def set_lab_context(lab: Lab, ixpconf_filename: str | None, is_discovered: bool | None,
+                        state: str = LAB_RUNNING, activate: bool = True) -> None:
+        """Register (or update) a lab with its config and discovery flag, and make it the active one"""
+        store = ServerContext._store()
+        with ServerContext._lock, store.transaction():
+            previous = store.get(LABS_NAMESPACE, lab.hash)
+            record = _lab_record(
+                lab.hash, lab.name, len(lab.machines), ixpconf_filename, is_discovered, state, previous
+            )
+            store.put(LABS_NAMESPACE, lab.hash, record)
+            ServerContext._lab_objects[lab.hash] = (record["revision"], lab)
+            if activate or ServerContext._active_hash() is None:
+                store.put(CONTEXT_NAMESPACE, "active_lab_hash", lab.hash)
+
+    @staticmethod
+    def clear_lab_context(lab_hash: str | None = None) -> None:
+        """Forget a lab (the active one by default); the most recent remaining lab becomes active"""
+        store = ServerContext._store()
+        with ServerContext._lock, store.transaction():
+            active = ServerContext._active_hash()
+            lab_hash = lab_hash or active
+            if lab_hash:
+                store.delete(LABS_NAMESPACE, lab_hash)
+                ServerContext._lab_objects.pop(lab_hash, None)
+                ServerContext._lab_lookups.pop(lab_hash, None)
+            labs = store.items(LABS_NAMESPACE)
+            if active == lab_hash or active not in labs:
+                remaining = sorted(labs.values(), key=lambda record: record["added_at"])
+                store.put(CONTEXT_NAMESPACE, "active_lab_hash", remaining[-1]["lab_hash"] if remaining else None)
+
+    @staticmethod
+    def _update_record(lab_hash: str, **fields) -> dict | None:
+        store = ServerContext._store()
+        with store.transaction():
+            record = store.get(LABS_NAMESPACE, lab_hash)
+            if record is not None:
+                record.update(fields)
+                store.put(LABS_NAMESPACE, lab_hash, record)
+            return record
+
+    @staticmethod
+    def set_lab_state(lab_hash: str, state: str) -> None:
+        ServerContext._update_record(lab_hash, state=state)
+
+    @staticmethod
+    def track_lab_job(lab_hash: str, job: Job) -> None:
+        """The lab goes back to running when job (deploy, restore) is over"""
+        store = ServerContext._store()
+        with ServerContext._lock, store.transaction():
+            if ServerContext._update_record(lab_hash, job_id=job.id) is None:
+                return
+            store.put(CONTEXT_NAMESPACE, "current_job_id", job.id)
+
+        def on_done(finished: Job):
+            with ServerContext._lock, store.transaction():
+                current = store.get(LABS_NAMESPACE, lab_hash)
+                if current is not None and current["job_id"] == finished.id:
+                    ServerContext._update_record(lab_hash, state=LAB_RUNNING)
+
+        job.add_done_callback(on_done)
+
+    @staticmethod
+    def register_discovered_labs(labs: list[Lab], reattached: list[dict] = ()) -> None:
+        """
+        Reconcile the shared lab records with the labs running on the host (at startup):
+        records of labs that are gone are dropped (unless a live job is still deploying
+        them), labs with a matching manifest (utils/lab_manifest.py) get their ixpconf
+        back, other running labs not known yet are added as discovered.
+        """
+        store = ServerContext._store()
+        running = {lab.hash: lab for lab in labs}
+        with ServerContext._lock, store.transaction():
+            known = store.items(LABS_NAMESPACE)
+            reattached_hashes = {manifest["lab_hash"] for manifest in reattached}
+            for lab_hash, record in known.items():
+                if lab_hash in running or lab_hash in reattached_hashes:
+                    continue
+                job = get_job_registry().get(record["job_id"]) if record.get("job_id") else None
+                if job is None or job.is_finished():
+                    logging.info(f"Lab {lab_hash} is not running anymore, forgetting it")
+                    ServerContext.clear_lab_context(lab_hash)
+
+            for lab_hash, lab in running.items():
+                record = known.get(lab_hash)
+                if record is None:
+                    ServerContext.set_lab_context(lab, None, is_discovered=True,
+                                                  activate=ServerContext._active_hash() is None)
+                else:
+                    # Già registrato (da un altro worker o da un avvio precedente)
+                    ServerContext._lab_objects[lab_hash] = (record["revision"], lab)
+
+            # Nessun oggetto Lab: viene ricostruito dalle API di Kathara al primo uso
+            for manifest in reattached:
+                previous = known.get(manifest["lab_hash"])
+                record = _lab_record(
+                    manifest["lab_hash"], manifest["lab_name"], len(manifest["devices"]),
+                    manifest["ixpconf_filename"], False, LAB_RUNNING, previous,
+                )
+                store.put(LABS_NAMESPACE, manifest["lab_hash"], record)
+                if ServerContext._active_hash() is None:
+                    store.put(CONTEXT_NAMESPACE, "active_lab_hash", manifest["lab_hash"])
+
+    # ==================== DISCOVERY ====================
+
+    @staticmethod
+    def begin_discovery(process_started_at: float) -> bool:
+        """
+        Claim the startup discovery of the running labs. Returns False if another
+        worker is already discovering, or has done it after this process started.
+        """
+        store = ServerContext._store()
+        with ServerContext._lock, store.transaction():
+            current = store.get(CONTEXT_NAMESPACE, "discovery")
+            if current is not None:
+                if ServerContext._discovering(current):
+                    return False
+                if current["ended_at"] is not None and current["ended_at"] >= process_started_at:
+                    return False
+            store.put(CONTEXT_NAMESPACE, "discovery", {"pid": os.getpid(), "started_at": time.time(), "ended_at": None})
+            return True
+
+    @staticmethod
+    def end_discovery() -> None:
+        store = ServerContext._store()
+        with ServerContext._lock, store.transaction():
+            current = store.get(CONTEXT_NAMESPACE, "discovery")
+            if current is not None and current["pid"] == os.getpid():
+                current["ended_at"] = time.time()
+                store.put(CONTEXT_NAMESPACE, "discovery", current)
+
+    @staticmethod
+    def _discovering(discovery: dict | None) -> bool:
+        return discovery is not None and discovery["ended_at"] is None and process_alive(discovery["pid"])
+
+    @staticmethod
+    def is_discovering() -> bool:
+        return ServerContext._discovering(ServerContext._store().get(CONTEXT_NAMESPACE, "discovery"))
+
+    @staticmethod
+    def wait_for_discovery(timeout: float = DISCOVERY_WAIT_TIMEOUT) -> bool:
+        """Block until the startup discovery is over (or timeout). Returns False on timeout"""
+        store = ServerContext._store()
+        deadline = time.monotonic() + timeout
+        version = store.version(CONTEXT_NAMESPACE)
+        while ServerContext.is_discovering():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                logging.warning(f"Lab discovery still running after {timeout}s, going on")
+                return False
+            version = store.wait_for_change(CONTEXT_NAMESPACE, version, min(remaining, 1.0))
+        return True
+
+    # ==================== VIEWS ====================
+
+    @staticmethod
+    def _view() -> dict:
+        """Consistent read of the shared lab context"""
+        store = ServerContext._store()
+        with store.transaction(write=False):
+            view = {
+                "labs": store.items(LABS_NAMESPACE),
+                "context": store.items(CONTEXT_NAMESPACE),
+                "wipes": store.items(WIPES_NAMESPACE),
+            }
+        view["transition"] = ServerContext._live_transition(view["context"].get("transition"))
+        view["wipes"] = {
+            lab_hash: wipe for lab_hash, wipe in view["wipes"].items() if ServerContext._job_running(wipe["job_id"])
+        }
+        return view
+
+    @staticmethod
+    def list_labs() -> list[dict]:
+        view = ServerContext._view()
+        active = view["context"].get("active_lab_hash")
+        return [
+            {
+                **{key: value for key, value in record.items() if key != "revision"},
+                "state": ServerContext._state_of(lab_hash, view),
+                "active": lab_hash == active,
+            }
+            for lab_hash, record in view["labs"].items()
+        ]
+
+    @staticmethod
+    def snapshot(lab_hash: str | None = None) -> dict:
+        """Consistent copy of the context of a lab (the active one by default)"""
+        view = ServerContext._view()
+        active = view["context"].get("active_lab_hash")
+        record = view["labs"].get(lab_hash or active or "")
+        transition = view["transition"]
+        return {
+            "state": ServerContext._state_of(lab_hash, view),
+            "lab_hash": record["lab_hash"] if record is not None else None,
+            "lab_name": record["lab_name"] if record is not None else None,
+            "lab_machines": record["lab_machines"] if record is not None else 0,
+            "ixpconf_filename": record["ixpconf_filename"] if record is not None else None,
+            "is_discovered": record["is_discovered"] if record is not None else None,
+            "current_job_id": view["context"].get("current_job_id"),
+            "transition": transition,
+            "active_lab_hash": active,
+            "labs": len(view["labs"]),
+            "wiping": sorted(view["wipes"]),
+            "discovering": ServerContext._discovering(view["context"].get("discovery")),
+        }
+
+    # ==================== LIFECYCLE ====================
+
+    @staticmethod
+    def _job_running(job_id: str | None) -> bool:
+        # I job di un worker terminato risultano falliti (RemoteJob)
+        job = get_job_registry().get(job_id) if job_id else None
+        return job is not None and not job.is_finished()
+
+    @staticmethod
+    def _live_transition(transition: dict | None) -> dict | None:
+        if transition is None or not ServerContext._job_running(transition["job_id"]):
+            return None
+        return transition
+
+    @staticmethod
+    def _transition_target(transition: dict) -> str | None:
+        if transition.get("lab_hash"):
+            return transition["lab_hash"]
+        job = get_job_registry().get(transition["job_id"])
+        return job.lab_hash if job is not None else None
+
+    @staticmethod
+    def _state_of(lab_hash: str | None, view: dict) -> str:
+        transition = view["transition"]
+        target = lab_hash or view["context"].get("active_lab_hash")
+        if transition is not None:
+            # Un build di start non ha ancora un hash: riguarda il lab "in arrivo"
+            transition_target = ServerContext._transition_target(transition)
+            if lab_hash is None or transition_target == target:
+                return transition["state"]
+        record = view["labs"].get(target or "")
+        if record is not None:
+            return record["state"]
+        # Lab non (ancora) noto: potrebbe essere trovato dalla discovery in corso
+        if ServerContext._discovering(view["context"].get("discovery")):
+            return LAB_DISCOVERING
+        if target in view["wipes"] or (lab_hash is None and view["wipes"]):
+            return LAB_WIPING
+        return LAB_IDLE
+
+    @staticmethod
+    def get_state(lab_hash: str | None = None) -> str:
+        return ServerContext._state_of(lab_hash, ServerContext._view())
+
+    @staticmethod
+    def set_state(state: str) -> None:
+        store = ServerContext._store()
+        with store.transaction():
+            transition = store.get(CONTEXT_NAMESPACE, "transition")
+            if transition is not None:
+                transition["state"] = state
+                store.put(CONTEXT_NAMESPACE, "transition", transition)
+
+    @staticmethod
+    def begin_transition(operation: str, key: str | None, state: str, job_factory,
+                         lab_hash: str | None = None) -> tuple[Job, bool]:
+        """
+        Atomically start a lifecycle operation (start build, reload, restore),
+        across all the workers.
+
+        - same operation with the same key already in progress: coalesced, its job is returned
+        - any other operation in progress raises LabTransitionConflict
+
+        Args:
+            operation: "start", "reload" or "restore"
+            key: What the operation works on (ixpconf filename, lab hash)
+            state: Lifecycle state while the operation runs
+            job_factory: Called (under lock) to create the job of a new operation
+            lab_hash: Lab the operation targets, if already known
+
+        Returns:
+            (job, coalesced)
+        """
+        store = ServerContext._store()
+        with ServerContext._lock, store.transaction():
+            current = ServerContext._live_transition(store.get(CONTEXT_NAMESPACE, "transition"))
+            if current is not None:
+                if current["operation"] == operation and current["key"] == key:
+                    return get_job_registry().get(current["job_id"]), True
+                raise LabTransitionConflict(operation, current)
+            wipe = store.get(WIPES_NAMESPACE, lab_hash) if lab_hash is not None else None
+            if wipe is not None and ServerContext._job_running(wipe["job_id"]) \
+                    and operation not in ("start", "restore"):
+                raise LabTransitionConflict(
+                    operation, {"operation": "wipe", "key": lab_hash, "state": LAB_WIPING}
+                )
+
+            job = job_factory()
+            store.put(CONTEXT_NAMESPACE, "transition", {
+                "operation": operation,
+                "key": key,
+                "lab_hash": lab_hash,
+                "job_id": job.id,
+                "state": state,
+                "started_at": time.time(),
+            })
+            store.put(CONTEXT_NAMESPACE, "current_job_id", job.id)
+
+        job.add_done_callback(ServerContext._end_transition)
+        return job, False
+
+    @staticmethod
+    def release_transition(job: Job) -> None:
+        """
+        End the transition of job before the job itself is over: used once a
+        start has built its lab, so other builds can run while it is deployed.
+        """
+        ServerContext._end_transition(job)
+
+    @staticmethod
+    def _end_transition(job: Job) -> None:
+        store = ServerContext._store()
+        with ServerContext._lock, store.transaction():
+            current = store.get(CONTEXT_NAMESPACE, "transition")
+            # Un'operazione successiva ha già preso il controllo
+            if current is None or current["job_id"] != job.id:
+                return
+            store.delete(CONTEXT_NAMESPACE, "transition")
+
+    @staticmethod
+    def begin_wipe(lab_hash: str, job_factory) -> tuple[Job, bool]:
+        """
+        Start (or join) the wipe of a lab: the operation in progress on that
+        lab, if any, is cancelled and the lab is forgotten right away.
+        Wipes do not block operations on other labs.
+
+        Returns:
+            (job, coalesced)
+        """
+        store = ServerContext._store()
+        to_cancel = []
+        with ServerContext._lock, store.transaction():
+            running = store.get(WIPES_NAMESPACE, lab_hash)
+            if running is not None and ServerContext._job_running(running["job_id"]):
+                return get_job_registry().get(running["job_id"]), True
+
+            current = ServerContext._live_transition(store.get(CONTEXT_NAMESPACE, "transition"))
+            if current is not None and ServerContext._transition_target(current) == lab_hash:
+                to_cancel.append(current["job_id"])
+            # Deploy del lab ancora in coda o in corso
+            record = store.get(LABS_NAMESPACE, lab_hash)
+            if record is not None and record.get("job_id"):
+                to_cancel.append(record["job_id"])
+
+            job = job_factory()
+            store.put(WIPES_NAMESPACE, lab_hash, {"job_id": job.id, "started_at": time.time()})
+            ServerContext.clear_lab_context(lab_hash)
+            store.put(CONTEXT_NAMESPACE, "current_job_id", job.id)
+
+        # Fuori dalla transazione: il job potrebbe essere in attesa dello store per pubblicare il suo stato
+        for job_id in to_cancel:
+            cancelled = get_job_registry().get(job_id)
+            if cancelled is not None:
+                cancelled.cancel()
+
+        def on_done(finished: Job):
+            with ServerContext._lock, store.transaction():
+                current_wipe = store.get(WIPES_NAMESPACE, lab_hash)
+                if current_wipe is not None and current_wipe["job_id"] == finished.id:
+                    store.delete(WIPES_NAMESPACE, lab_hash)
+
+        job.add_done_callback(on_done)
+        return job, False
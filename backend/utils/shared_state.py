@@ -0,0 +1,249 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from globals import BACKEND_STATE_FOLDER, get_backend_setting
+
+SHARED_STATE_FILE = os.path.join(BACKEND_STATE_FOLDER, "shared_state.db")
+
+# Attesa massima su un lock SQLite tenuto da un altro worker (millisecondi)
+BUSY_TIMEOUT_MS = 10000
+
+# Ogni quanto wait_for_change() controlla se un altro processo ha scritto
+_CHANGE_POLL_INTERVAL = 0.05
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS kv (
+    namespace TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    expires_at REAL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (namespace, key)
+);
+CREATE TABLE IF NOT EXISTS versions (
+    namespace TEXT PRIMARY KEY,
+    version INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS events (
+    stream TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    payload TEXT NOT NULL,
+    PRIMARY KEY (stream, seq)
+);
+"""
+
+
+def process_alive(pid: int | None) -> bool:
+    """Whether a process of this host is still running (the owner of a job, an admission, ...)"""
+    if not pid:
+        return False
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class SharedStateStore:
+    """
+    Key/value store shared by all the uvicorn workers of the host (SQLite in WAL mode).
+
+    Values are JSON documents grouped by namespace, optionally with a TTL.
+    Every write bumps the version of its namespace, so readers detect changes
+    with a single indexed lookup, and wait_for_change() only reads the table
+    when SQLite reports a commit from another connection (PRAGMA data_version).
+
+    Each thread of each process uses its own connection. transaction() takes
+    the SQLite write lock (BEGIN IMMEDIATE) for atomic read-modify-write across
+    workers; calls inside it join the outer transaction, so a read-only
+    transaction must not contain writes.
+    """
+
+    def __init__(self, path: str = SHARED_STATE_FILE):
+        self.path = path
+        self._local = threading.local()
+        self._schema_lock = threading.Lock()
+        self._schema_ready = False
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        # Dopo un fork la connessione del processo padre non è riutilizzabile
+        if connection is not None and self._local.pid == os.getpid():
+            return connection
+
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        connection = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT_MS / 1000, isolation_level=None)
+        connection.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        with self._schema_lock:
+            if not self._schema_ready:
+                connection.executescript(_SCHEMA)
+                self._schema_ready = True
+        self._local.connection = connection
+        self._local.pid = os.getpid()
+        self._local.depth = 0
+        return connection
+
+    @contextmanager
+    def transaction(self, write: bool = True):
+        """
+        Atomic block. write=True takes the write lock upfront (BEGIN IMMEDIATE),
+        write=False gives a consistent read snapshot of several keys.
+        """
+        connection = self._connection()
+        if self._local.depth:
+            self._local.depth += 1
+            try:
+                yield connection
+            finally:
+                self._local.depth -= 1
+            return
+
+        connection.execute("BEGIN IMMEDIATE" if write else "BEGIN")
+        self._local.depth = 1
+        try:
+            yield connection
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        else:
+            connection.execute("COMMIT")
+        finally:
+            self._local.depth = 0
+
+    @staticmethod
+    def _bump(connection: sqlite3.Connection, namespace: str) -> None:
+        connection.execute(
+            "INSERT INTO versions (namespace, version) VALUES (?, 1) "
+            "ON CONFLICT(namespace) DO UPDATE SET version = version + 1",
+            (namespace,),
+        )
+
+    # ==================== KEY/VALUE ====================
+
+    def get(self, namespace: str, key: str, default=None):
+        row = self._connection().execute(
+            "SELECT value FROM kv WHERE namespace = ? AND key = ? AND (expires_at IS NULL OR expires_at > ?)",
+            (namespace, key, time.time()),
+        ).fetchone()
+        return json.loads(row[0]) if row is not None else default
+
+    def items(self, namespace: str) -> dict:
+        rows = self._connection().execute(
+            "SELECT key, value FROM kv WHERE namespace = ? AND (expires_at IS NULL OR expires_at > ?)",
+            (namespace, time.time()),
+        ).fetchall()
+        return {key: json.loads(value) for key, value in rows}
+
+    def put(self, namespace: str, key: str, value, ttl: float | None = None) -> None:
+        now = time.time()
+        payload = json.dumps(value, default=str)
+        with self.transaction() as connection:
+            connection.execute(
+                "INSERT INTO kv (namespace, key, value, expires_at, updated_at) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(namespace, key) DO UPDATE SET "
+                "value = excluded.value, expires_at = excluded.expires_at, updated_at = excluded.updated_at",
+                (namespace, key, payload, now + ttl if ttl else None, now),
+            )
+            if ttl:
+                # Le voci scadute del namespace vengono rimosse a ogni scrittura con TTL
+                connection.execute(
+                    "DELETE FROM kv WHERE namespace = ? AND expires_at IS NOT NULL AND expires_at <= ?",
+                    (namespace, now),
+                )
+            self._bump(connection, namespace)
+
+    def delete(self, namespace: str, key: str) -> bool:
+        with self.transaction() as connection:
+            deleted = connection.execute(
+                "DELETE FROM kv WHERE namespace = ? AND key = ?", (namespace, key)
+            ).rowcount > 0
+            if deleted:
+                self._bump(connection, namespace)
+        return deleted
+
+    def clear(self, namespace: str) -> None:
+        with self.transaction() as connection:
+            connection.execute("DELETE FROM kv WHERE namespace = ?", (namespace,))
+            self._bump(connection, namespace)
+
+    # ==================== CHANGE NOTIFICATION ====================
+
+    def version(self, namespace: str) -> int:
+        row = self._connection().execute(
+            "SELECT version FROM versions WHERE namespace = ?", (namespace,)
+        ).fetchone()
+        return row[0] if row is not None else 0
+
+    def wait_for_change(self, namespace: str, since: int, timeout: float | None = None) -> int:
+        """
+        Block until the version of namespace is greater than since (or timeout).
+
+        Returns:
+            int: The current version of the namespace
+        """
+        connection = self._connection()
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        data_version = None
+        while True:
+            current_data_version = connection.execute("PRAGMA data_version").fetchone()[0]
+            if current_data_version != data_version:
+                data_version = current_data_version
+                version = self.version(namespace)
+                if version > since:
+                    return version
+            if deadline is not None and time.monotonic() >= deadline:
+                return self.version(namespace)
+            time.sleep(_CHANGE_POLL_INTERVAL)
+
+    # ==================== EVENT STREAMS ====================
+
+    def append_events(self, stream: str, events: list[dict], keep: int | None = None) -> None:
+        """Append events (with a "seq" field) to a stream, keeping only the last `keep`"""
+        if not events:
+            return
+        with self.transaction() as connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO events (stream, seq, payload) VALUES (?, ?, ?)",
+                [(stream, event["seq"], json.dumps(event, default=str)) for event in events],
+            )
+            if keep:
+                connection.execute(
+                    "DELETE FROM events WHERE stream = ? AND seq <= ?", (stream, events[-1]["seq"] - keep)
+                )
+
+    def events_since(self, stream: str, seq: int = 0) -> list[dict]:
+        rows = self._connection().execute(
+            "SELECT payload FROM events WHERE stream = ? AND seq >= ? ORDER BY seq", (stream, seq)
+        ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def delete_events(self, stream: str) -> None:
+        with self.transaction() as connection:
+            connection.execute("DELETE FROM events WHERE stream = ?", (stream,))
+
+
+# Singleton (la connessione viene aperta al primo uso, in ogni worker)
+_shared_state = None
+_shared_state_lock = threading.Lock()
+
+
+def get_shared_state() -> SharedStateStore:
+    global _shared_state
+    if _shared_state is None:
+        with _shared_state_lock:
+            if _shared_state is None:
+                path = get_backend_setting("shared_state_file", SHARED_STATE_FILE)
+                _shared_state = SharedStateStore(path)
+                logging.info(f"🗄️ Shared state store: {path}")
+    return _shared_state
@@ -0,0 +1,97 @@
+import logging
+import os
+import threading
+import time
+
+from utils.shared_state import get_shared_state, process_alive
+
+# Tempi di avvio di ogni worker, condivisi (utils/shared_state.py)
+STARTUP_NAMESPACE = "startup"
+
+_MODULE_LOADED_AT = time.time()
+
+
+def process_started_at() -> float:
+    """
+    Wall clock time at which this process started (from /proc, 10ms resolution),
+    or the first import of this module where /proc is not available
+    """
+    try:
+        with open("/proc/self/stat", "r") as f:
+            # Il nome del comando può contenere spazi: i campi vanno letti dopo ")"
+            fields = f.read().rsplit(")", 1)[1].split()
+        start_ticks = int(fields[19])
+        with open("/proc/uptime", "r") as f:
+            uptime = float(f.read().split()[0])
+        age = uptime - start_ticks / os.sysconf("SC_CLK_TCK")
+        return time.time() - max(age, 0.0)
+    except (OSError, ValueError, IndexError):
+        return _MODULE_LOADED_AT
+
+
+class StartupTimer:
+    """
+    Milestones of the backend startup, in seconds since the process started:
+    imports, startup hook, lab discovery and the first request served.
+    """
+
+    def __init__(self):
+        self.pid = os.getpid()
+        self.process_started_at = process_started_at()
+        self.marks = {}
+        self.first_request = None
+        self._lock = threading.Lock()
+
+    def _elapsed(self) -> float:
+        return round(time.time() - self.process_started_at, 3)
+
+    def mark(self, name: str) -> None:
+        """Record a milestone (only its first occurrence)"""
+        with self._lock:
+            if name in self.marks:
+                return
+            self.marks[name] = self._elapsed()
+        logging.info(f"⏱️ Startup: {name} after {self.marks[name]}s")
+        self._publish()
+
+    def request_served(self, path: str) -> None:
+        if self.first_request is not None:
+            return
+        with self._lock:
+            if self.first_request is not None:
+                return
+            self.first_request = {"path": path, "after_s": self._elapsed()}
+        logging.info(f"⏱️ Startup: first request ({path}) served after {self.first_request['after_s']}s")
+        self._publish()
+
+    def report(self) -> dict:
+        with self._lock:
+            return {
+                "pid": self.pid,
+                "process_started_at": round(self.process_started_at, 3),
+                "milestones": dict(self.marks),
+                "first_request": dict(self.first_request) if self.first_request else None,
+            }
+
+    def _publish(self) -> None:
+        try:
+            get_shared_state().put(STARTUP_NAMESPACE, str(self.pid), self.report())
+        except Exception as e:
+            logging.debug(f"Could not publish startup timings: {e}")
+
+
+def get_workers_startup() -> list[dict]:
+    """Startup timings of the running uvicorn workers"""
+    reports = get_shared_state().items(STARTUP_NAMESPACE).values()
+    return sorted(
+        (report for report in reports if process_alive(report["pid"])),
+        key=lambda report: report["process_started_at"],
+    )
+
+
+# Singleton
+_startup_timer = StartupTimer()
+
+
+def get_startup_timer():
+    return _startup_timer
@@ -0,0 +1,107 @@
+import logging
+import threading
+
+from globals import get_backend_setting
+from utils.docker_utils import get_lab_containers, run_on_containers
+from utils.lab_manifest import delete_lab_manifest
+from utils.warm_pool import get_warm_pool
+from utils.jobs import (
+    Job,
+    JobCancelledError,
+    get_job_registry,
+    job_phase,
+    JOB_COMPLETED,
+    JOB_FAILED,
+    JOB_CANCELLED,
+)
+
+# Container rimossi in parallelo (sovrascrivibile con "wipe_concurrency" in settings.json)
+DEFAULT_WIPE_CONCURRENCY = 16
+
+
+def remove_container(container) -> None:
+    """Same teardown as Kathara: shutdown scripts (if running), then forced removal"""
+    from Kathara.manager.docker.DockerMachine import SHUTDOWN_COMMANDS
+
+    if container.status == "running":
+        shutdown_commands = "; ".join(SHUTDOWN_COMMANDS).format(machine_name=container.labels["name"])
+        try:
+            container.exec_run(
+                [container.labels.get("shell", "/bin/bash"), "-c", shutdown_commands],
+                stdout=True, stderr=False, privileged=True, detach=False,
+            )
+        except Exception as e:
+            logging.debug(f"Shutdown commands failed on {container.name}: {e}")
+    container.remove(v=True, force=True)
+
+
+def remove_lab_networks(lab_hash: str) -> None:
+    """Once the containers are gone, Kathara removes only the lab networks (and any leftovers)"""
+    from Kathara.manager.Kathara import Kathara
+
+    Kathara.get_instance().undeploy_lab(lab_hash=lab_hash)
+
+
+def wipe_lab(lab_hash: str, job: Job | None = None) -> None:
+    """
+    Tear down only the lab identified by lab_hash: containers are removed in
+    parallel with bounded concurrency, then Kathara removes the lab networks
+    (and their external interfaces). With the warm pool enabled some containers
+    are parked instead (see utils/warm_pool.py), and the networks are kept.
+    """
+    concurrency = int(get_backend_setting("wipe_concurrency", DEFAULT_WIPE_CONCURRENCY))
+    containers = get_lab_containers(lab_hash)
+    logging.info(f"🧹 Wiping lab {lab_hash}: {len(containers)} containers (concurrency {concurrency})")
+
+    if job is not None:
+        job.set_devices_total(len(containers))
+
+    to_remove = get_warm_pool().park(lab_hash, containers, job)
+    with job_phase(job, "remove devices"):
+        failures = run_on_containers(to_remove, remove_container, job, max_workers=concurrency)
+        if failures:
+            logging.warning(f"Could not remove {len(failures)} containers of lab {lab_hash}: {failures}")
+
+    if len(to_remove) == len(containers):
+        with job_phase(job, "remove networks"):
+            remove_lab_networks(lab_hash)
+    delete_lab_manifest(lab_hash)
+
+    logging.info(f"🧹 Lab {lab_hash} wiped")
+
+
+def start_wipe_job(lab_hash: str) -> Job:
+    """
+    Wipe the lab in a background thread, tracked as a "wipe" job.
+    A running wipe of the same lab is reused instead of starting a new one.
+    """
+    active = get_active_wipe(lab_hash)
+    if active is not None:
+        return active
+
+    job = get_job_registry().create("wipe", lab_hash=lab_hash)
+    job.start()
+
+    def do_wipe():
+        try:
+            wipe_lab(lab_hash, job)
+            if job.failures:
+                job.finish(JOB_FAILED, error=f"{len(job.failures)} devices could not be removed")
+            else:
+                job.finish(JOB_COMPLETED)
+        except JobCancelledError:
+            job.finish(JOB_CANCELLED)
+        except Exception as e:
+            logging.error(f"Error during wipe of lab {lab_hash}: {e}")
+            job.add_failure(None, str(e))
+            job.finish(JOB_FAILED, error=str(e))
+
+    threading.Thread(target=do_wipe, daemon=True).start()
+    return job
+
+
+def get_active_wipe(lab_hash: str) -> Job | None:
+    for job in get_job_registry().get_active("wipe"):
+        if job.lab_hash == lab_hash:
+            return job
+    return None
@@ -0,0 +1,254 @@
+import logging
+import time
+
+from globals import get_backend_setting
+from utils.config_hash import load_config_hashes, compute_structure_hashes
+from utils.docker_utils import get_lab_containers, run_on_containers
+from utils.jobs import Job, job_phase
+from utils.shared_state import get_shared_state
+
+# Default del pool (sovrascrivibili in settings.json): 0 = pool disattivato
+DEFAULT_WARM_POOL_SIZE = 0
+
+# Container parcheggiati per lab e statistiche, condivisi tra i worker (utils/shared_state.py)
+WARM_POOL_NAMESPACE = "warm_pool"
+WARM_POOL_STATS_NAMESPACE = "warm_pool_stats"
+
+# Container fermati/rimossi/ripresi in parallelo
+MAX_POOL_WORKERS = 32
+STOP_TIMEOUT = 5
+
+
+def get_warm_pool_size() -> int:
+    return max(0, int(get_backend_setting("warm_pool_size", DEFAULT_WARM_POOL_SIZE)))
+
+
+def _device_create_seconds() -> float | None:
+    """Seconds a device took to be created in the last deploys (see utils/deploy_waves.py)"""
+    from utils.deploy_waves import get_deploy_reports
+
+    waves = [
+        wave for report in get_deploy_reports()[:5] for wave in report["waves"] if wave["kind"] == "members"
+    ]
+    devices = sum(wave["size"] for wave in waves)
+    return sum(wave["duration_s"] for wave in waves) / devices if devices else None
+
+
+class WarmPool:
+    """
+    Pool of parked member containers, claimed by the next deploy of the same lab.
+
+    Kathara creates the containers of a lab itself and identifies them by
+    labels (lab hash, device name) that Docker cannot change after creation,
+    so generic pre-created containers could never become lab devices. The
+    pool is filled instead when a lab is torn down: up to `warm_pool_size`
+    containers are stopped rather than removed, keeping filesystem and
+    networks. When the lab is deployed again, a parked device whose image
+    and interfaces are unchanged (structure hash) gets the new machine files
+    and is restarted, the others are removed and created by Kathara.
+    """
+
+    # ==================== PARKING ====================
+
+    def park(self, lab_hash: str, containers: list, job: Job | None = None) -> list:
+        """
+        Park the containers of a lab being wiped, within the free pool capacity.
+
+        Returns:
+            list: The containers that were not parked (to be removed)
+        """
+        size = get_warm_pool_size()
+        hashes = load_config_hashes(lab_hash) or {}
+        structure = hashes.get("structure") or {}
+        if not size or not structure:
+            return containers
+
+        self._evict(size - len(containers), exclude=lab_hash)
+        free = size - self._parked_devices(exclude=lab_hash)
+        candidates = [c for c in containers if structure.get(c.labels.get("name"))][:max(free, 0)]
+        if not candidates:
+            return containers
+
+        with job_phase(job, "park devices"):
+            failures = run_on_containers(
+                candidates, lambda container: container.stop(timeout=STOP_TIMEOUT), max_workers=MAX_POOL_WORKERS
+            )
+        parked = [c for c in candidates if c.labels.get("name") not in failures]
+        if job is not None:
+            for container in parked:
+                job.device_completed(container.labels["name"])
+        get_shared_state().put(WARM_POOL_NAMESPACE, lab_hash, {
+            "lab_hash": lab_hash,
+            "parked_at": time.time(),
+            "devices": {
+                c.labels["name"]: {"container_id": c.id, "structure_hash": structure[c.labels["name"]]}
+                for c in parked
+            },
+        })
+        self._add_stats(parked=len(parked))
+        logging.info(f"🅿️ Parked {len(parked)} containers of lab {lab_hash} in the warm pool")
+        parked_ids = {c.id for c in parked}
+        return [c for c in containers if c.id not in parked_ids]
+
+    def _parked_devices(self, exclude: str | None = None) -> int:
+        return sum(
+            len(entry["devices"]) for lab_hash, entry in get_shared_state().items(WARM_POOL_NAMESPACE).items()
+            if lab_hash != exclude
+        )
+
+    def _evict(self, capacity: int, exclude: str | None = None) -> None:
+        """Drain the oldest parked labs until at most capacity devices are parked"""
+        entries = sorted(
+            (entry for lab_hash, entry in get_shared_state().items(WARM_POOL_NAMESPACE).items() if lab_hash != exclude),
+            key=lambda entry: entry["parked_at"],
+        )
+        parked = sum(len(entry["devices"]) for entry in entries)
+        for entry in entries:
+            if parked <= max(capacity, 0):
+                break
+            self.drain(entry["lab_hash"])
+            parked -= len(entry["devices"])
+
+    def drain(self, lab_hash: str | None = None) -> int:
+        """
+        Remove the parked containers (and the networks) of a lab, or of all the parked labs.
+
+        Returns:
+            int: Number of containers removed
+        """
+        from utils.teardown import remove_lab_networks, remove_container
+
+        store = get_shared_state()
+        lab_hashes = [lab_hash] if lab_hash else list(store.items(WARM_POOL_NAMESPACE))
+        removed = 0
+        for parked_hash in lab_hashes:
+            if not store.delete(WARM_POOL_NAMESPACE, parked_hash):
+                continue
+            containers = get_lab_containers(parked_hash)
+            failures = run_on_containers(containers, remove_container, max_workers=MAX_POOL_WORKERS)
+            removed += len(containers) - len(failures)
+            remove_lab_networks(parked_hash)
+            logging.info(f"🅿️ Warm pool of lab {parked_hash} drained ({len(containers)} containers)")
+        return removed
+
+    # ==================== CLAIM ====================
+
+    def has_parked(self, lab_hash: str) -> bool:
+        return get_shared_state().get(WARM_POOL_NAMESPACE, lab_hash) is not None
+
+    def claim(self, lab, job: Job | None = None) -> set[str]:
+        """
+        Reuse the parked containers of lab: unchanged devices get the new machine
+        files (configurations, startup) and are restarted, the other containers
+        of the lab are removed. Kathara deploys the devices not returned.
+
+        Returns:
+            set: Names of the devices claimed from the pool
+        """
+        from Kathara.manager.docker.DockerMachine import STARTUP_COMMANDS
+        from utils.checkpoint import exec_commands_of
+        from utils.teardown import remove_container
+
+        store = get_shared_state()
+        with store.transaction():
+            entry = store.get(WARM_POOL_NAMESPACE, lab.hash)
+            if entry is not None:
+                store.delete(WARM_POOL_NAMESPACE, lab.hash)
+        if entry is None:
+            return set()
+
+        started = time.perf_counter()
+        structure = compute_structure_hashes(lab)
+        containers = {c.labels.get("name"): c for c in get_lab_containers(lab.hash)}
+        claimable = {
+            name: containers[name] for name, parked in entry["devices"].items()
+            if name in containers and containers[name].id == parked["container_id"]
+            and structure.get(name) == parked["structure_hash"]
+        }
+
+        def resume(container):
+            machine = lab.machines[container.labels["name"]]
+            shell = container.labels.get("shell", "/bin/bash")
+            container.start()
+            # pack_data scrive solo sotto /hostlab: prima si tolgono i file del deploy precedente,
+            # così un file rimosso dal nuovo lab non resta nel container
+            container.exec_run(
+                [shell, "-c", f"rm -rf /hostlab/{machine.name} /hostlab/{machine.name}.startup /hostlab/shared.startup"]
+            )
+            data = machine.pack_data()
+            if data:
+                container.put_archive("/", data)
+            # Stessi comandi di avvio di Kathara: copia /hostlab/<device> in /, permessi di /etc/frr,
+            # startup ed exec commands, così i demoni partono con le configurazioni del nuovo lab
+            command = "; ".join(STARTUP_COMMANDS).format(
+                machine_name=machine.name, machine_commands=exec_commands_of(machine)
+            )
+            container.exec_run([shell, "-c", command], privileged=True, detach=True)
+
+        with job_phase(job, "claim warm pool"):
+            stale = [c for name, c in containers.items() if name not in claimable]
+            run_on_containers(stale, remove_container, max_workers=MAX_POOL_WORKERS)
+            failures = run_on_containers(list(claimable.values()), resume, job, max_workers=MAX_POOL_WORKERS)
+            if failures:
+                logging.warning(f"Could not reuse {len(failures)} parked containers, recreating them: {failures}")
+                run_on_containers(
+                    [claimable[name] for name in failures], remove_container, max_workers=MAX_POOL_WORKERS
+                )
+
+        claimed = set(claimable) - set(failures)
+        claim_s = time.perf_counter() - started
+        logging.info(
+            f"🅿️ Claimed {len(claimed)} parked devices of lab {lab.hash} in {round(claim_s, 2)}s, "
+            f"{len(lab.machines) - len(claimed)} to create"
+        )
+        if job is not None:
+            job.emit("warm_pool_claim", claimed=len(claimed), created=len(lab.machines) - len(claimed),
+                     duration_s=round(claim_s, 2))
+        self.record_deploy(len(claimed), len(lab.machines) - len(claimed), claim_s)
+        return claimed
+
+    # ==================== STATS ====================
+
+    def record_deploy(self, claimed: int, created: int, claim_s: float = 0.0) -> None:
+        """Count devices served by the pool (hits) or created by Kathara (misses) in a deploy"""
+        per_device = _device_create_seconds()
+        saved = max(claimed * per_device - claim_s, 0.0) if per_device is not None and claimed else 0.0
+        self._add_stats(hits=claimed, misses=created, saved_s=saved)
+
+    @staticmethod
+    def _add_stats(**increments) -> None:
+        store = get_shared_state()
+        with store.transaction():
+            stats = store.get(WARM_POOL_STATS_NAMESPACE, "totals") or {}
+            for name, value in increments.items():
+                stats[name] = stats.get(name, 0) + value
+            store.put(WARM_POOL_STATS_NAMESPACE, "totals", stats)
+
+    def status(self) -> dict:
+        store = get_shared_state()
+        stats = store.get(WARM_POOL_STATS_NAMESPACE, "totals") or {}
+        hits, misses = stats.get("hits", 0), stats.get("misses", 0)
+        entries = store.items(WARM_POOL_NAMESPACE).values()
+        return {
+            "size": get_warm_pool_size(),
+            "parked": [
+                {"lab_hash": entry["lab_hash"], "parked_at": entry["parked_at"], "devices": len(entry["devices"])}
+                for entry in entries
+            ],
+            "parked_devices": sum(len(entry["devices"]) for entry in entries),
+            "stats": {
+                "parked": stats.get("parked", 0),
+                "hits": hits,
+                "misses": misses,
+                "hit_rate": round(hits / (hits + misses), 3) if hits + misses else None,
+                "saved_s": round(stats.get("saved_s", 0.0), 1),
+            },
+        }
+
+
+# Singleton
+_warm_pool = WarmPool()
+
+
+def get_warm_pool():
+    return _warm_pool